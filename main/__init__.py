@@ -5,7 +5,6 @@ from flask import Flask
 from flask_login import LoginManager
 from flask_mail import Mail
 from flask_moment import Moment
-from flask_msearch import Search
 from flask_sqlalchemy import SQLAlchemy
 
 app = Flask(__name__)
@@ -15,6 +14,34 @@ app.config['SECRET_KEY'] = 'b4f576c819524c45fa389ced800edafb'
 app.config['JSON_AS_ASCII'] = False
 app.config['UPLOAD_FOLDER'] = path.join(app.root_path, 'static', 'uploads')
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024
+app.config['UPLOAD_PART_FOLDER'] = path.join(app.root_path, 'upload-parts')
+app.config['UPLOAD_CHUNK_SIZE'] = 8 * 1024 * 1024
+app.config['UPLOAD_EXPIRY_HOURS'] = 24
+app.config['BLOB_FOLDER'] = path.join(app.root_path, 'blobs')
+# 由前端代理伺服器傳送附件：nginx 設定 internal location 對應 BLOB_FOLDER 後填入其路徑（例如 '/protected-blobs'），
+# Apache 等支援 X-Sendfile 的伺服器則將 USE_X_SENDFILE 設為 True
+app.config['ATTACHMENT_ACCEL_PREFIX'] = None
+app.config['USE_X_SENDFILE'] = False
+app.config['MEETINGS_PER_PAGE'] = 30
+app.config['TEMPLATE_CACHE_TTL'] = 60
+app.config['USER_CACHE_SIZE'] = 1024
+app.config['USER_CACHE_TTL'] = 30
+app.config['PEOPLE_DIRECTORY_TTL'] = 300
+app.config['PEOPLE_SUGGEST_LIMIT'] = 20
+app.config['SEARCH_INDEX_PATH'] = path.join(app.root_path, 'search-index.sqlite3')
+app.config['SEARCH_RESULTS_PER_PAGE'] = 20
+app.config['SEARCH_INDEX_INTERVAL'] = 2
+app.config['SEARCH_INDEX_BATCH_SIZE'] = 500
+app.config['RENDER_CACHE_SIZE'] = 128
+app.config['SNAPSHOT_FOLDER'] = path.join(app.root_path, 'snapshots')
+app.config['PREVIEW_FOLDER'] = path.join(app.root_path, 'previews')
+app.config['PREVIEW_QUEUE_PATH'] = path.join(app.root_path, 'preview-queue.sqlite3')
+app.config['PREVIEW_WORKERS'] = 2
+app.config['PREVIEW_THUMBNAIL_SIZE'] = 320
+app.config['PREVIEW_TEXT_LIMIT'] = 100000
+app.config['PREVIEW_MAX_FILE_SIZE'] = 64 * 1024 * 1024
+app.config['PREVIEW_MAX_ATTEMPTS'] = 3
+app.config['PREVIEW_QUEUE_INTERVAL'] = 5
 
 # Flask-Mail configurations
 app.config['MAIL_SERVER'] = 'smtp.gmail.com'
@@ -24,14 +51,23 @@ app.config['MAIL_DEBUG'] = False
 app.config['TESTING'] = False
 app.config['MAIL_USERNAME'] = '110.database.csie.nuk@gmail.com'
 app.config['MAIL_PASSWORD'] = 'mrietnakkcaduuwb'
+app.config['MAIL_QUEUE_PATH'] = path.join(app.root_path, 'mail-queue.sqlite3')
+app.config['MAIL_WORKERS'] = 2
+app.config['MAIL_BATCH_SIZE'] = 50
+app.config['MAIL_MAX_ATTEMPTS'] = 5
+app.config['MAIL_RETRY_DELAY'] = 30
+app.config['MAIL_QUEUE_INTERVAL'] = 5
 
-# Create upload folder if it doesn't exist
+# Create upload, snapshot and preview folders if they don't exist
 Path(app.config['UPLOAD_FOLDER']).mkdir(parents=True, exist_ok=True)
+Path(app.config['UPLOAD_PART_FOLDER']).mkdir(parents=True, exist_ok=True)
+Path(app.config['BLOB_FOLDER']).mkdir(parents=True, exist_ok=True)
+Path(app.config['SNAPSHOT_FOLDER']).mkdir(parents=True, exist_ok=True)
+Path(app.config['PREVIEW_FOLDER']).mkdir(parents=True, exist_ok=True)
 
 db = SQLAlchemy(app)
 login = LoginManager(app)
 moment = Moment(app)
 mail = Mail(app)
-search = Search(app)
 
-from main import views, models
+from main import views, models, benchmarks
@@ -0,0 +1,362 @@
+import hashlib
+import os
+import zipfile
+from collections import Counter
+from datetime import datetime
+
+import click
+from flask import request, send_file
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from werkzeug.utils import send_file as werkzeug_send_file
+
+from main import app, db
+from main.models import Attachment, Blob
+
+READ_SIZE = 64 * 1024
+# 本身已壓縮的格式在 ZIP 中直接存放，不再壓縮
+STORED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif', 'pdf', 'zip', 'rar', '7z', 'gz', 'mp3', 'mp4', 'mov',
+                     'docx', 'xlsx', 'pptx', 'odt', 'ods', 'odp'}
+
+
+def blob_path(sha256):
+    """
+    以內容雜湊值分層存放的檔案路徑，例如 BLOB_FOLDER/ab/cd/abcd...
+    :param sha256: 檔案內容的 SHA-256（十六進位）
+    :return: 檔案路徑
+    """
+    return os.path.join(app.config['BLOB_FOLDER'], sha256[:2], sha256[2:4], sha256)
+
+
+def file_sha256(file_path):
+    hasher = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(READ_SIZE), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def known_blob(sha256, size):
+    """
+    檢查內容是否已存放於檔案庫，已存在時上傳不需再傳送內容
+    :param sha256: 檔案內容的 SHA-256
+    :param size: 檔案大小
+    :return: 是否已存在
+    """
+    blob = Blob.query.get(sha256)
+    return blob is not None and blob.size == size and os.path.exists(blob_path(sha256))
+
+
+def store_file(file_path, sha256):
+    """
+    登記要移入檔案庫的檔案，內容相同的檔案只存放一份；檔案於 flush 鎖定內容資料列後才移入，
+    檔案庫已有相同內容時，多餘的檔案等交易提交後才刪除
+    :param file_path: 檔案路徑（交易提交後即不存在），None 表示內容已在檔案庫中
+    :param sha256: 檔案內容的 SHA-256
+    :return: 檔案庫中的路徑
+    """
+    if file_path is not None:
+        db.session.info.setdefault('blob_incoming', {}).setdefault(sha256, []).append(file_path)
+    return blob_path(sha256)
+
+
+def new_attachment(meeting, name, sha256):
+    """
+    建立指向檔案庫內容的會議附件，參照數於 flush 時更新
+    :param meeting: 會議（需已有編號）
+    :param name: 附件名稱
+    :param sha256: 檔案內容的 SHA-256
+    :return: Attachment
+    """
+    # secure_filename() does not allow Chinese characters
+    attachment = Attachment(str(meeting.id) + '-' + name, blob_path(sha256))
+    attachment.sha256 = sha256
+    meeting.attachments.append(attachment)
+    return attachment
+
+
+def send_attachment(file_path, sha256, download_name):
+    """
+    傳送附件檔案：以內容雜湊值為強 ETag（舊式附件依檔案資訊產生），支援條件請求（304）與 Range 部分下載；
+    設定 ATTACHMENT_ACCEL_PREFIX 時只回傳標頭，由前端代理伺服器依 X-Accel-Redirect 傳送檔案內容
+    :param file_path: 檔案路徑
+    :param sha256: 檔案內容的 SHA-256，舊式附件為 None
+    :param download_name: 下載檔名
+    :return: Response
+    :raise FileNotFoundError: 檔案不存在
+    """
+    if sha256 and app.config['ATTACHMENT_ACCEL_PREFIX']:
+        response = werkzeug_send_file(file_path, request.environ, download_name=download_name, etag=sha256,
+                                      use_x_sendfile=True, response_class=app.response_class)
+        del response.headers['X-Sendfile']
+        response.headers['X-Accel-Redirect'] = '/'.join([app.config['ATTACHMENT_ACCEL_PREFIX'].rstrip('/'),
+                                                         sha256[:2], sha256[2:4], sha256])
+    else:
+        response = send_file(file_path, download_name=download_name, etag=sha256 or True)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+class _ZipStream:
+    """
+    只能附加寫入的緩衝區，zipfile 無法 seek 時會改用 data descriptor，寫入的內容每段取出後即清空
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    @property
+    def pending(self):
+        return bool(self._chunks)
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def archive_names(filenames):
+    """
+    還原附件的原始檔名（去除「<會議編號>-」前綴），重複的檔名加上序號
+    :param filenames: Attachment.filename 列表
+    :return: ZIP 中的檔名列表
+    """
+    names = []
+    used = set()
+    for filename in filenames:
+        name = filename.split('-', 1)[1]
+        stem, dot, extension = name.rpartition('.')
+        if not dot:
+            stem, extension = name, ''
+        number = 1
+        while name in used:
+            number += 1
+            name = f'{stem} ({number}){dot}{extension}'
+        used.add(name)
+        names.append(name)
+    return names
+
+
+def stream_zip(files):
+    """
+    邊讀取檔案邊產生 ZIP 內容，不建立暫存檔，記憶體用量只與 READ_SIZE 有關
+    :param files: [(ZIP 中的檔名, 檔案路徑)]，找不到的檔案略過
+    :return: 產生 ZIP 內容的 generator
+    """
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, 'w') as archive:
+        for name, file_path in files:
+            try:
+                file = open(file_path, 'rb')
+            except FileNotFoundError:
+                app.logger.warning('Attachment file not found: %s', file_path)
+                continue
+            with file:
+                stat = os.fstat(file.fileno())
+                info = zipfile.ZipInfo(name, datetime.fromtimestamp(stat.st_mtime).timetuple()[:6])
+                info.file_size = stat.st_size
+                info.compress_type = zipfile.ZIP_STORED \
+                    if name.rpartition('.')[2].lower() in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+                with archive.open(info, 'w') as entry:
+                    for block in iter(lambda: file.read(READ_SIZE), b''):
+                        entry.write(block)
+                        if stream.pending:
+                            yield stream.pop()
+            yield stream.pop()
+    yield stream.pop()
+
+
+def _reference_changes(session):
+    """
+    統計此次 flush 中各內容參照數的變化，並找出要刪除檔案的舊式附件（未存放於檔案庫）
+    :param session: SQLAlchemy Session
+    :return: (Counter {SHA-256: 參照數變化}, 舊式附件檔案路徑列表)
+    """
+    changes = Counter()
+    legacy_paths = []
+    for obj in session.new:
+        if isinstance(obj, Attachment) and obj.sha256:
+            changes[obj.sha256] += 1
+    for obj in session.dirty:
+        if isinstance(obj, Attachment):
+            history = inspect(obj).attrs.sha256.history
+            changes.update(sha256 for sha256 in history.added or () if sha256)
+            changes.subtract(sha256 for sha256 in history.deleted or () if sha256)
+    for obj in session.deleted:
+        if isinstance(obj, Attachment):
+            if obj.sha256:
+                changes[obj.sha256] -= 1
+            else:
+                legacy_paths.append(obj.file_path)
+    return Counter({sha256: count for sha256, count in changes.items() if count}), legacy_paths
+
+
+def _add_references(connection, sha256, count, size):
+    """
+    增加內容的參照數，內容資料列不存在時新增；執行後此交易即鎖定該資料列
+    """
+    table = Blob.__table__
+    if connection.dialect.name == 'mysql':
+        connection.execute(mysql_insert(table).values(sha256=sha256, size=size, ref_count=count)
+                           .on_duplicate_key_update(ref_count=table.c.ref_count + count))
+        return
+    result = connection.execute(table.update().where(table.c.sha256 == sha256)
+                                .values(ref_count=table.c.ref_count + count))
+    if result.rowcount == 0:
+        connection.execute(table.insert().values(sha256=sha256, size=size, ref_count=count))
+
+
+def _place_incoming(session, sha256):
+    """
+    在已鎖定內容資料列的情況下放置登記的檔案：檔案庫中沒有此內容時移入，已有時待交易提交後刪除
+    """
+    incoming = session.info.get('blob_incoming', {}).pop(sha256, None)
+    if not incoming:
+        return
+    incoming, *duplicates = incoming
+    removed = session.info.setdefault('attachment_removed', [])
+    removed.extend(duplicates)
+    stored_path = blob_path(sha256)
+    if os.path.exists(stored_path):
+        removed.append(incoming)
+    else:
+        os.makedirs(os.path.dirname(stored_path), exist_ok=True)
+        os.replace(incoming, stored_path)
+        session.info.setdefault('blob_placed', {})[sha256] = incoming
+
+
+@event.listens_for(db.session, 'after_flush')
+def update_references(session, flush_context):
+    """
+    附件新增或刪除時，在同一交易內更新內容的參照數；參照數歸零的內容於交易提交後刪除檔案
+    """
+    changes, legacy_paths = _reference_changes(session)
+    session.info.setdefault('attachment_removed', []).extend(legacy_paths)
+    if not changes:
+        return
+
+    table = Blob.__table__
+    connection = session.connection()
+    incoming = session.info.get('blob_incoming', {})
+    for sha256, count in sorted(changes.items()):
+        if count > 0:
+            size = os.path.getsize(incoming[sha256][0] if incoming.get(sha256) else blob_path(sha256))
+            _add_references(connection, sha256, count, size)
+            _place_incoming(session, sha256)
+        else:
+            connection.execute(table.update().where(table.c.sha256 == sha256)
+                               .values(ref_count=table.c.ref_count + count))
+
+    released = [sha256 for sha256, count in changes.items() if count < 0]
+    unreferenced = connection.execute(select(table.c.sha256).where(table.c.sha256.in_(released),
+                                                                   table.c.ref_count <= 0).with_for_update()) \
+        .scalars().all()
+    if unreferenced:
+        connection.execute(table.delete().where(table.c.sha256.in_(unreferenced)))
+        session.info.setdefault('blob_released', set()).update(unreferenced)
+
+
+def _release_blob(engine, sha256, restore_path=None):
+    """
+    鎖定內容資料列後再次確認內容已無參照才刪除檔案，避免刪除其他交易剛參照的內容
+    :param engine: 資料庫引擎
+    :param sha256: 檔案內容的 SHA-256
+    :param restore_path: 不為 None 時將檔案移回此路徑而不刪除
+    """
+    table = Blob.__table__
+    with engine.begin() as connection:
+        if connection.execute(select(table.c.sha256).where(table.c.sha256 == sha256).with_for_update()).first():
+            return
+        try:
+            if restore_path:
+                os.replace(blob_path(sha256), restore_path)
+            else:
+                os.remove(blob_path(sha256))
+        except FileNotFoundError:
+            app.logger.warning('Attachment file not found: %s', blob_path(sha256))
+
+
+@event.listens_for(db.session, 'after_commit')
+def remove_unreferenced(session):
+    session.info.pop('blob_placed', None)
+    removed = session.info.pop('attachment_removed', [])
+    # 登記後沒有被參照（例如同一交易內又刪除附件）的檔案也一併刪除
+    for file_paths in session.info.pop('blob_incoming', {}).values():
+        removed.extend(file_paths)
+    for file_path in removed:
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            app.logger.warning('Attachment file not found: %s', file_path)
+    for sha256 in sorted(session.info.pop('blob_released', ())):
+        _release_blob(session.get_bind(), sha256)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_removed(session):
+    """
+    交易取消時保留所有檔案；此交易移入檔案庫的內容若沒有其他參照，則移回原來的路徑
+    """
+    session.info.pop('attachment_removed', None)
+    session.info.pop('blob_released', None)
+    session.info.pop('blob_incoming', None)
+    for sha256, incoming in session.info.pop('blob_placed', {}).items():
+        _release_blob(session.get_bind(), sha256, restore_path=incoming)
+
+
+def migrate_legacy_attachments():
+    """
+    將舊式附件（UPLOAD_FOLDER/<會議編號>-<檔名>）移入檔案庫
+    :return: (移入的附件數, 找不到檔案的附件數)
+    """
+    migrated = 0
+    missing = 0
+    for attachment in Attachment.query.filter(Attachment.sha256.is_(None)).all():
+        if not os.path.exists(attachment.file_path):
+            missing += 1
+            continue
+        sha256 = file_sha256(attachment.file_path)
+        attachment.file_path = store_file(attachment.file_path, sha256)
+        attachment.sha256 = sha256
+        migrated += 1
+        db.session.flush()
+    db.session.commit()
+    return migrated, missing
+
+
+def verify_references():
+    """
+    比對內容參照數與附件資料表
+    :return: 不一致項目列表 [(SHA-256, 記錄的參照數, 實際參照數)]
+    """
+    recorded = {blob.sha256: blob.ref_count for blob in Blob.query}
+    actual = dict(db.session.query(Attachment.sha256, func.count(Attachment.id))
+                  .filter(Attachment.sha256.isnot(None)).group_by(Attachment.sha256))
+    return [(sha256, recorded.get(sha256, 0), actual.get(sha256, 0))
+            for sha256 in sorted(recorded.keys() | actual.keys()) if recorded.get(sha256, 0) != actual.get(sha256, 0)]
+
+
+@app.cli.command('attachment-store')
+@click.option('--migrate', is_flag=True, help='將舊式附件移入檔案庫')
+def attachment_store_command(migrate):
+    """
+    將舊式附件移入檔案庫並比對內容參照數
+    """
+    if migrate:
+        migrated, missing = migrate_legacy_attachments()
+        click.echo(f'已移入 {migrated} 個附件，{missing} 個附件找不到檔案')
+
+    mismatches = verify_references()
+    for sha256, recorded, actual in mismatches:
+        click.echo(f'{sha256}：記錄 {recorded}，實際 {actual}')
+    if mismatches:
+        raise click.ClickException(f'內容參照數有 {len(mismatches)} 筆不一致')
+    click.echo('內容參照數與附件資料表一致')
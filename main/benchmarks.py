@@ -0,0 +1,312 @@
+import json
+import os
+import random
+import tempfile
+from contextlib import closing, contextmanager
+from datetime import datetime, timedelta
+from statistics import median
+from time import perf_counter
+
+import click
+from sqlalchemy import and_, event, extract, or_
+
+from main import app, db, search, statistics, visibility
+from main.models import Announcement, Attachment, Attendee, Extempore, Feedback, GenderType, Meeting, MeetingType, \
+    MeetingVisibility, Motion, MotionStatusType, Person, PersonType
+from main.views import paginate_meetings
+
+# 以 (會議編號, 編號) 為主鍵的資料表，SQLite 不支援複合主鍵的自動編號，產生資料時直接指定編號
+COMPOSITE_KEY_MODELS = (Announcement, Attachment, Extempore, Motion)
+
+
+@contextmanager
+def benchmark_database(database_url):
+    """
+    暫時改用另一個資料庫並建立資料表，結束後刪除資料表並恢復原本的設定
+    :param database_url: 資料庫網址，None 表示暫存目錄中的 SQLite 檔案
+    """
+    original_url = app.config['SQLALCHEMY_DATABASE_URI']
+    with tempfile.TemporaryDirectory() as folder:
+        app.config['SQLALCHEMY_DATABASE_URI'] = database_url or f'sqlite:///{os.path.join(folder, "benchmark.db")}'
+        try:
+            db.session.remove()
+            if db.get_engine().dialect.name == 'sqlite':
+                for model in COMPOSITE_KEY_MODELS:
+                    model.__table__.c.id.autoincrement = False
+            db.drop_all()
+            db.create_all()
+            yield
+        finally:
+            db.session.remove()
+            db.drop_all()
+            db.get_engine().dispose()
+            app.config['SQLALCHEMY_DATABASE_URI'] = original_url
+
+
+def seed_meetings(meetings, people=200, attendees=0, motions=2, end=None, years=10, chunk_size=10000):
+    """
+    以批次 INSERT 產生測試資料（不經過 ORM，寫入時維護的索引與統計摘要需另外重建）
+    :param meetings: 會議數
+    :param people: 人員數
+    :param attendees: 每場會議的與會人員數
+    :param motions: 每場會議的討論事項數
+    :param end: 最晚的會議時間，預設為現在
+    :param years: 會議時間分布的年數
+    :param chunk_size: 每次 INSERT 的資料列數
+    """
+    rng = random.Random(0)
+    end = end or datetime.utcnow()
+    span = int(timedelta(days=365 * years).total_seconds())
+    connection = db.session.connection()
+
+    connection.execute(Person.__table__.insert(), [
+        {'id': person_id, 'name': f'人員{person_id}', 'gender': GenderType.Male, 'phone': '0912345678',
+         'email': f'person{person_id}@example.com', 'password': 'password', 'type': PersonType.DeptProf}
+        for person_id in range(1, people + 1)])
+
+    motion_id = 0
+    for first in range(1, meetings + 1, chunk_size):
+        meeting_rows, attendee_rows, motion_rows = [], [], []
+        for meeting_id in range(first, min(first + chunk_size, meetings + 1)):
+            chair_id, minute_taker_id, *attendee_ids = rng.sample(range(1, people + 1), attendees + 2)
+            meeting_rows.append({'id': meeting_id, 'title': f'會議{meeting_id}', 'type': rng.choice(list(MeetingType)),
+                                 'time': end - timedelta(seconds=rng.randrange(span)), 'location': '會議室',
+                                 'archived': False, 'version': 1, 'chair_id': chair_id,
+                                 'minute_taker_id': minute_taker_id, 'chair_confirmed': False})
+            attendee_rows.extend({'meeting_id': meeting_id, 'person_id': person_id, 'is_present': True,
+                                  'is_confirmed': False, 'is_member': True, 'version': 1}
+                                 for person_id in attendee_ids)
+            for _ in range(motions):
+                motion_id += 1
+                motion_rows.append({'id': motion_id, 'meeting_id': meeting_id, 'description': '案由',
+                                    'status': rng.choice(list(MotionStatusType)), 'version': 1})
+        connection.execute(Meeting.__table__.insert(), meeting_rows)
+        if attendee_rows:
+            connection.execute(Attendee.__table__.insert(), attendee_rows)
+        if motion_rows:
+            connection.execute(Motion.__table__.insert(), motion_rows)
+    db.session.commit()
+
+
+def measure(function, repeat):
+    """
+    重複執行並記錄時間與 SQL 語句數（第一次執行不計，避免計入連線與快取的準備時間）
+    :param function: 要測量的函式
+    :param repeat: 執行次數
+    :return: (每次執行時間的中位數（毫秒）, 每次執行的 SQL 語句數)
+    """
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    function()
+    db.session.remove()
+    engine = db.get_engine()
+    event.listen(engine, 'after_cursor_execute', record)
+    try:
+        times = []
+        for _ in range(repeat):
+            start = perf_counter()
+            function()
+            times.append((perf_counter() - start) * 1000)
+            db.session.remove()
+    finally:
+        event.remove(engine, 'after_cursor_execute', record)
+    return median(times), len(executed) // repeat
+
+
+def report(label, function, repeat):
+    elapsed, statements = measure(function, repeat)
+    click.echo(f'{label}：{elapsed:.1f} ms，{statements} 個 SQL 語句')
+
+
+def timed(function):
+    start = perf_counter()
+    function()
+    return (perf_counter() - start) * 1000
+
+
+def legacy_dashboard_data(today):
+    """
+    舊版統計資料頁面的計算方式（每月各查詢一次，並載入學期內所有討論事項於 Python 中計數），僅供比較效能
+    :param today: 日期時間
+    :return: 統計資料 dict
+    """
+    year = today.year
+    week_start = (today - timedelta(days=today.weekday() + 1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    if today.weekday() == 6:
+        week_start = today.replace(hour=0, minute=0, second=0, microsecond=0)
+    week_end = (week_start + timedelta(days=6)).replace(hour=23, minute=59, second=59, microsecond=0)
+
+    if today.month <= 1 or today.month >= 8:
+        if today.month <= 1:
+            year -= 1
+        months = [(year + 1, 1)] + [(year, month) for month in range(8, 13)]
+    else:
+        months = [(year, month) for month in range(2, 8)]
+
+    months_meeting_count = []
+    motion_status_count = dict.fromkeys(MotionStatusType, 0)
+    for year, month in months:
+        meetings = Meeting.query.filter(and_(extract('year', Meeting.time) == year,
+                                             extract('month', Meeting.time) == month))
+        months_meeting_count.append((statistics.MONTH_STR[month - 1], meetings.count()))
+        for motion in Motion.query.join(meetings.subquery()):
+            motion_status_count[motion.status] += 1
+
+    week_meetings = Meeting.query.filter(and_(Meeting.time > week_start, Meeting.time < week_end))
+    return {
+        'week_meeting_count': week_meetings.count(),
+        'week_motion_count': Motion.query.join(week_meetings.subquery()).count(),
+        'person_count': Person.query.count(),
+        'feedback_count': Feedback.query.count(),
+        'months_meeting_count': months_meeting_count,
+        'semester_motion_status_percentage': [(status.value, count) for status, count in motion_status_count.items()]
+    }
+
+
+@app.cli.group('benchmark')
+def benchmark_command():
+    """
+    以產生的資料比較查詢方式的效能（使用另一個資料庫，結束後刪除資料表，不影響正式資料）
+    """
+
+
+@benchmark_command.command('statistics')
+@click.option('--meetings', default=[10000, 100000], multiple=True, show_default=True,
+              help='產生的會議數，可指定多次以比較不同資料量')
+@click.option('--repeat', default=20, show_default=True, help='每種方式的執行次數')
+@click.option('--database', default=None, help='資料庫網址（會清空該資料庫），預設為暫存的 SQLite 檔案')
+def benchmark_statistics_command(meetings, repeat, database):
+    """
+    比較統計資料頁面：每次請求即時計算與讀取統計摘要
+    """
+    today = datetime(2024, 11, 15, 12)
+    for count in meetings:
+        with benchmark_database(database):
+            click.echo(f'產生 {count} 場會議...')
+            seed_meetings(count, end=today)
+            statistics.rebuild_summary()
+            legacy, summary = legacy_dashboard_data(today), statistics.dashboard_data(today)
+            for key in ('months_meeting_count', 'semester_motion_status_percentage'):
+                # 舊版上學期的一月排在最前面，比較時不考慮順序
+                if sorted(legacy[key]) != sorted(summary[key]):
+                    raise click.ClickException(f'{key} 結果不一致：{legacy[key]} / {summary[key]}')
+
+            report(f'{count} 場會議，每次請求即時計算', lambda: legacy_dashboard_data(today), repeat)
+            report(f'{count} 場會議，讀取統計摘要', lambda: statistics.dashboard_data(today), repeat)
+
+
+def legacy_visible_meetings(user):
+    """
+    舊版的可檢視會議條件（每筆會議以三個關聯子查詢判斷主席、紀錄與與會人員），僅供比較效能
+    :param user: 使用者
+    :return: 會議查詢
+    """
+    return Meeting.query.filter(or_(Meeting.chair.has(id=user.id), Meeting.minute_taker.has(id=user.id),
+                                    Meeting.attendees.any(id=user.id)))
+
+
+@benchmark_command.command('visibility')
+@click.option('--meetings', default=100000, show_default=True, help='產生的會議數')
+@click.option('--people', default=200, show_default=True, help='人員數（人數越多，每人可檢視的會議越少）')
+@click.option('--attendees', default=10, show_default=True, help='每場會議的與會人員數')
+@click.option('--repeat', default=20, show_default=True, help='每種方式的執行次數')
+@click.option('--database', default=None, help='資料庫網址（會清空該資料庫），預設為暫存的 SQLite 檔案')
+def benchmark_visibility_command(meetings, people, attendees, repeat, database):
+    """
+    比較可檢視會議的查詢：舊版 or_/EXISTS 條件與可檢視會議索引
+    """
+    with benchmark_database(database):
+        click.echo(f'產生 {meetings} 場會議（每場 {attendees} 位與會人員）...')
+        seed_meetings(meetings, people=people, attendees=attendees)
+        visibility.rebuild_visibility()
+        user = Person.query.get(1)
+        user_id = user.id
+        db.session.expunge(user)
+        visible = visibility.visible_meetings(user).count()
+        if legacy_visible_meetings(user).count() != visible:
+            raise click.ClickException('兩種方式可檢視的會議數不一致')
+        click.echo(f'人員 {user_id} 可檢視 {visible} 場會議')
+
+        for label, query in (('or_/EXISTS 條件', legacy_visible_meetings), ('可檢視會議索引', visibility.visible_meetings)):
+            report(f'{label} 會議列表第一頁', lambda: paginate_meetings(query(user)), repeat)
+            report(f'{label} 可檢視會議數', lambda: query(user).count(), repeat)
+
+        # 會議的主席、紀錄或與會人員異動時，依 meeting_id 刪除並重新產生該會議的索引
+        meeting_ids = random.Random(user_id).sample(range(1, meetings + 1), repeat + 1)
+        report('更新一場會議的索引（meeting_id 索引）',
+               lambda: visibility.refresh_meetings(db.session.connection(), [meeting_ids.pop()]), repeat)
+        engine = db.get_engine()
+        if engine.dialect.name != 'mysql':
+            # MySQL 的外鍵需要 meeting_id 的索引，無法刪除
+            index = next(index for index in MeetingVisibility.__table__.indexes
+                         if index.name == 'ix_meeting_visibility_meeting')
+            index.drop(engine)
+            meeting_ids = random.Random(user_id).sample(range(1, meetings + 1), repeat + 1)
+            report('更新一場會議的索引（無 meeting_id 索引）',
+                   lambda: visibility.refresh_meetings(db.session.connection(), [meeting_ids.pop()]), repeat)
+            index.create(engine)
+
+
+# 產生搜尋測試資料的詞彙（中文詞與英文字各半，以測試 bigram 與前綴比對）
+SEARCH_WORDS = ['預算', '課程', '招生', '評鑑', '實驗室', '畢業門檻', '學分', '經費', '研究生', '獎學金',
+                'budget', 'curriculum', 'admission', 'review', 'laboratory', 'scholarship']
+
+
+def legacy_search(index, query, meeting_ids=None, page=1, per_page=20, max_candidates=1000):
+    """
+    舊版的搜尋方式（只從最相關的 max_candidates 份文件中取出會議，在 Python 中分組與分頁），僅供比較效能
+    :param index: SearchIndex
+    :param query: 搜尋字串
+    :param meeting_ids: 可檢視的會議編號，None 表示不限制
+    :param page: 頁碼（從 1 開始）
+    :param per_page: 每頁筆數
+    :param max_candidates: 取出的文件數上限
+    :return: ([(會議編號, 文件編號)], 符合的會議總數)
+    """
+    sql = 'SELECT doc.meeting_id, doc.id FROM document JOIN doc ON doc.id = document.rowid WHERE document MATCH ?'
+    params = [search.build_match_query(query)]
+    if meeting_ids is not None:
+        sql += ' AND doc.meeting_id IN (SELECT value FROM json_each(?))'
+        params.append(json.dumps(list(meeting_ids)))
+    with closing(index.connect()) as connection:
+        best = {}
+        rows = connection.execute(sql + ' ORDER BY document.rank LIMIT ?', params + [max_candidates])
+        for meeting_id, doc_id in rows:
+            best.setdefault(meeting_id, doc_id)
+    return list(best.items())[(page - 1) * per_page:page * per_page], len(best)
+
+
+@benchmark_command.command('search')
+@click.option('--meetings', default=100000, show_default=True, help='產生的會議數（每場會議一份會議文件與兩份討論事項文件）')
+@click.option('--visible', default=0.1, show_default=True, help='一般使用者可檢視的會議比例')
+@click.option('--repeat', default=20, show_default=True, help='每種方式的執行次數')
+def benchmark_search_command(meetings, visible, repeat):
+    """
+    比較全文檢索：舊版從前 1000 份文件取出會議，與在 SQLite 中依會議分組、計數與分頁
+    """
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as folder:
+        index = search.SearchIndex(os.path.join(folder, 'search-index.sqlite3'))
+        click.echo(f'產生 {meetings} 場會議的索引文件...')
+        for first in range(1, meetings + 1, 10000):
+            index.update([(f'{kind}:{meeting_id}', meeting_id,
+                           f'會議{meeting_id} ' + ' '.join(rng.sample(SEARCH_WORDS, 3)))
+                          for meeting_id in range(first, min(first + 10000, meetings + 1))
+                          for kind in ('meeting', 'motion', 'extempore')])
+        meeting_ids = sorted(rng.sample(range(1, meetings + 1), int(meetings * visible)))
+
+        for query in ('預算', '實驗', 'budg', '課程 review'):
+            for label, ids in (('不限制', None), ('可檢視會議', meeting_ids)):
+                _, total = index.search(query, ids)
+                _, legacy_total = legacy_search(index, query, ids)
+                pages = max((total + 19) // 20, 1)
+                click.echo(f'「{query}」（{label}）：{total} 場會議，舊版只找到 {legacy_total} 場')
+                for name, function in (
+                        ('舊版第一頁', lambda: legacy_search(index, query, ids)),
+                        ('第一頁', lambda: index.search(query, ids)),
+                        (f'最後一頁（第 {pages} 頁）', lambda: index.search(query, ids, page=pages))):
+                    elapsed = median(timed(function) for _ in range(repeat))
+                    click.echo(f'  {name}：{elapsed:.1f} ms')
@@ -0,0 +1,77 @@
+from collections import OrderedDict, namedtuple
+from threading import Lock
+from time import monotonic
+
+CacheStatus = namedtuple('CacheStatus', ['size', 'hits', 'misses', 'hit_rate'])
+
+
+class TTLCache:
+    """
+    每個行程各自保存於記憶體的快取：項目在 ttl 秒後過期（其他行程的異動最多在 ttl 秒後生效），
+    設定容量時淘汰最久未使用的項目
+    清除或更新項目時遞增世代（generation），載入期間若有異動，載入的內容可能是舊的，不會存入
+    """
+
+    def __init__(self, ttl, capacity=None):
+        self.ttl = ttl
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._lock = Lock()
+
+    def get(self, key, load):
+        """
+        取得項目，快取中沒有或已過期時呼叫 load() 載入（載入時不持有鎖）
+        :param key: 鍵值
+        :param load: 載入函式，回傳 None 表示不存在（不存入快取）
+        :return: 項目的值
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            generation = self._generation
+
+        value = load()
+        with self._lock:
+            if value is not None and generation == self._generation:
+                self._entries[key] = (value, monotonic() + self.ttl)
+                self._entries.move_to_end(key)
+                while self.capacity is not None and len(self._entries) > self.capacity:
+                    self._entries.popitem(last=False)
+        return value
+
+    def update(self, key, update):
+        """
+        以 update(目前的值) 取代已存在的項目（保留原本的過期時間），沒有項目時不載入
+        :param key: 鍵值
+        :param update: 更新函式，於持有鎖時呼叫
+        """
+        with self._lock:
+            self._generation += 1
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = (update(entry[0]), entry[1])
+
+    def invalidate(self, keys=None):
+        """
+        清除項目
+        :param keys: 鍵值列表，None 表示全部
+        """
+        with self._lock:
+            if keys is None:
+                self._entries.clear()
+            else:
+                for key in keys:
+                    self._entries.pop(key, None)
+            self._generation += 1
+
+    def status(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return CacheStatus(len(self._entries), self.hits, self.misses, self.hits / lookups if lookups else 0)
@@ -0,0 +1,186 @@
+import re
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+from itertools import chain
+
+from sqlalchemy import event, inspect
+
+from main import app, db
+from main.caching import TTLCache
+from main.models import Person, PersonType
+
+PersonRecord = namedtuple('PersonRecord', ['id', 'name', 'email', 'type'])
+
+_CJK = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]')
+
+
+def person_json(record):
+    return {'id': record.id, 'name': record.name, 'email': record.email, 'type': record.type.value}
+
+
+class _Snapshot:
+    """
+    人員目錄的唯讀快照：依姓名排序的平行陣列，外加姓名字元索引與電子郵件排序索引，建立後不再修改
+    """
+
+    def __init__(self, records):
+        records = sorted(records, key=lambda record: (record.name.lower(), record.id))
+        self.ids = array('l', (record.id for record in records))
+        self.names = [record.name for record in records]
+        self.emails = [record.email for record in records]
+        self.types = [record.type for record in records]
+        self.keys = [name.lower() for name in self.names]
+        self.positions = {person_id: position for position, person_id in enumerate(self.ids)}
+
+        # 含中日文字元的單字與相鄰二字 -> 姓名位置（遞增），供中文姓名的子字串搜尋
+        self.grams = {}
+        for position, key in enumerate(self.keys):
+            for gram in set(chain(key, (key[i:i + 2] for i in range(len(key) - 1)))):
+                if _CJK.search(gram):
+                    self.grams.setdefault(gram, array('l')).append(position)
+
+        emails = sorted((email.lower(), position) for position, email in enumerate(self.emails))
+        self.email_keys = [email for email, _ in emails]
+        self.email_positions = array('l', (position for _, position in emails))
+
+    def record(self, position):
+        return PersonRecord(self.ids[position], self.names[position], self.emails[position], self.types[position])
+
+    def records(self):
+        return [self.record(position) for position in range(len(self.ids))]
+
+    def _name_prefix(self, query):
+        position = bisect_left(self.keys, query)
+        while position < len(self.keys) and self.keys[position].startswith(query):
+            yield position
+            position += 1
+
+    def _email_prefix(self, query):
+        index = bisect_left(self.email_keys, query)
+        while index < len(self.email_keys) and self.email_keys[index].startswith(query):
+            yield self.email_positions[index]
+            index += 1
+
+    def _name_substring(self, query):
+        if len(query) == 1:
+            yield from self.grams.get(query, ())
+            return
+        postings = [self.grams.get(query[i:i + 2]) for i in range(len(query) - 1)]
+        if not all(postings):
+            return
+        for position in min(postings, key=len):
+            if query in self.keys[position]:
+                yield position
+
+    def suggest(self, query, limit):
+        """
+        依序找出姓名開頭相符、電子郵件開頭相符，以及（查詢含中文時）姓名包含查詢字串的人員
+        :param query: 已轉為小寫的查詢字串
+        :param limit: 最多筆數
+        :return: 人員位置列表
+        """
+        sources = [self._name_prefix(query), self._email_prefix(query)]
+        if _CJK.search(query):
+            sources.append(self._name_substring(query))
+        found = []
+        seen = set()
+        for position in chain.from_iterable(sources):
+            if position not in seen:
+                seen.add(position)
+                found.append(position)
+                if len(found) == limit:
+                    break
+        return found
+
+
+class PersonDirectory:
+    """
+    人員目錄（編號、姓名、電子郵件、身分），每個行程各自保存於記憶體，供人員選單的即時搜尋使用
+    人員新增、修改或刪除的交易提交後即套用至目錄；其他行程的異動則最多在 ttl 秒後重新載入
+    """
+
+    def __init__(self, ttl):
+        self._cache = TTLCache(ttl)
+
+    def _current(self):
+        return self._cache.get('snapshot', lambda: _Snapshot(
+            PersonRecord(*row) for row in db.session.query(Person.id, Person.name, Person.email, Person.type)))
+
+    def suggest(self, query, limit):
+        """
+        搜尋人員：姓名或電子郵件開頭相符，查詢含中文時也比對姓名中間的字
+        :param query: 查詢字串
+        :param limit: 最多筆數
+        :return: PersonRecord 列表
+        """
+        query = query.strip().lower()
+        if not query:
+            return []
+        snapshot = self._current()
+        return [snapshot.record(position) for position in snapshot.suggest(query, limit)]
+
+    def get(self, person_ids):
+        """
+        :param person_ids: 人員編號列表
+        :return: PersonRecord 列表（依傳入順序，不存在的人員略過）
+        """
+        snapshot = self._current()
+        return [snapshot.record(snapshot.positions[person_id])
+                for person_id in person_ids if person_id in snapshot.positions]
+
+    def all(self):
+        """
+        :return: 依姓名排序的 PersonRecord 列表
+        """
+        return self._current().records()
+
+    def apply(self, changes):
+        """
+        套用已提交的人員異動
+        :param changes: {人員編號: PersonRecord，已刪除的人員為 None}
+        """
+        def update(snapshot):
+            records = {record.id: record for record in snapshot.records()}
+            for person_id, record in changes.items():
+                if record is None:
+                    records.pop(person_id, None)
+                else:
+                    records[person_id] = record
+            return _Snapshot(records.values())
+
+        self._cache.update('snapshot', update)
+
+
+people = PersonDirectory(app.config['PEOPLE_DIRECTORY_TTL'])
+
+
+def _record_of(person):
+    person_type = PersonType[person.type] if isinstance(person.type, str) else person.type
+    return PersonRecord(person.id, person.name, person.email, person_type)
+
+
+@event.listens_for(db.session, 'after_flush')
+def collect_people_changes(session, flush_context):
+    """
+    記錄此次 flush 中新增、修改（姓名、電子郵件、身分）或刪除的人員，待交易提交後再套用至目錄
+    """
+    for obj in chain(session.new, session.dirty):
+        if isinstance(obj, Person) and (obj in session.new or any(
+                inspect(obj).attrs[name].history.has_changes() for name in ('name', 'email', 'type'))):
+            session.info.setdefault('people_changed', {})[obj.id] = _record_of(obj)
+    for obj in session.deleted:
+        if isinstance(obj, Person):
+            session.info.setdefault('people_changed', {})[obj.id] = None
+
+
+@event.listens_for(db.session, 'after_commit')
+def apply_people_changes(session):
+    changes = session.info.pop('people_changed', None)
+    if changes:
+        people.apply(changes)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_people_changes(session):
+    session.info.pop('people_changed', None)
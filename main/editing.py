@@ -0,0 +1,227 @@
+from datetime import datetime, timedelta
+
+from main import db
+from main.models import Meeting, Person, Attendee, Announcement, Motion, Extempore, MeetingType, MotionStatusType
+from main.visibility import refresh_meetings
+
+# 一次依週期規則建立的會議數上限
+RECURRENCE_LIMIT = 200
+
+
+def resolve_people(*id_lists):
+    """
+    以單一 IN 查詢載入表單中參照的所有人員
+    :param id_lists: 人員編號列表
+    :return: ({人員編號: Person}, 找不到的人員編號列表)
+    """
+    ids = {int(person_id) for id_list in id_lists for person_id in id_list}
+    people = {person.id: person for person in Person.query.filter(Person.id.in_(ids))} if ids else {}
+    return people, sorted(ids - people.keys())
+
+
+def build_attendees(people, data):
+    """
+    依表單建立與會人員關聯，同時設定成員身分與出席狀態
+    :param people: resolve_people() 載入的人員
+    :param data: 會議表單
+    :return: Attendee 列表
+    """
+    present = {int(person_id) for person_id in data['present']}
+    attendees = {}
+    for ids, is_member in ((data['attendee'], True), (data['guest'], False)):
+        for person_id in map(int, ids):
+            if person_id not in attendees:
+                attendees[person_id] = Attendee(person_id=people[person_id].id, is_member=is_member,
+                                                is_present=person_id in present)
+    return list(attendees.values())
+
+
+def assign(obj, **values):
+    """
+    只設定與目前值不同的欄位，避免產生不必要的 UPDATE
+    :param obj: 資料庫物件
+    :param values: {欄位名稱: 新值}
+    :return: 是否有欄位被修改
+    """
+    changed = False
+    for key, value in values.items():
+        if getattr(obj, key) != value:
+            setattr(obj, key, value)
+            changed = True
+    return changed
+
+
+class WriteCounts:
+    """
+    會議更新所需的寫入次數：新增、修改、刪除的資料列數
+    """
+
+    def __init__(self):
+        self.inserted = 0
+        self.updated = 0
+        self.deleted = 0
+
+    def __bool__(self):
+        return bool(self.inserted or self.updated or self.deleted)
+
+    def to_dict(self):
+        return {'inserted': self.inserted, 'updated': self.updated, 'deleted': self.deleted}
+
+
+def reconcile_attendees(meeting, attendees, counts):
+    """
+    以人員編號比對與會人員：保留的人員只更新成員身分與出席狀態（保留確認狀態），其餘新增或刪除
+    :param meeting: 會議
+    :param attendees: build_attendees() 建立的 Attendee 列表
+    :param counts: WriteCounts
+    """
+    existing = {attendee.person_id: attendee for attendee in meeting.attendee_association}
+    for attendee in attendees:
+        current = existing.pop(attendee.person_id, None)
+        if current is None:
+            meeting.attendee_association.append(attendee)
+            counts.inserted += 1
+        elif assign(current, is_member=attendee.is_member, is_present=attendee.is_present):
+            counts.updated += 1
+    for attendee in existing.values():
+        meeting.attendee_association.remove(attendee)
+        counts.deleted += 1
+
+
+def reconcile_contents(collection, items, model, counts):
+    """
+    以編號比對公告或臨時動議：有編號的就地更新內容，沒有編號的新增，表單中沒有出現的刪除
+    :param collection: 會議的 announcements 或 extempores
+    :param items: 表單中的項目列表 [{'id': 編號（新項目為空字串）, 'content': 內容}]
+    :param model: Announcement 或 Extempore
+    :param counts: WriteCounts
+    """
+    existing = {item.id: item for item in collection}
+    for item in items:
+        item_id = item.get('id')
+        current = existing.pop(int(item_id), None) if item_id else None
+        if current is None:
+            collection.append(model(item['content']))
+            counts.inserted += 1
+        elif assign(current, content=item['content']):
+            counts.updated += 1
+    for item in existing.values():
+        collection.remove(item)
+        counts.deleted += 1
+
+
+def reconcile_motions(meeting, motion_forms, counts):
+    """
+    以討論事項編號比對：有編號的就地更新並保留編號（討論事項追蹤的連結不會失效），沒有編號的新增，
+    表單中沒有出現的刪除
+    :param meeting: 會議
+    :param motion_forms: 表單中的討論事項列表
+    :param counts: WriteCounts
+    """
+    existing = {motion.id: motion for motion in meeting.motions}
+    for motion_form in motion_forms:
+        values = {'description': motion_form['MotionDescription'],
+                  'content': motion_form['MotionContent'],
+                  'status': MotionStatusType[motion_form['MotionStatus']],
+                  'resolution': motion_form['MotionResolution'],
+                  'execution': motion_form['MotionExecution']}
+        motion_id = motion_form.get('MotionId')
+        current = existing.pop(int(motion_id), None) if motion_id else None
+        if current is None:
+            meeting.motions.append(Motion(**values))
+            counts.inserted += 1
+        elif assign(current, **values):
+            counts.updated += 1
+    for motion in existing.values():
+        meeting.motions.remove(motion)
+        counts.deleted += 1
+
+
+def update_meeting(meeting, data, people):
+    """
+    以差異更新會議：只修改有變動的欄位與子項目，未變動的項目不產生任何寫入
+    :param meeting: 會議（建議以 Meeting.query_full() 載入）
+    :param data: 編輯會議表單
+    :param people: resolve_people() 載入的人員
+    :return: WriteCounts
+    """
+    counts = WriteCounts()
+    if assign(meeting,
+              title=data['title'],
+              time=datetime.fromisoformat(data['time']),
+              location=data['location'],
+              type=MeetingType[data['type']],
+              chair_id=int(data['chair']),
+              minute_taker_id=int(data['minuteTaker']),
+              chair_speech=data['chairSpeech']):
+        counts.updated += 1
+
+    reconcile_attendees(meeting, build_attendees(people, data), counts)
+    reconcile_contents(meeting.announcements, data['announcement'], Announcement, counts)
+    reconcile_motions(meeting, data['motion'], counts)
+    reconcile_contents(meeting.extempores, data['extempore'], Extempore, counts)
+    return counts
+
+
+def recurrence_dates(start, end, weekday=None, interval=1, exclude=()):
+    """
+    產生每隔固定週數、在同一星期幾的日期，例如開學至學期結束每隔一週的星期三
+    :param start: 開始日期
+    :param end: 結束日期（含）
+    :param weekday: 星期幾（0 為星期一），None 表示與開始日期相同
+    :param interval: 間隔週數
+    :param exclude: 略過的日期（例如國定假日）
+    :return: 日期列表
+    """
+    if weekday is None:
+        weekday = start.weekday()
+    day = start + timedelta(days=(weekday - start.weekday()) % 7)
+    dates = []
+    while day <= end:
+        if day not in exclude:
+            dates.append(day)
+        day += timedelta(weeks=interval)
+    return dates
+
+
+def template_attendees(template):
+    """
+    模板的與會人員與列席人員編號，已去除重複
+    模板中可能重複列出同一人員（或同時為與會及列席人員），與 build_attendees() 相同只保留第一次出現的身分，
+    否則批次寫入會違反 Attendee 的主鍵
+    :param template: 會議模板（與會人員與列席人員應已預先載入）
+    :return: (與會人員編號列表, 列席人員編號列表)
+    """
+    members = list(dict.fromkeys(person.id for person in template.attendees))
+    guests = [person_id for person_id in dict.fromkeys(person.id for person in template.guests)
+              if person_id not in members]
+    return members, guests
+
+
+def create_meetings(template, times):
+    """
+    依會議模板建立多場會議與其與會人員（模板的與會人員為成員、列席人員為非成員）
+    會議以 ORM 寫入（統計摘要、全文檢索等由 flush 事件維護），與會人員則以單一 executemany 批次寫入，
+    再一次更新這些會議的可檢視會議索引
+    :param template: 會議模板（與會人員與列席人員應已預先載入）
+    :param times: 會議時間列表
+    :return: Meeting 列表（已 flush，尚未 commit）
+    """
+    meetings = [Meeting(title=template.title, type=template.type, time=time, location=template.location,
+                        chair_id=template.chair_id, minute_taker_id=template.minute_taker_id, chair_speech='')
+                for time in times]
+    if not meetings:
+        return meetings
+    db.session.add_all(meetings)
+    db.session.flush()
+
+    members, guests = template_attendees(template)
+    rows = [{'meeting_id': meeting.id, 'person_id': person_id, 'is_member': is_member, 'version': 1}
+            for meeting in meetings
+            for person_ids, is_member in ((members, True), (guests, False))
+            for person_id in person_ids]
+    connection = db.session.connection()
+    if rows:
+        connection.execute(Attendee.__table__.insert(), rows)
+    refresh_meetings(connection, {meeting.id for meeting in meetings})
+    return meetings
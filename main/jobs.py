@@ -0,0 +1,146 @@
+import sqlite3
+from contextlib import closing, contextmanager
+from threading import Event, Lock, Thread
+from time import time
+
+from main import app
+
+
+def backoff(attempts, retry_delay, now=None):
+    """
+    以指數退避計算下一次嘗試的時間
+    :param attempts: 已失敗的次數（0 為第一次失敗）
+    :param retry_delay: 第一次重試的等待秒數，之後每次加倍
+    :param now: 目前時間，預設為現在
+    :return: 下一次嘗試的時間（time() 秒數）
+    """
+    return (now or time()) + retry_delay * 2 ** attempts
+
+
+class LocalQueue:
+    """
+    以 SQLite 儲存於本機檔案的工作佇列，行程重啟後仍會繼續處理，多個行程可共用同一個檔案
+    子類別以 SCHEMA 定義資料表，並以 TABLE、KEY、CLAIM_COLUMNS、CLAIM_WHERE、CLAIM_ORDER 指定 claim() 取出的工作；
+    取出的工作設有保留期限（claimed_until 欄位），行程中斷後逾期的工作會再被取出
+    """
+
+    SCHEMA = ''
+    TABLE = None
+    KEY = 'id'
+    CLAIM_COLUMNS = '*'
+    # 可使用 :now 參數
+    CLAIM_WHERE = '1'
+    CLAIM_ORDER = None
+
+    def __init__(self, queue_path, lease=300):
+        self.queue_path = queue_path
+        self.lease = lease
+        self._initialized = False
+
+    def connect(self):
+        connection = sqlite3.connect(self.queue_path, timeout=30)
+        if not self._initialized:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(self.SCHEMA)
+            self._initialized = True
+        return connection
+
+    @contextmanager
+    def immediate(self):
+        """
+        以 BEGIN IMMEDIATE 開始交易，先取得寫入鎖再讀取，多個行程同時取出工作時不會重複取出
+        :return: 資料庫連線
+        """
+        with closing(self.connect()) as connection:
+            connection.isolation_level = None
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield connection
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+
+    def claim(self, batch_size):
+        """
+        取出一批待處理的工作並保留 lease 秒，期間其他行程不會重複取出
+        :param batch_size: 每批工作數
+        :return: 資料列列表（CLAIM_COLUMNS）
+        """
+        now = time()
+        sql = f'SELECT {self.KEY}, {self.CLAIM_COLUMNS} FROM {self.TABLE} ' \
+              f'WHERE {self.CLAIM_WHERE} AND claimed_until <= :now'
+        if self.CLAIM_ORDER:
+            sql += f' ORDER BY {self.CLAIM_ORDER}'
+        with self.immediate() as connection:
+            rows = connection.execute(sql + ' LIMIT :limit', {'now': now, 'limit': batch_size}).fetchall()
+            connection.executemany(f'UPDATE {self.TABLE} SET claimed_until = ? WHERE {self.KEY} = ?',
+                                   [(now + self.lease, row[0]) for row in rows])
+        return [row[1:] for row in rows]
+
+
+class Workers:
+    """
+    此行程的背景工作執行緒：定期（或被喚醒時）呼叫 drain 處理佇列中的工作，例外只記錄不中斷
+    """
+
+    def __init__(self, name, drain, interval_key, count_key=None):
+        """
+        :param name: 記錄錯誤時使用的名稱
+        :param drain: 處理佇列中所有工作的函式，參數為 Flask 實例，於 app context 中呼叫
+        :param interval_key: 每次檢查佇列的間隔秒數的設定名稱
+        :param count_key: 執行緒數量的設定名稱，None 表示一個
+        """
+        self.name = name
+        self.drain = drain
+        self.interval_key = interval_key
+        self.count_key = count_key
+        # 行程啟動後的第一個請求是否已檢查過佇列（見 resume()）
+        self.resumed = False
+        self._wakeup = Event()
+        self._threads = []
+        self._lock = Lock()
+
+    def run(self, current_app):
+        while True:
+            try:
+                with current_app.app_context():
+                    self.drain(current_app)
+            except Exception:
+                current_app.logger.exception('%s failed', self.name)
+            self._wakeup.wait(current_app.config[self.interval_key])
+            self._wakeup.clear()
+
+    def start(self):
+        """
+        啟動背景執行緒（已啟動的不重複啟動，結束的重新啟動）
+        """
+        with self._lock:
+            self._threads[:] = [thread for thread in self._threads if thread.is_alive()]
+            count = app.config[self.count_key] if self.count_key else 1
+            while len(self._threads) < count:
+                thread = Thread(target=self.run, args=[app], daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def wake(self):
+        """
+        喚醒等待中的執行緒，立即處理新加入的工作
+        """
+        self._wakeup.set()
+
+    def resume(self, pending, start):
+        """
+        行程啟動後的第一個請求：佇列中仍有待處理的工作時啟動背景執行緒，
+        避免重啟前未完成的工作要等到下一次加入工作才會處理
+        :param pending: 回傳待處理工作數的函式
+        :param start: 啟動背景執行緒的函式
+        """
+        if self.resumed:
+            return
+        self.resumed = True
+        try:
+            if pending():
+                start()
+        except Exception:
+            app.logger.exception('Failed to resume %s', self.name)
@@ -0,0 +1,223 @@
+import json
+from base64 import b64decode, b64encode
+from collections import namedtuple
+from contextlib import closing
+from time import time
+
+import click
+from flask_mail import Attachment, Message
+
+from main import app, jobs, mail
+
+MailStatus = namedtuple('MailStatus', ['pending', 'failed', 'oldest_age', 'average_latency', 'max_latency'])
+
+
+class MailQueue(jobs.LocalQueue):
+    """
+    待寄送電子郵件的佇列，以 SQLite 儲存於本機檔案，行程重啟後仍會繼續寄送
+    message 資料表為待寄送的郵件，寄送失敗時延後重試，超過重試次數則標記為失敗；
+    delivery 資料表記錄最近寄出郵件的等待時間
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS message (
+            id INTEGER PRIMARY KEY,
+            payload TEXT NOT NULL,
+            enqueued_at REAL NOT NULL,
+            next_attempt REAL NOT NULL,
+            claimed_until REAL NOT NULL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            error TEXT
+        );
+        CREATE INDEX IF NOT EXISTS message_due ON message (failed, next_attempt);
+        CREATE TABLE IF NOT EXISTS delivery (
+            id INTEGER PRIMARY KEY,
+            sent_at REAL NOT NULL,
+            latency REAL NOT NULL
+        );
+    """
+
+    TABLE = 'message'
+    CLAIM_COLUMNS = 'id, enqueued_at, attempts, payload'
+    CLAIM_WHERE = 'failed = 0 AND next_attempt <= :now'
+    CLAIM_ORDER = 'next_attempt'
+
+    DELIVERY_HISTORY = 1000
+
+    def enqueue(self, msg):
+        """
+        將郵件加入佇列
+        :param msg: flask_mail.Message 物件
+        """
+        now = time()
+        with closing(self.connect()) as connection, connection:
+            connection.execute('INSERT INTO message (payload, enqueued_at, next_attempt) VALUES (?, ?, ?)',
+                               [json.dumps(payload_of(msg), ensure_ascii=False), now, now])
+
+    def claim(self, batch_size):
+        """
+        取出一批已到寄送時間的郵件並保留一段時間，期間其他寄送程序不會重複取出
+        :param batch_size: 每批郵件數
+        :return: [(郵件編號, 加入佇列時間, 重試次數, flask_mail.Message)]
+        """
+        return [(message_id, enqueued_at, attempts, message_of(json.loads(payload)))
+                for message_id, enqueued_at, attempts, payload in super().claim(batch_size)]
+
+    def finish(self, sent=(), failed=(), max_attempts=5, retry_delay=30):
+        """
+        記錄一批郵件的寄送結果：寄出的移出佇列，失敗的以指數退避延後重試
+        :param sent: [(郵件編號, 加入佇列時間)]
+        :param failed: [(郵件編號, 重試次數, 錯誤訊息)]
+        :param max_attempts: 最多寄送次數，超過則標記為失敗不再重試
+        :param retry_delay: 第一次重試的等待秒數，之後每次加倍
+        """
+        now = time()
+        with closing(self.connect()) as connection, connection:
+            connection.executemany('DELETE FROM message WHERE id = ?', [(message_id,) for message_id, _ in sent])
+            connection.executemany('INSERT INTO delivery (sent_at, latency) VALUES (?, ?)',
+                                   [(now, now - enqueued_at) for _, enqueued_at in sent])
+            connection.execute('DELETE FROM delivery WHERE id <= (SELECT MAX(id) FROM delivery) - ?',
+                               [self.DELIVERY_HISTORY])
+            connection.executemany('UPDATE message SET attempts = ?, error = ?, failed = ?, '
+                                   'next_attempt = ?, claimed_until = 0 WHERE id = ?',
+                                   [(attempts + 1, error, attempts + 1 >= max_attempts,
+                                     jobs.backoff(attempts, retry_delay, now), message_id)
+                                    for message_id, attempts, error in failed])
+
+    def retry_failed(self):
+        """
+        將標記為失敗的郵件重新放回佇列
+        :return: 重新放回的郵件數
+        """
+        with closing(self.connect()) as connection, connection:
+            return connection.execute('UPDATE message SET failed = 0, attempts = 0, next_attempt = ? '
+                                      'WHERE failed = 1', [time()]).rowcount
+
+    def status(self):
+        """
+        佇列狀態
+        :return: MailStatus（待寄送數、失敗數、最久待寄送郵件的等待秒數、最近寄出郵件的平均與最長等待秒數）
+        """
+        now = time()
+        with closing(self.connect()) as connection:
+            pending, failed, oldest = connection.execute(
+                'SELECT SUM(failed = 0), SUM(failed = 1), MIN(CASE WHEN failed = 0 THEN enqueued_at END) '
+                'FROM message').fetchone()
+            average_latency, max_latency = connection.execute(
+                'SELECT AVG(latency), MAX(latency) FROM delivery').fetchone()
+        return MailStatus(pending or 0, failed or 0, now - oldest if oldest else 0,
+                          average_latency or 0, max_latency or 0)
+
+
+def payload_of(msg):
+    """
+    將郵件轉換為可存入佇列的 JSON 物件（附件內容以 base64 編碼）
+    :param msg: flask_mail.Message 物件
+    :return: dict
+    """
+    return {'subject': msg.subject, 'sender': msg.sender, 'recipients': msg.recipients, 'cc': msg.cc,
+            'bcc': msg.bcc, 'reply_to': msg.reply_to, 'body': msg.body, 'html': msg.html,
+            'extra_headers': msg.extra_headers,
+            'attachments': [{'filename': attachment.filename, 'content_type': attachment.content_type,
+                             'data': b64encode(attachment.data if isinstance(attachment.data, bytes)
+                                               else attachment.data.encode()).decode(),
+                             'disposition': attachment.disposition, 'headers': attachment.headers}
+                            for attachment in msg.attachments]}
+
+
+def _address(address):
+    # JSON 沒有 tuple，(名稱, 地址) 形式的地址存入後會變成 list
+    return tuple(address) if isinstance(address, list) else address
+
+
+def message_of(payload):
+    return Message(payload['subject'], sender=_address(payload['sender']),
+                   recipients=[_address(address) for address in payload['recipients']],
+                   cc=[_address(address) for address in payload.get('cc') or []],
+                   bcc=[_address(address) for address in payload.get('bcc') or []],
+                   reply_to=_address(payload.get('reply_to')), body=payload['body'], html=payload['html'],
+                   extra_headers=payload.get('extra_headers'),
+                   attachments=[Attachment(attachment['filename'], attachment['content_type'],
+                                           b64decode(attachment['data']), attachment['disposition'],
+                                           attachment['headers'])
+                                for attachment in payload.get('attachments') or []])
+
+
+queue = MailQueue(app.config['MAIL_QUEUE_PATH'])
+
+
+def send_batch(current_app, batch):
+    """
+    以同一個 SMTP 連線寄出一批郵件，並記錄每封郵件的寄送結果
+    :param current_app: Flask 實例
+    :param batch: claim() 取出的郵件
+    """
+    sent = []
+    failed = []
+    try:
+        with mail.connect() as connection:
+            for message_id, enqueued_at, attempts, msg in batch:
+                try:
+                    connection.send(msg)
+                    sent.append((message_id, enqueued_at))
+                except Exception as e:
+                    current_app.logger.warning('Failed to send mail %s: %s', message_id, e)
+                    failed.append((message_id, attempts, str(e)))
+    except Exception as e:
+        # 無法連線或連線中斷：尚未寄出的郵件全部延後重試
+        current_app.logger.warning('SMTP connection failed: %s', e)
+        done = {message_id for message_id, _ in sent} | {message_id for message_id, _, _ in failed}
+        failed.extend((message_id, attempts, str(e))
+                      for message_id, _, attempts, _ in batch if message_id not in done)
+    queue.finish(sent, failed, current_app.config['MAIL_MAX_ATTEMPTS'], current_app.config['MAIL_RETRY_DELAY'])
+
+
+def drain_queue(current_app):
+    """
+    取出佇列中已到寄送時間的郵件，每批共用一個 SMTP 連線寄出
+    :param current_app: Flask 實例
+    """
+    batch = queue.claim(current_app.config['MAIL_BATCH_SIZE'])
+    while batch:
+        send_batch(current_app, batch)
+        batch = queue.claim(current_app.config['MAIL_BATCH_SIZE'])
+
+
+# 背景寄信程序 (用於異步處理)
+mailers = jobs.Workers('Mailer', drain_queue, 'MAIL_QUEUE_INTERVAL', 'MAIL_WORKERS')
+
+
+def start_mailers():
+    """
+    啟動此行程的背景寄信程序（數量固定為 MAIL_WORKERS，已啟動的不重複啟動）
+    """
+    mailers.start()
+
+
+@app.before_request
+def resume_mailers():
+    mailers.resume(lambda: queue.status().pending, start_mailers)
+
+
+def send(msg):
+    """
+    將郵件加入寄送佇列，由背景寄信程序寄出
+    :param msg: flask_mail.Message 物件
+    """
+    queue.enqueue(msg)
+    start_mailers()
+    mailers.wake()
+
+
+@app.cli.command('mail-queue')
+@click.option('--retry-failed', is_flag=True, help='將寄送失敗的郵件重新放回佇列')
+def mail_queue_command(retry_failed):
+    """
+    顯示郵件佇列狀態
+    """
+    if retry_failed:
+        click.echo(f'已將 {queue.retry_failed()} 封失敗的郵件重新放回佇列')
+    status = queue.status()
+    click.echo(f'待寄送 {status.pending} 封，失敗 {status.failed} 封，最久已等待 {status.oldest_age:.1f} 秒')
+    click.echo(f'最近寄出郵件平均等待 {status.average_latency:.1f} 秒，最長 {status.max_latency:.1f} 秒')
@@ -0,0 +1,80 @@
+import hashlib
+from itertools import chain
+
+from flask import json
+from sqlalchemy import event
+from sqlalchemy.orm import selectinload
+
+from main import app, db
+from main.caching import TTLCache
+from main.models import MeetingTemplate, Person
+
+
+def template_list():
+    """
+    載入所有會議模板，與會人員與列席人員各以一次 IN 查詢載入（只取人員編號），SQL 語句數固定為 3
+    :return: 模板列表
+    """
+    templates = MeetingTemplate.query.options(
+        selectinload(MeetingTemplate.attendees).load_only(Person.id),
+        selectinload(MeetingTemplate.guests).load_only(Person.id)
+    ).order_by(MeetingTemplate.id)
+    return [{'id': template.id,
+             'name': template.name,
+             'title': template.title,
+             'time': template.time,
+             'location': template.location,
+             'type': template.type.name,
+             'chair': template.chair_id,
+             'minuteTaker': template.minute_taker_id,
+             'attendees': [person.id for person in template.attendees],
+             'guests': [person.id for person in template.guests]}
+            for template in templates]
+
+
+class TemplateDirectory:
+    """
+    會議模板列表的快取，保存序列化後的 JSON 與其 ETag
+    模板或人員異動的交易提交後清除；其他行程的異動則最多在 ttl 秒後生效
+    """
+
+    def __init__(self, ttl):
+        self._cache = TTLCache(ttl)
+
+    def get(self):
+        """
+        取得模板列表
+        :return: (JSON 字串, ETag)，ETag 為內容的雜湊值，各行程產生的值一致
+        """
+        def load():
+            body = json.dumps({'templateList': template_list()})
+            return body, hashlib.sha256(body.encode()).hexdigest()[:32]
+
+        return self._cache.get('templates', load)
+
+    def invalidate(self):
+        self._cache.invalidate()
+
+
+directory = TemplateDirectory(app.config['TEMPLATE_CACHE_TTL'])
+
+
+@event.listens_for(db.session, 'after_flush')
+def collect_template_changes(session, flush_context):
+    """
+    模板新增、修改、刪除，或刪除人員（連帶移除模板中的該人員）時，待交易提交後清除快取
+    """
+    if any(isinstance(obj, MeetingTemplate) for obj in chain(session.new, session.dirty, session.deleted)) \
+            or any(isinstance(obj, Person) for obj in session.deleted):
+        session.info['templates_changed'] = True
+
+
+@event.listens_for(db.session, 'after_commit')
+def invalidate_templates(session):
+    if session.info.pop('templates_changed', False):
+        directory.invalidate()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_template_changes(session):
+    session.info.pop('templates_changed', None)
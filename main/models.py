@@ -3,7 +3,7 @@ from enum import Enum
 
 from flask_login import UserMixin
 from sqlalchemy.ext.associationproxy import association_proxy
-from sqlalchemy.orm import backref
+from sqlalchemy.orm import backref, joinedload, selectinload
 
 from main import db, login
 
@@ -12,11 +12,6 @@ login.login_message = '請先登入系統'
 login.login_message_category = 'primary'
 
 
-@login.user_loader
-def load_user(person_id):
-    return Person.query.get(int(person_id))
-
-
 class GenderType(Enum):
     Male = '男'
     Female = '女'
@@ -61,13 +56,23 @@ class MotionStatusType(Enum):
     Closed = '結案'
 
 
+class VisibilityRole(Enum):
+    Chair = '主席'
+    MinuteTaker = '紀錄'
+    Attendee = '與會人員'
+
+
 class Meeting(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
-    type = db.Column(db.Enum(MeetingType), nullable=False)
-    time = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # 類型與時間修改時先載入原本的值，main.statistics 才能從原月份扣除
+    type = db.column_property(db.Column(db.Enum(MeetingType), nullable=False), active_history=True)
+    time = db.column_property(db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True),
+                              active_history=True)
     location = db.Column(db.String(100), nullable=False)
     archived = db.Column(db.Boolean, nullable=False, default=False)
+    # 會議或其子項目（與會人員、報告事項、討論事項、臨時動議、附件）每次寫入時由 main.rendering 遞增
+    version = db.Column(db.Integer, nullable=False, default=1)
 
     attachments = db.relationship('Attachment', backref='meeting', cascade='all, delete-orphan')
     announcements = db.relationship('Announcement', backref='meeting', cascade='all, delete-orphan')
@@ -92,6 +97,34 @@ class Meeting(db.Model):
     def attendees_filter_by(self, **kwargs):
         return Person.query.filter_by(**kwargs).join(Attendee).join(Meeting).filter_by(id=self.id)
 
+    def attendee_of(self, person_id):
+        """
+        從已載入的與會人員中找出指定人員
+        :param person_id: 人員編號
+        :return: Attendee 物件，不在與會名單中時為 None
+        """
+        for attendee in self.attendee_association:
+            if attendee.person_id == person_id:
+                return attendee
+        return None
+
+    @classmethod
+    def query_full(cls):
+        """
+        完整會議的載入設定：一次預先載入主席、紀錄、與會人員與所有子項目，
+        SQL 語句數固定，與與會人數及提案數無關，用於會議檢視、列印與寄信
+        :return: 會議查詢
+        """
+        return cls.query.options(
+            joinedload(cls.chair),
+            joinedload(cls.minute_taker),
+            selectinload(cls.attendee_association).joinedload(Attendee.attendee),
+            selectinload(cls.announcements),
+            selectinload(cls.motions),
+            selectinload(cls.extempores),
+            selectinload(cls.attachments)
+        )
+
 
 class Person(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
@@ -114,6 +147,22 @@ class Person(db.Model, UserMixin):
     def is_admin(self):
         return self.type == PersonType.Assistant
 
+    @classmethod
+    def query_profile(cls):
+        """
+        人員詳細資料的載入設定：以一次 SQL 語句（LEFT OUTER JOIN 五個身分資料表）同時載入人員與其身分資料，
+        身分資料表皆以人員編號為主鍵，每位人員只對應一列，不符合身分的資料表為 NULL；
+        用於人員列表時 SQL 語句數同樣固定為 1，之後存取或刪除（cascade）身分資料都不再查詢
+        :return: 人員查詢
+        """
+        return cls.query.options(
+            joinedload(cls.expert_info),
+            joinedload(cls.assistant_info),
+            joinedload(cls.dept_prof_info),
+            joinedload(cls.other_prof_info),
+            joinedload(cls.student_info)
+        )
+
     def add_expert_info(self, company_name, job_title, office_tel, address, bank_account):
         expert = Expert()
         expert.company_name = company_name
@@ -163,11 +212,27 @@ class Attendee(db.Model):
     is_present = db.Column(db.Boolean, nullable=False, default=False)
     is_confirmed = db.Column(db.Boolean, nullable=False, default=False)
     is_member = db.Column(db.Boolean, nullable=False, default=True)
+    version = db.Column(db.Integer, nullable=False)
+
+    __mapper_args__ = {'version_id_col': version}
 
     def __repr__(self):
         return f'<Attendee {self.meeting.title} {self.attendee.name}>'
 
 
+class MeetingVisibility(db.Model):
+    """
+    人員可檢視會議的索引（主席、紀錄、與會人員），由 main.visibility 於寫入時維護
+    """
+    person_id = db.Column(db.Integer, db.ForeignKey('person.id', ondelete='CASCADE'), primary_key=True)
+    meeting_id = db.Column(db.Integer, db.ForeignKey('meeting.id', ondelete='CASCADE'), primary_key=True)
+    role = db.Column(db.Enum(VisibilityRole), primary_key=True)
+
+    # 主鍵以 person_id 開頭，依會議更新或刪除索引（main.visibility.refresh_meetings）需要 meeting_id 的索引；
+    # MySQL 會為外鍵自動建立索引，但其他資料庫不會，因此明確宣告
+    __table_args__ = (db.Index('ix_meeting_visibility_meeting', 'meeting_id'),)
+
+
 class Expert(db.Model):
     person_id = db.Column(db.Integer, db.ForeignKey('person.id'), primary_key=True)
     company_name = db.Column(db.String(50), nullable=False)
@@ -210,6 +275,8 @@ class Attachment(db.Model):
     meeting_id = db.Column(db.Integer, db.ForeignKey('meeting.id'), primary_key=True)
     filename = db.Column(db.String(100), nullable=False)
     file_path = db.Column(db.String(500), nullable=False)
+    # 檔案庫中內容的 SHA-256，舊式附件（直接存放於 UPLOAD_FOLDER）為 None
+    sha256 = db.Column(db.String(64), db.ForeignKey('blob.sha256'), index=True)
 
     def __init__(self, filename, filepath):
         self.filename = filename
@@ -219,10 +286,39 @@ class Attachment(db.Model):
         return f'<Person {self.id} {self.meeting_id} {self.filename}>'
 
 
+class Blob(db.Model):
+    """
+    以內容雜湊值存放的附件檔案，內容相同的附件共用一份，ref_count 由 main.attachments 於附件寫入時維護
+    """
+    sha256 = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class Upload(db.Model):
+    """
+    分段上傳中的檔案，上傳完成後由會議表單以編號附加為會議附件
+    """
+    id = db.Column(db.String(32), primary_key=True)
+    filename = db.Column(db.String(100), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    offset = db.Column(db.BigInteger, nullable=False, default=0)
+    sha256 = db.Column(db.String(64))
+    uploader_id = db.Column(db.Integer, db.ForeignKey('person.id', ondelete='CASCADE'), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    @property
+    def completed(self):
+        return self.sha256 is not None
+
+
 class Announcement(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     meeting_id = db.Column(db.Integer, db.ForeignKey('meeting.id'), primary_key=True)
     content = db.Column(db.Text, nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+
+    __mapper_args__ = {'version_id_col': version}
 
     def __init__(self, content):
         self.content = content
@@ -232,6 +328,9 @@ class Extempore(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     meeting_id = db.Column(db.Integer, db.ForeignKey('meeting.id'), primary_key=True)
     content = db.Column(db.Text, nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+
+    __mapper_args__ = {'version_id_col': version}
 
     def __init__(self, content):
         self.content = content
@@ -239,12 +338,18 @@ class Extempore(db.Model):
 
 class Motion(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    meeting_id = db.Column(db.Integer, db.ForeignKey('meeting.id'), primary_key=True)
+    # 主鍵為 (id, meeting_id)，依會議查詢討論事項（統計資料的本週討論事項數等）需要另外的索引
+    meeting_id = db.Column(db.Integer, db.ForeignKey('meeting.id'), primary_key=True, index=True)
     description = db.Column(db.Text, nullable=False)
     content = db.Column(db.Text)
-    status = db.Column(db.Enum(MotionStatusType), nullable=False, default=MotionStatusType.InDiscussion)
+    status = db.column_property(
+        db.Column(db.Enum(MotionStatusType), nullable=False, default=MotionStatusType.InDiscussion),
+        active_history=True)
     resolution = db.Column(db.Text)
     execution = db.Column(db.Text)
+    version = db.Column(db.Integer, nullable=False)
+
+    __mapper_args__ = {'version_id_col': version}
 
     def __init__(self, description, content, status, resolution, execution):
         self.description = description
@@ -296,3 +401,23 @@ class MeetingTemplate(db.Model):
                                    backref='templates_as_minute_taker')
     attendees = db.relationship('Person', secondary=template_attendee_relations, backref='templates_as_attendees')
     guests = db.relationship('Person', secondary=template_guest_relations, backref='templates_as_guests')
+
+
+class MeetingMonthlyCount(db.Model):
+    """
+    每月各類型會議數統計摘要，由 main.statistics 於寫入時維護
+    """
+    year = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    month = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    type = db.Column(db.Enum(MeetingType), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class MotionMonthlyCount(db.Model):
+    """
+    每月（依會議時間）各狀態討論事項數統計摘要，由 main.statistics 於寫入時維護
+    """
+    year = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    month = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    status = db.Column(db.Enum(MotionStatusType), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
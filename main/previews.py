@@ -0,0 +1,436 @@
+import codecs
+import os
+import re
+import sys
+import zipfile
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import closing
+from multiprocessing import get_context
+from xml.etree import ElementTree
+
+import click
+from flask import url_for
+from PIL import Image, ImageOps
+from pypdf import PdfReader
+from sqlalchemy import event, inspect, select, update
+
+from main import app, attachments, db, jobs
+from main.models import Meeting, Attachment, Blob
+
+IMAGE_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp'}
+TEXT_EXTENSIONS = {'txt', 'csv', 'md'}
+# Office Open XML 與 OpenDocument 檔案中存放文字的 XML 檔
+XML_MEMBERS = {
+    'docx': re.compile(r'word/document\.xml'),
+    'pptx': re.compile(r'ppt/slides/slide(\d+)\.xml'),
+    'xlsx': re.compile(r'xl/sharedStrings\.xml'),
+    'odt': re.compile(r'content\.xml'),
+    'ods': re.compile(r'content\.xml'),
+    'odp': re.compile(r'content\.xml'),
+}
+# 段落元素（w:p、a:p、text:p、text:h）與試算表共用字串（si）
+PARAGRAPH_TAGS = {'p', 'h', 'si'}
+TEXT_ENCODINGS = ('utf-8-sig', 'cp950')
+
+EXCERPT_LENGTH = 200
+
+# 每個工作行程處理的工作數，之後更換新的行程以釋放解析檔案佔用的記憶體；
+# ProcessPoolExecutor 的 max_tasks_per_child 需要 Python 3.11，較舊的版本改為每處理這麼多工作就更換整個行程池
+MAX_TASKS_PER_CHILD = 100
+POOL_RECYCLES_CHILDREN = sys.version_info >= (3, 11)
+
+Preview = namedtuple('Preview', ['thumbnail', 'excerpt'])
+PreviewStatus = namedtuple('PreviewStatus', ['pending', 'done', 'failed'])
+
+
+def preview_path(sha256, suffix):
+    """
+    附件預覽檔的路徑，與檔案庫相同以內容雜湊值分層存放，例如 PREVIEW_FOLDER/ab/cd/abcd....jpg
+    :param sha256: 檔案內容的 SHA-256
+    :param suffix: 'jpg' 為縮圖，'txt' 為擷取的文字
+    :return: 檔案路徑
+    """
+    return os.path.join(app.config['PREVIEW_FOLDER'], sha256[:2], sha256[2:4], f'{sha256}.{suffix}')
+
+
+def _write_atomic(output_path, write):
+    # 先寫入暫存檔再更名，重新啟動或其他行程讀取時不會讀到寫到一半的檔案
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    temp_path = f'{output_path}.{os.getpid()}.tmp'
+    try:
+        write(temp_path)
+        os.replace(temp_path, output_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def make_thumbnail(source_path, output_path, size):
+    with Image.open(source_path) as image:
+        # JPEG 直接以較低解析度解碼，不需讀入完整影像
+        image.draft('RGB', (size, size))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        if image.mode != 'RGB':
+            background = Image.new('RGB', image.size, 'white')
+            image = image.convert('RGBA')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        _write_atomic(output_path, lambda temp_path: image.save(temp_path, 'JPEG', quality=80))
+
+
+def _read_text(source_path, limit):
+    with open(source_path, 'rb') as file:
+        data = file.read(limit * 4)
+    for encoding in TEXT_ENCODINGS:
+        try:
+            # 增量解碼：截斷在多位元組字元中間時不視為錯誤
+            return codecs.getincrementaldecoder(encoding)().decode(data)
+        except UnicodeDecodeError:
+            continue
+    return data.decode('utf-8', errors='replace')
+
+
+def _read_xml_text(source_path, pattern):
+    with zipfile.ZipFile(source_path) as archive:
+        members = [(match, name) for name in archive.namelist() for match in [pattern.fullmatch(name)] if match]
+        members.sort(key=lambda member: int(member[0].group(1)) if member[0].groups() else 0)
+        for _, name in members:
+            with archive.open(name) as stream:
+                for _, element in ElementTree.iterparse(stream):
+                    if element.tag.rpartition('}')[2] in PARAGRAPH_TAGS:
+                        text = ''.join(element.itertext()).strip()
+                        if text:
+                            yield text
+                        # 清除已處理的段落，記憶體用量不隨文件大小增加，巢狀段落（文字方塊）也不會重複擷取
+                        element.clear()
+
+
+def _read_pdf_text(source_path):
+    reader = PdfReader(source_path)
+    if reader.is_encrypted:
+        reader.decrypt('')
+    for page in reader.pages:
+        yield page.extract_text() or ''
+
+
+def extract_text(source_path, extension, limit):
+    """
+    擷取檔案中的純文字
+    :param source_path: 檔案路徑
+    :param extension: 副檔名（小寫）
+    :param limit: 最多擷取的字數
+    :return: 文字，不支援的格式為 None
+    """
+    if extension in TEXT_EXTENSIONS:
+        return _read_text(source_path, limit)[:limit]
+    if extension == 'pdf':
+        paragraphs = _read_pdf_text(source_path)
+    elif extension in XML_MEMBERS:
+        paragraphs = _read_xml_text(source_path, XML_MEMBERS[extension])
+    else:
+        return None
+
+    parts = []
+    length = 0
+    for paragraph in paragraphs:
+        parts.append(paragraph)
+        length += len(paragraph) + 1
+        if length >= limit:
+            break
+    return '\n'.join(parts)[:limit]
+
+
+def generate_preview(source_path, extension, thumbnail_path, text_path, thumbnail_size, text_limit, max_file_size):
+    """
+    產生一個附件內容的縮圖與擷取文字，於背景行程池中執行，不使用 Flask 與資料庫
+    :param source_path: 檔案庫中的檔案路徑
+    :param extension: 副檔名（小寫）
+    :param thumbnail_path: 縮圖輸出路徑
+    :param text_path: 擷取文字輸出路徑
+    :param thumbnail_size: 縮圖最大邊長（像素）
+    :param text_limit: 最多擷取的字數
+    :param max_file_size: 超過此大小的檔案不處理
+    :return: (是否產生縮圖, 是否擷取到文字)
+    """
+    if os.path.getsize(source_path) > max_file_size:
+        return False, False
+    if extension in IMAGE_EXTENSIONS:
+        make_thumbnail(source_path, thumbnail_path, thumbnail_size)
+        return True, False
+
+    text = extract_text(source_path, extension, text_limit)
+    if not text or not text.strip():
+        return False, False
+
+    def write(temp_path):
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            file.write(text)
+
+    _write_atomic(text_path, write)
+    return False, True
+
+
+class PreviewQueue(jobs.LocalQueue):
+    """
+    附件預覽工作記錄，以 SQLite 儲存於本機檔案
+    每份內容（SHA-256）只有一筆工作，加入已存在的工作不會重設狀態，因此已完成的工作在重新啟動後不會重做；
+    處理中的工作設有保留期限，行程中斷後逾期的工作會再被取出
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS job (
+            sha256 TEXT PRIMARY KEY,
+            extension TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            claimed_until REAL NOT NULL DEFAULT 0,
+            thumbnail INTEGER NOT NULL DEFAULT 0,
+            text INTEGER NOT NULL DEFAULT 0,
+            error TEXT
+        );
+        CREATE INDEX IF NOT EXISTS job_status ON job (status, claimed_until);
+    """
+
+    TABLE = 'job'
+    KEY = 'sha256'
+    CLAIM_COLUMNS = 'sha256, extension, attempts'
+    CLAIM_WHERE = "status = 'pending'"
+
+    def __init__(self, queue_path, lease=600):
+        super().__init__(queue_path, lease)
+
+    def enqueue(self, pending):
+        """
+        加入預覽工作，已存在的工作（不論狀態）保持不變
+        :param pending: {SHA-256: 副檔名}
+        """
+        with closing(self.connect()) as connection, connection:
+            connection.executemany('INSERT OR IGNORE INTO job (sha256, extension) VALUES (?, ?)', pending.items())
+
+    def finish(self, done=(), failed=(), max_attempts=3):
+        """
+        記錄一批工作的處理結果
+        :param done: [(SHA-256, 是否產生縮圖, 是否擷取到文字)]
+        :param failed: [(SHA-256, 已嘗試次數, 錯誤訊息)]
+        :param max_attempts: 最多嘗試次數，超過則標記為失敗不再重試
+        """
+        with closing(self.connect()) as connection, connection:
+            connection.executemany("UPDATE job SET status = 'done', thumbnail = ?, text = ?, error = NULL, "
+                                   "claimed_until = 0 WHERE sha256 = ?",
+                                   [(thumbnail, text, sha256) for sha256, thumbnail, text in done])
+            connection.executemany('UPDATE job SET status = ?, attempts = ?, error = ?, claimed_until = 0 '
+                                   'WHERE sha256 = ?',
+                                   [('failed' if attempts + 1 >= max_attempts else 'pending', attempts + 1, error,
+                                     sha256) for sha256, attempts, error in failed])
+
+    def retry_failed(self):
+        with closing(self.connect()) as connection, connection:
+            return connection.execute("UPDATE job SET status = 'pending', attempts = 0 "
+                                      "WHERE status = 'failed'").rowcount
+
+    def prune(self, keep):
+        """
+        刪除不在檔案庫中的內容的工作記錄
+        :param keep: 檔案庫中的 SHA-256 集合
+        :return: 刪除的 SHA-256 列表
+        """
+        with closing(self.connect()) as connection, connection:
+            removed = [sha256 for sha256, in connection.execute('SELECT sha256 FROM job') if sha256 not in keep]
+            connection.executemany('DELETE FROM job WHERE sha256 = ?', [(sha256,) for sha256 in removed])
+        return removed
+
+    def status(self):
+        with closing(self.connect()) as connection:
+            counts = dict(connection.execute('SELECT status, COUNT(*) FROM job GROUP BY status'))
+        return PreviewStatus(counts.get('pending', 0), counts.get('done', 0), counts.get('failed', 0))
+
+
+queue = PreviewQueue(app.config['PREVIEW_QUEUE_PATH'])
+# 擷取到文字時呼叫的函式，參數為內容的 SHA-256 列表（main.search 以此重新索引附件，previews 不需匯入 search）
+text_extracted_handlers = []
+
+
+def process_batch(current_app, pool, batch):
+    """
+    將一批工作交給行程池處理，記錄結果後將有擷取文字的附件加入全文檢索佇列
+    :param current_app: Flask 實例
+    :param pool: ProcessPoolExecutor
+    :param batch: claim() 取出的工作
+    """
+    futures = {}
+    for sha256, extension, attempts in batch:
+        future = pool.submit(generate_preview, attachments.blob_path(sha256), extension,
+                             preview_path(sha256, 'jpg'), preview_path(sha256, 'txt'),
+                             current_app.config['PREVIEW_THUMBNAIL_SIZE'], current_app.config['PREVIEW_TEXT_LIMIT'],
+                             current_app.config['PREVIEW_MAX_FILE_SIZE'])
+        futures[future] = (sha256, attempts)
+
+    done = []
+    failed = []
+    for future in as_completed(futures):
+        sha256, attempts = futures[future]
+        try:
+            done.append((sha256, *future.result()))
+        except Exception as e:
+            # 工作行程異常結束（BrokenProcessPool）也計入嘗試次數，無法處理的檔案不會一再使行程池中斷
+            current_app.logger.warning('Failed to preview %s: %s', sha256, e)
+            failed.append((sha256, attempts, f'{type(e).__name__}: {e}'))
+    queue.finish(done, failed, current_app.config['PREVIEW_MAX_ATTEMPTS'])
+
+    # 會議頁面顯示縮圖與文字摘要，產生後遞增所屬會議的版本
+    previewed = [sha256 for sha256, thumbnail, text in done if thumbnail or text]
+    if previewed:
+        db.session.execute(update(Meeting).where(Meeting.id.in_(
+            select(Attachment.meeting_id).where(Attachment.sha256.in_(previewed)).scalar_subquery()))
+            .values(version=Meeting.version + 1).execution_options(synchronize_session=False))
+        db.session.commit()
+
+    extracted = [sha256 for sha256, _, text in done if text]
+    if extracted:
+        for handler in text_extracted_handlers:
+            handler(extracted)
+
+
+def new_pool(current_app):
+    # 以 spawn 建立工作行程，不繼承此行程的執行緒與資料庫連線，並定期更換以釋放解析檔案佔用的記憶體
+    options = {'max_tasks_per_child': MAX_TASKS_PER_CHILD} if POOL_RECYCLES_CHILDREN else {}
+    return ProcessPoolExecutor(max_workers=current_app.config['PREVIEW_WORKERS'], mp_context=get_context('spawn'),
+                               **options)
+
+
+def drain_queue(current_app):
+    """
+    處理佇列中所有待處理的工作，有工作時才建立行程池
+    :param current_app: Flask 實例
+    :return: 處理的工作數
+    """
+    processed = 0
+    batch_size = current_app.config['PREVIEW_WORKERS'] * 2
+    batch = queue.claim(batch_size)
+    while batch:
+        with new_pool(current_app) as pool:
+            submitted = 0
+            while batch and (POOL_RECYCLES_CHILDREN
+                             or submitted < MAX_TASKS_PER_CHILD * current_app.config['PREVIEW_WORKERS']):
+                process_batch(current_app, pool, batch)
+                processed += len(batch)
+                submitted += len(batch)
+                batch = queue.claim(batch_size)
+    return processed
+
+
+# 背景預覽程序：取出待處理的工作交給行程池，產生縮圖與擷取文字 (用於異步處理)
+previewer = jobs.Workers('Previewer', drain_queue, 'PREVIEW_QUEUE_INTERVAL')
+
+
+def start_previewer():
+    """
+    啟動此行程的背景預覽程序（若尚未啟動）
+    """
+    previewer.start()
+
+
+@app.before_request
+def resume_previewer():
+    previewer.resume(lambda: queue.status().pending, start_previewer)
+
+
+def extracted_text(sha256):
+    """
+    讀取附件內容擷取的文字
+    :param sha256: 檔案內容的 SHA-256
+    :return: 文字，尚未擷取或無文字時為 None
+    """
+    try:
+        with open(preview_path(sha256, 'txt'), encoding='utf-8') as file:
+            return file.read()
+    except FileNotFoundError:
+        return None
+
+
+@app.template_global()
+def attachment_preview(attachment):
+    """
+    會議頁面顯示的附件預覽
+    :param attachment: Attachment 物件
+    :return: Preview（縮圖網址或 None、文字摘要或 None）
+    """
+    if not attachment.sha256:
+        return Preview(None, None)
+    thumbnail = url_for('attachment_thumbnail', file_id=attachment.id) \
+        if os.path.exists(preview_path(attachment.sha256, 'jpg')) else None
+    try:
+        with open(preview_path(attachment.sha256, 'txt'), encoding='utf-8') as file:
+            excerpt = ' '.join(file.read(EXCERPT_LENGTH).split())
+    except FileNotFoundError:
+        excerpt = None
+    return Preview(thumbnail, excerpt)
+
+
+def extension_of(filename):
+    return filename.rpartition('.')[2].lower() if '.' in filename else ''
+
+
+@event.listens_for(db.session, 'after_flush')
+def collect_previews(session, flush_context):
+    """
+    記錄此次 flush 中新增或移入檔案庫的附件內容，待交易提交後再加入預覽工作
+    """
+    pending = session.info.setdefault('preview_pending', {})
+    for obj in session.new | session.dirty:
+        if isinstance(obj, Attachment) and obj.sha256 and (
+                obj in session.new or inspect(obj).attrs.sha256.history.has_changes()):
+            pending.setdefault(obj.sha256, extension_of(obj.filename))
+
+
+@event.listens_for(db.session, 'after_commit')
+def enqueue_previews(session):
+    pending = session.info.pop('preview_pending', None)
+    if pending:
+        queue.enqueue(pending)
+        start_previewer()
+        previewer.wake()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_previews(session):
+    session.info.pop('preview_pending', None)
+
+
+def remove_previews(sha256):
+    for suffix in ('jpg', 'txt'):
+        try:
+            os.remove(preview_path(sha256, suffix))
+        except FileNotFoundError:
+            pass
+
+
+@app.cli.command('previews')
+@click.option('--backfill', is_flag=True, help='為尚未處理的附件內容加入預覽工作')
+@click.option('--prune', is_flag=True, help='刪除已不在檔案庫中的內容的預覽')
+@click.option('--retry-failed', is_flag=True, help='將處理失敗的工作重新放回佇列')
+@click.option('--run', is_flag=True, help='立即處理所有待處理的工作')
+def previews_command(backfill, prune, retry_failed, run):
+    """
+    顯示附件預覽工作狀態
+    """
+    if backfill:
+        jobs = {}
+        for sha256, filename in db.session.query(Attachment.sha256, Attachment.filename) \
+                .filter(Attachment.sha256.isnot(None)):
+            jobs.setdefault(sha256, extension_of(filename))
+        queue.enqueue(jobs)
+        click.echo(f'已檢查 {len(jobs)} 份附件內容')
+    if prune:
+        removed = queue.prune({sha256 for sha256, in db.session.query(Blob.sha256)})
+        for sha256 in removed:
+            remove_previews(sha256)
+        click.echo(f'已刪除 {len(removed)} 份內容的預覽')
+    if retry_failed:
+        click.echo(f'已將 {queue.retry_failed()} 個失敗的工作重新放回佇列')
+    if run:
+        click.echo(f'已處理 {drain_queue(app)} 個工作')
+    status = queue.status()
+    click.echo(f'待處理 {status.pending} 個，已完成 {status.done} 個，失敗 {status.failed} 個')
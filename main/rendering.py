@@ -0,0 +1,188 @@
+import os
+from collections import OrderedDict
+from glob import glob
+from itertools import chain
+from threading import Lock
+
+from flask import render_template
+from sqlalchemy import event, inspect, or_, select, union
+
+from main import app, db
+from main.models import Meeting, Attendee, Announcement, Motion, Extempore, Attachment, Person
+
+MEETING_CHILDREN = (Attendee, Announcement, Motion, Extempore, Attachment)
+# 會議紀錄、會議區塊與會議 API 中顯示的人員欄位，修改時遞增相關會議的版本
+PERSON_ATTRIBUTES = ('name',)
+
+
+class RenderCache:
+    """
+    會議紀錄與開會通知的渲染快取
+    記憶體中以 (會議編號, 會議版本, 是否為開會通知) 為鍵值，超過容量時淘汰最久未使用的項目；
+    已封存的會議另存快照於磁碟，檔名包含會議版本，只讀取與目前版本相同的快照
+    """
+
+    def __init__(self, capacity, snapshot_folder):
+        self.capacity = capacity
+        self.snapshot_folder = snapshot_folder
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+            return html
+
+    def put(self, key, html):
+        with self._lock:
+            self._entries[key] = html
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def snapshot_path(self, meeting_id, version, agenda):
+        return os.path.join(self.snapshot_folder, f'{meeting_id}-{"agenda" if agenda else "minute"}-{version}.html')
+
+    def read_snapshot(self, meeting_id, version, agenda):
+        try:
+            with open(self.snapshot_path(meeting_id, version, agenda), encoding='utf-8') as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def write_snapshot(self, meeting_id, version, agenda, html):
+        # 先寫入暫存檔再更名，讀取端不會讀到寫到一半的快照；
+        # 以舊版本寫入的快照不會被讀取，其他版本的快照寫入後即刪除
+        snapshot_path = self.snapshot_path(meeting_id, version, agenda)
+        if os.path.exists(snapshot_path):
+            return
+        temp_path = f'{snapshot_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            file.write(html)
+        os.replace(temp_path, snapshot_path)
+        for other_path in glob(self.snapshot_path(meeting_id, '*', agenda)):
+            if other_path != snapshot_path:
+                try:
+                    os.remove(other_path)
+                except FileNotFoundError:
+                    pass
+
+    def remove_snapshots(self, meeting_id):
+        for snapshot_path in glob(os.path.join(self.snapshot_folder, f'{meeting_id}-*.html')):
+            try:
+                os.remove(snapshot_path)
+            except FileNotFoundError:
+                pass
+
+
+cache = RenderCache(app.config['RENDER_CACHE_SIZE'], app.config['SNAPSHOT_FOLDER'])
+
+
+def render_minute(meeting, agenda=False):
+    """
+    渲染會議紀錄或開會通知，同一版本的會議只渲染一次
+    :param meeting: 會議（建議以 Meeting.query_full() 載入）
+    :param agenda: True 為開會通知，False 為會議紀錄
+    :return: HTML 字串
+    """
+    key = (meeting.id, meeting.version, agenda)
+    html = cache.get(key)
+    if html is None:
+        html = render_template('components/mail-meeting-minute.html', meeting=meeting, agenda=agenda)
+        cache.put(key, html)
+    if meeting.archived:
+        cache.write_snapshot(meeting.id, meeting.version, agenda, html)
+    return html
+
+
+def cached_minute(meeting_id, agenda=False):
+    """
+    依會議編號取得渲染結果：只查詢會議版本，已封存的會議讀取同一版本的快照，快取與快照都沒有時才載入完整會議
+    :param meeting_id: 會議編號
+    :param agenda: True 為開會通知，False 為會議紀錄
+    :return: HTML 字串
+    """
+    version, archived = db.session.query(Meeting.version, Meeting.archived).filter_by(id=meeting_id).first_or_404()
+    html = cache.get((meeting_id, version, agenda))
+    if html is None and archived:
+        html = cache.read_snapshot(meeting_id, version, agenda)
+        if html is not None:
+            cache.put((meeting_id, version, agenda), html)
+    if html is None:
+        return render_minute(Meeting.query_full().filter_by(id=meeting_id).first_or_404(), agenda)
+    if archived:
+        cache.write_snapshot(meeting_id, version, agenda, html)
+    return html
+
+
+def _touched_meeting_ids(session):
+    """
+    找出此次 flush 中會議本身或其子項目有異動的會議
+    :param session: SQLAlchemy Session
+    :return: 會議編號集合
+    """
+    meeting_ids = set()
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, Meeting):
+            if obj in session.dirty and not session.is_modified(obj, include_collections=False):
+                continue
+            meeting_ids.add(inspect(obj).identity[0] if obj in session.deleted else obj.id)
+        elif isinstance(obj, MEETING_CHILDREN):
+            if obj in session.dirty and not session.is_modified(obj, include_collections=False):
+                continue
+            meeting_ids.add(obj.meeting_id)
+            meeting_ids.update(meeting.id for meeting in inspect(obj).attrs.meeting.history.deleted or () if meeting)
+    meeting_ids.discard(None)
+    return meeting_ids
+
+
+def _person_meeting_ids(session):
+    """
+    找出此次 flush 中顯示的人員欄位（PERSON_ATTRIBUTES）有修改的人員所擔任主席、紀錄或與會人員的會議
+    :param session: SQLAlchemy Session
+    :return: 會議編號集合
+    """
+    person_ids = [obj.id for obj in session.dirty if isinstance(obj, Person) and any(
+        inspect(obj).attrs[key].history.has_changes() for key in PERSON_ATTRIBUTES)]
+    if not person_ids:
+        return set()
+    meeting = Meeting.__table__
+    attendee = Attendee.__table__
+    query = union(select(meeting.c.id).where(or_(meeting.c.chair_id.in_(person_ids),
+                                                 meeting.c.minute_taker_id.in_(person_ids))),
+                  select(attendee.c.meeting_id).where(attendee.c.person_id.in_(person_ids)))
+    return set(session.connection().execute(query).scalars())
+
+
+@event.listens_for(db.session, 'after_flush')
+def bump_versions(session, flush_context):
+    """
+    會議或其子項目寫入，或會議中顯示的人員資料修改時，在同一交易內遞增會議版本
+    """
+    meeting_ids = _touched_meeting_ids(session) | _person_meeting_ids(session)
+    if meeting_ids:
+        table = Meeting.__table__
+        session.connection().execute(table.update().where(table.c.id.in_(sorted(meeting_ids)))
+                                     .values(version=table.c.version + 1))
+        session.info.setdefault('render_touched', set()).update(meeting_ids)
+
+
+@event.listens_for(db.session, 'after_flush_postexec')
+def expire_versions(session, flush_context):
+    for meeting_id in session.info.get('render_touched', ()):
+        meeting = session.identity_map.get(inspect(Meeting).identity_key_from_primary_key([meeting_id]))
+        if meeting is not None and meeting not in session.deleted:
+            session.expire(meeting, ['version'])
+
+
+@event.listens_for(db.session, 'after_commit')
+def remove_snapshots(session):
+    for meeting_id in session.info.pop('render_touched', ()):
+        cache.remove_snapshots(meeting_id)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_touched(session):
+    session.info.pop('render_touched', None)
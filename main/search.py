@@ -0,0 +1,380 @@
+import json
+import re
+from collections import namedtuple
+from contextlib import closing
+
+import click
+from markupsafe import Markup, escape
+from sqlalchemy import event, inspect
+
+from main import app, db, jobs, previews
+from main.models import Meeting, Announcement, Motion, Extempore, Attachment
+
+CJK_CHARS = '㐀-䶿一-鿿豈-﫿'
+CJK_RUN_PATTERN = re.compile(f'[{CJK_CHARS}]+')
+TERM_PATTERN = re.compile(f'[{CJK_CHARS}]+|[^\\W{CJK_CHARS}]+')
+
+SNIPPET_RADIUS = 40
+
+SearchHit = namedtuple('SearchHit', ['meeting', 'snippet'])
+SearchResult = namedtuple('SearchResult', ['hits', 'total', 'page', 'pages'])
+
+
+def tokenize(text):
+    """
+    將文字切分為索引詞：中日韓文字以相鄰兩字（bigram）為一詞，並補上每段的最後一字；其他文字以單字為一詞
+    例如「開會紀錄」切分為「開會 會紀 紀錄 錄」，因此任一字或任一連續片段都能被查到
+    :param text: 文字
+    :return: 索引詞列表
+    """
+    tokens = []
+    for run in TERM_PATTERN.findall(text.lower()):
+        if CJK_RUN_PATTERN.fullmatch(run):
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+            tokens.append(run[-1])
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def build_match_query(query):
+    """
+    將搜尋字串轉換為 FTS5 MATCH 語法，各段落皆須符合（AND）
+    :param query: 搜尋字串
+    :return: MATCH 語法字串，沒有可搜尋的字詞時為 None
+    """
+    phrases = []
+    for run in TERM_PATTERN.findall(query.lower()):
+        if CJK_RUN_PATTERN.fullmatch(run) and len(run) > 1:
+            phrases.append('"' + ' '.join(run[i:i + 2] for i in range(len(run) - 1)) + '"')
+        else:
+            phrases.append(f'"{run}"*')
+    return ' '.join(phrases) if phrases else None
+
+
+def highlight(text, query):
+    """
+    擷取文字中第一個符合搜尋字詞的片段，並以 <mark> 標示所有符合的字詞
+    :param text: 原始文字
+    :param query: 搜尋字串
+    :return: 已跳脫 HTML 的片段
+    """
+    terms = sorted(set(TERM_PATTERN.findall(query)), key=len, reverse=True)
+    if not terms:
+        return escape(text[:SNIPPET_RADIUS * 2])
+    pattern = re.compile('|'.join(map(re.escape, terms)), re.IGNORECASE)
+
+    match = pattern.search(text)
+    start = max(match.start() - SNIPPET_RADIUS, 0) if match else 0
+    end = min(start + SNIPPET_RADIUS * 2 + (match.end() - match.start() if match else 0), len(text))
+    fragment = text[start:end]
+
+    parts = []
+    last = 0
+    for m in pattern.finditer(fragment):
+        parts.append(escape(fragment[last:m.start()]))
+        parts.append(Markup('<mark>') + escape(m.group()) + Markup('</mark>'))
+        last = m.end()
+    parts.append(escape(fragment[last:]))
+    return Markup('...' if start > 0 else '') + Markup('').join(parts) + Markup('...' if end < len(text) else '')
+
+
+def document_of(obj):
+    """
+    產生模型物件對應的索引文件
+    :param obj: Meeting、Announcement、Motion、Extempore 或 Attachment 物件
+    :return: (文件鍵值, 會議編號, 文字內容)
+    """
+    if isinstance(obj, Meeting):
+        return f'meeting:{obj.id}', obj.id, '\n'.join(filter(None, [obj.title, obj.chair_speech]))
+    if isinstance(obj, Motion):
+        return f'motion:{obj.id}', obj.meeting_id, '\n'.join(
+            filter(None, [obj.description, obj.content, obj.resolution, obj.execution]))
+    if isinstance(obj, Attachment):
+        # 附件以原始檔名與背景擷取的文字建立索引，文字擷取完成後由 main.previews 重新加入佇列
+        return f'attachment:{obj.id}', obj.meeting_id, '\n'.join(
+            filter(None, [obj.filename.split('-', 1)[1], previews.extracted_text(obj.sha256) if obj.sha256 else None]))
+    return f'{type(obj).__name__.lower()}:{obj.id}', obj.meeting_id, obj.content
+
+
+class SearchIndex(jobs.LocalQueue):
+    """
+    會議內容全文檢索索引，以 SQLite FTS5 儲存於本機檔案
+    文件存放於 doc 資料表，FTS5 的 document 表以其為外部內容（external content），由觸發器同步；
+    queue 資料表為待更新文件的佇列，同一文件多次異動只保留一筆
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS doc (
+            id INTEGER PRIMARY KEY,
+            doc_key TEXT NOT NULL UNIQUE,
+            meeting_id INTEGER NOT NULL,
+            terms TEXT NOT NULL,
+            content TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS doc_meeting_id ON doc (meeting_id);
+        CREATE VIRTUAL TABLE IF NOT EXISTS document USING fts5(
+            terms, content='doc', content_rowid='id', tokenize='unicode61'
+        );
+        CREATE TRIGGER IF NOT EXISTS doc_insert AFTER INSERT ON doc BEGIN
+            INSERT INTO document (rowid, terms) VALUES (new.id, new.terms);
+        END;
+        CREATE TRIGGER IF NOT EXISTS doc_delete AFTER DELETE ON doc BEGIN
+            INSERT INTO document (document, rowid, terms) VALUES ('delete', old.id, old.terms);
+        END;
+        CREATE TABLE IF NOT EXISTS queue (
+            doc_key TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 1
+        );
+    """
+
+    def update(self, documents=(), deleted_keys=(), deleted_meetings=()):
+        """
+        更新索引文件
+        :param documents: 新增或修改的文件 [(文件鍵值, 會議編號, 文字內容)]
+        :param deleted_keys: 刪除的文件鍵值
+        :param deleted_meetings: 刪除的會議編號（連同其所有文件）
+        """
+        with closing(self.connect()) as connection, connection:
+            self._write(connection, documents, deleted_keys, deleted_meetings)
+
+    @staticmethod
+    def _write(connection, documents, deleted_keys, deleted_meetings):
+        documents = [document for document in documents if document[1] not in deleted_meetings]
+        connection.executemany('DELETE FROM doc WHERE doc_key = ?',
+                               [(key,) for key in [document[0] for document in documents] + list(deleted_keys)])
+        connection.executemany('DELETE FROM doc WHERE meeting_id = ?',
+                               [(meeting_id,) for meeting_id in deleted_meetings])
+        connection.executemany('INSERT INTO doc (doc_key, meeting_id, terms, content) VALUES (?, ?, ?, ?)',
+                               [(key, meeting_id, ' '.join(tokenize(content or '')), content or '')
+                                for key, meeting_id, content in documents])
+
+    def enqueue(self, keys):
+        """
+        將需要更新的文件加入佇列
+        :param keys: 文件鍵值
+        """
+        with closing(self.connect()) as connection, connection:
+            connection.executemany('INSERT INTO queue (doc_key) VALUES (?) '
+                                   'ON CONFLICT (doc_key) DO UPDATE SET version = version + 1',
+                                   [(key,) for key in keys])
+
+    def queue_size(self):
+        with closing(self.connect()) as connection:
+            return connection.execute('SELECT COUNT(*) FROM queue').fetchone()[0]
+
+    def process_queue(self, load, batch_size):
+        """
+        取出一批佇列中的文件並更新索引，與移出佇列在同一個 SQLite 交易中完成，
+        多個行程同時處理時也不會重複處理或遺漏
+        :param load: 依文件鍵值載入文件的函式，回傳 (文件, 刪除的文件鍵值, 刪除的會議編號)
+        :param batch_size: 每批文件數
+        :return: 處理的文件數
+        """
+        with self.immediate() as connection:
+            batch = connection.execute('SELECT doc_key, version FROM queue LIMIT ?', [batch_size]).fetchall()
+            if batch:
+                self._write(connection, *load([key for key, _ in batch]))
+                connection.executemany('DELETE FROM queue WHERE doc_key = ? AND version = ?', batch)
+        return len(batch)
+
+    def clear(self):
+        with closing(self.connect()) as connection, connection:
+            connection.execute('DELETE FROM doc')
+            connection.execute("INSERT INTO document (document) VALUES ('rebuild')")
+
+    def search(self, query, meeting_ids=None, page=1, per_page=20):
+        """
+        搜尋會議，依會議中最相關文件的相關程度（BM25）排序，每場會議只列出一次
+        分組、排序與分頁都在 SQLite 中完成，總數與頁數涵蓋所有符合的會議
+        :param query: 搜尋字串
+        :param meeting_ids: 可檢視的會議編號，None 表示不限制
+        :param page: 頁碼（從 1 開始）
+        :param per_page: 每頁筆數
+        :return: ([(會議編號, 片段)], 符合的會議總數)
+        """
+        match = build_match_query(query)
+        if not match or meeting_ids is not None and not meeting_ids:
+            return [], 0
+
+        hits = 'SELECT doc.meeting_id, doc.id, document.rank AS rank FROM document ' \
+               'JOIN doc ON doc.id = document.rowid WHERE document MATCH ?'
+        params = [match]
+        if meeting_ids is not None:
+            hits += ' AND doc.meeting_id IN (SELECT value FROM json_each(?))'
+            params.append(json.dumps(list(meeting_ids)))
+
+        with closing(self.connect()) as connection:
+            total = connection.execute(f'SELECT COUNT(DISTINCT meeting_id) FROM ({hits})', params).fetchone()[0]
+            # SQLite 的 MIN() 聚合會讓同一列的其他欄位（id）取自最小值所在的資料列，即每場會議最相關的文件
+            rows = connection.execute(
+                f'SELECT meeting_id, id, MIN(rank) FROM ({hits}) GROUP BY meeting_id '
+                f'ORDER BY MIN(rank), meeting_id LIMIT ? OFFSET ?',
+                params + [per_page, (page - 1) * per_page]).fetchall()
+            contents = dict(connection.execute(
+                'SELECT id, content FROM doc WHERE id IN (SELECT value FROM json_each(?))',
+                [json.dumps([doc_id for _, doc_id, _ in rows])]))
+
+        return [(meeting_id, highlight(contents[doc_id], query)) for meeting_id, doc_id, _ in rows], total
+
+
+index = SearchIndex(app.config['SEARCH_INDEX_PATH'])
+
+
+def search_meetings(query, meeting_ids=None, page=1):
+    """
+    搜尋會議內容並載入對應的會議
+    :param query: 搜尋字串
+    :param meeting_ids: 可檢視的會議編號，None 表示不限制
+    :param page: 頁碼（從 1 開始）
+    :return: SearchResult
+    """
+    start_indexer()
+    per_page = app.config['SEARCH_RESULTS_PER_PAGE']
+    rows, total = index.search(query, meeting_ids, page, per_page)
+    meetings = Meeting.query_full().filter(Meeting.id.in_([meeting_id for meeting_id, _ in rows]))
+    meetings = {meeting.id: meeting for meeting in meetings}
+    hits = [SearchHit(meetings[meeting_id], snippet) for meeting_id, snippet in rows if meeting_id in meetings]
+    return SearchResult(hits, total, page, max((total + per_page - 1) // per_page, 1))
+
+
+DOCUMENT_MODELS = {
+    'meeting': Meeting,
+    'announcement': Announcement,
+    'motion': Motion,
+    'extempore': Extempore,
+    'attachment': Attachment,
+}
+
+INDEXED_ATTRIBUTES = {
+    Meeting: ['title', 'chair_speech'],
+    Announcement: ['content'],
+    Motion: ['description', 'content', 'resolution', 'execution'],
+    Extempore: ['content'],
+    Attachment: ['filename', 'sha256'],
+}
+
+
+def load_documents(keys):
+    """
+    依文件鍵值從資料庫載入最新內容，每種模型一次 IN 查詢
+    :param keys: 文件鍵值
+    :return: (文件列表, 已刪除的文件鍵值, 已刪除的會議編號)
+    """
+    ids = {kind: set() for kind in DOCUMENT_MODELS}
+    for key in keys:
+        kind, obj_id = key.split(':')
+        ids[kind].add(int(obj_id))
+
+    documents = []
+    deleted_keys = set()
+    deleted_meetings = set()
+    for kind, model in DOCUMENT_MODELS.items():
+        if not ids[kind]:
+            continue
+        found = model.query.filter(model.id.in_(ids[kind])).all()
+        documents.extend(document_of(obj) for obj in found)
+        missing = ids[kind] - {obj.id for obj in found}
+        if model is Meeting:
+            deleted_meetings.update(missing)
+        else:
+            deleted_keys.update(f'{kind}:{obj_id}' for obj_id in missing)
+    return documents, deleted_keys, deleted_meetings
+
+
+def drain_queue(current_app):
+    """
+    分批取出佇列中的文件並更新索引，直到佇列清空
+    :param current_app: Flask 實例
+    """
+    while index.process_queue(load_documents, current_app.config['SEARCH_INDEX_BATCH_SIZE']):
+        pass
+
+
+# 背景索引程序 (用於異步處理)
+indexer = jobs.Workers('Search indexer', drain_queue, 'SEARCH_INDEX_INTERVAL')
+
+
+def start_indexer():
+    """
+    啟動此行程的背景索引程序（若尚未啟動）
+    """
+    indexer.start()
+
+
+def reindex_attachments(sha256s):
+    """
+    附件內容擷取到文字後，重新索引使用該內容的附件
+    :param sha256s: 內容的 SHA-256 列表
+    """
+    index.enqueue(f'attachment:{attachment_id}' for attachment_id, in
+                  db.session.query(Attachment.id).filter(Attachment.sha256.in_(sha256s)))
+    start_indexer()
+
+
+previews.text_extracted_handlers.append(reindex_attachments)
+
+
+def rebuild_index(progress=None, chunk_size=500):
+    """
+    從資料庫重建全部索引
+    :param progress: 進度回呼函式，參數為此次處理的文件數
+    :param chunk_size: 每次寫入的文件數
+    """
+    index.clear()
+    for model in DOCUMENT_MODELS.values():
+        documents = []
+        for obj in model.query.order_by(model.id).yield_per(chunk_size):
+            documents.append(document_of(obj))
+            if len(documents) == chunk_size:
+                index.update(documents)
+                if progress:
+                    progress(len(documents))
+                documents = []
+        index.update(documents)
+        if progress:
+            progress(len(documents))
+
+
+@app.cli.command('reindex')
+def reindex_command():
+    """
+    重建全文檢索索引
+    """
+    total = sum(model.query.count() for model in DOCUMENT_MODELS.values())
+    with click.progressbar(length=total, label='重建索引') as bar:
+        rebuild_index(progress=bar.update)
+    click.echo(f'已索引 {total} 份文件，佇列中尚有 {index.queue_size()} 份待更新')
+
+
+@event.listens_for(db.session, 'after_flush')
+def collect_changes(session, flush_context):
+    """
+    記錄此次 flush 中需要更新索引的文件，待交易提交後再加入佇列
+    """
+    pending = session.info.setdefault('search_pending', set())
+    for obj in session.new | session.dirty:
+        attributes = INDEXED_ATTRIBUTES.get(type(obj))
+        if attributes is None:
+            continue
+        state = inspect(obj)
+        if obj in session.dirty and not any(state.attrs[key].history.has_changes() for key in attributes):
+            continue
+        pending.add(f'{type(obj).__name__.lower()}:{obj.id}')
+
+    for obj in session.deleted:
+        if type(obj) in INDEXED_ATTRIBUTES:
+            pending.add(f'{type(obj).__name__.lower()}:{inspect(obj).identity[0]}')
+
+
+@event.listens_for(db.session, 'after_commit')
+def enqueue_changes(session):
+    pending = session.info.pop('search_pending', None)
+    if pending:
+        index.enqueue(pending)
+        start_indexer()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_changes(session):
+    session.info.pop('search_pending', None)
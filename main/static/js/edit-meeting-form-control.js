@@ -1,5 +1,13 @@
 let meeting_id;
 
+// Versions of the rows loaded from the server, used for optimistic checks when autosaving
+const AUTOSAVE_DELAY = 2000;
+let autosaveVersions = {};
+let autosaveTimers = {};
+// Fields edited since the last PATCH of each row, merged so that a quick edit of another field is not lost
+let autosavePending = {};
+let autosaveInFlight = {};
+
 jQuery.validator.addMethod('duplicate-filename', function (value, element) {
     let filenameList = [];
     $('#savedFiles').children().each(function () {
@@ -23,61 +31,36 @@ $(document).ready(function () {
             timeInput.val(datetime.substring(0, datetime.length - 1));
             locationInput.val(data['location']);
             typeInput.val(data['type']);
-            chairInput.val(data['chair']);
-            minuteTakerInput.val(data['minuteTaker']);
-            attendeeInput.val(data['attendee']);
-            guestInput.val(data['guest']);
-
-            // disable click process
-            let chairBar = chairInput.children();
-            let minuteTakerBar = minuteTakerInput.children();
-            let attendeeBar = attendeeInput.children();
-            let guestBar = guestInput.children();
-            chairInput.children().each(function () {
-                let value = $(this).val();
-                let index = $(this).index();
-
-                if (data['chair'] === parseInt(value)) {
-                    oldChairIndex = index;
-                    minuteTakerBar[index].disabled = true;
-                    attendeeBar[index - 1].disabled = true;
-                    guestBar[index - 1].disabled = true;
-                } else if (data['minuteTaker'] === parseInt(value)) {
-                    oldMinuteTakerIndex = index;
-                    chairBar[index].disabled = true;
-                    attendeeBar[index - 1].disabled = true;
-                    guestBar[index - 1].disabled = true;
-                } else if (data['attendee'][0] === parseInt(value)) {
-                    data['attendee'].shift();
-                    chairBar[index].disabled = true;
-                    minuteTakerBar[index].disabled = true;
-                    guestBar[index - 1].disabled = true;
-                } else if (data['guest'][0] === parseInt(value)) {
-                    data['guest'].shift();
-                    chairBar[index].disabled = true;
-                    minuteTakerBar[index].disabled = true;
-                    attendeeBar[index - 1].disabled = true;
-                }
-            })
-            $('.selectpicker').selectpicker('refresh');
-            appendPresentTag();
-            $('.attendanceCheck').each(function () {
-                if (parseInt(this.id.split('-')[1]) === data['is_present'][0]) {
-                    data['is_present'].shift();
-                } else {
-                    $(this).click()
-                }
-            });
+            loadPersonOptions([data['chair'], data['minuteTaker']].concat(data['attendee'], data['guest']))
+                .then(function () {
+                    chairInput.val(data['chair']);
+                    minuteTakerInput.val(data['minuteTaker']);
+                    attendeeInput.val(data['attendee']);
+                    guestInput.val(data['guest']);
+                    syncPersonOptions();
+                    appendPresentTag();
+                    // Set the loaded state directly; clicking would autosave every absent person
+                    $('.attendanceCheck').each(function () {
+                        setAttendance($(this), data['is_present'].includes(parseInt(this.id.split('-')[1])));
+                    });
+                });
+            for (const [personId, version] of Object.entries(data['autosave']['attendees'])) {
+                autosaveVersions['attendee-' + personId] = version;
+            }
             chairSpeechInput.text(data['chair_speech']);
 
             for (let i = 0; i < data['announcements'].length; i++) {
                 newAnnouncementBtn.click();
-                $('textarea[name="AnnouncementContent-' + i + '"]').text(data['announcements'][i]);
+                let announcement = data['autosave']['announcements'][i];
+                $('textarea[name="AnnouncementContent-' + i + '"]').text(data['announcements'][i])
+                    .attr('data-item-id', announcement['id']);
+                autosaveVersions['announcement-' + announcement['id']] = announcement['version'];
             }
             for (let i = 0; i < data['motions'].length; i++) {
                 newMotionBtn.click();
                 let motion = data['motions'][i];
-                $('input[name="MotionDescription-' + i + '"]').val(motion['description']);
+                $('input[name="MotionDescription-' + i + '"]').val(motion['description']).attr('data-motion-id', motion['id']);
+                autosaveVersions['motion-' + motion['id']] = motion['version'];
                 $('select[name="MotionStatus-' + i + '"]').val(motion['status']).selectpicker('refresh');
                 $('textarea[name="MotionContent-' + i + '"]').val(motion['content']);
                 $('textarea[name="MotionResolution-' + i + '"]').val(motion['resolution']);
@@ -85,7 +68,10 @@ $(document).ready(function () {
             }
             for (let i = 0; i < data['extempore'].length; i++) {
                 newExtemporeBtn.click();
-                $('textarea[name="ExtemporeContent-' + i + '"]').text(data['extempore'][i]);
+                let extempore = data['autosave']['extempores'][i];
+                $('textarea[name="ExtemporeContent-' + i + '"]').text(data['extempore'][i])
+                    .attr('data-item-id', extempore['id']);
+                autosaveVersions['extempore-' + extempore['id']] = extempore['version'];
             }
 
             data['files'].forEach(function (fileObj) {
@@ -139,7 +125,7 @@ $('#editMeetingBtn').on('click', function () {
         return;
     }
 
-    // formData contains: { json_form: body_form_save_as_json, attachments: FileList }
+    // formData contains: { json_form: body_form_save_as_json }
     let formData = new FormData();
     let meetingForm = {};
 
@@ -158,7 +144,8 @@ $('#editMeetingBtn').on('click', function () {
     let extemporeList = [];
 
     $('#pAnnouncement').children('div').each(function () {
-        announcementList.push($(this).children().val());
+        let content = $(this).children();
+        announcementList.push({'id': content.attr('data-item-id') || '', 'content': content.val()});
     })
 
     let present = [];
@@ -173,6 +160,7 @@ $('#editMeetingBtn').on('click', function () {
     for (let i = 0; i < motionRaw.length / 6; i++) {
         let head = i * 6;
         motionList.push({
+            'MotionId': motionRaw[head].dataset.motionId,
             'MotionDescription': motionRaw[head].value,
             'MotionStatus': motionRaw[head + 2].value,
             'MotionContent': motionRaw[head + 3].value,
@@ -182,38 +170,52 @@ $('#editMeetingBtn').on('click', function () {
     }
 
     $('#pExtempore').children('div').each(function () {
-        extemporeList.push($(this).children().val());
+        let content = $(this).children();
+        extemporeList.push({'id': content.attr('data-item-id') || '', 'content': content.val()});
     })
 
     meetingForm['announcement'] = announcementList;
     meetingForm['motion'] = motionList;
     meetingForm['extempore'] = extemporeList;
 
-    formData.append('json_form', JSON.stringify(meetingForm));
-
+    // Disable the button until the submission finishes so attachments are not uploaded twice
+    const submitButton = $(this).prop('disabled', true);
     let attachments = document.getElementById('mAttachmentInput').files;
-    for (let i = 0; i < attachments.length; i++) {
-        formData.append('files[]', attachments[i]);
-    }
+    uploadFiles(attachments).then(function (uploadIds) {
+        // Attachments are uploaded in chunks beforehand, the form only carries their upload IDs
+        meetingForm['uploads'] = uploadIds;
+        formData.append('json_form', JSON.stringify(meetingForm));
 
-    $.ajax({
-        'type': 'POST',
-        'dataType': 'json',
-        'mimeType': 'multipart/form-data',
-        'url': $SCRIPT_ROOT + '/edit/meeting/' + meeting_id,
-        'data': formData,
-        'success': (data) => {
-            if (data['message'] === 'Success') {
-                // Redirect to homepage if the submission is successful
-                window.location.href = '/meeting/' + meeting_id;
-                console.log('success')
-            } else {
-                // TODO: If validation failed -> show error message
-                console.log(data['message']);
-            }
-        },
-        'contentType': false,
-        'processData': false,
+        $.ajax({
+            'type': 'POST',
+            'dataType': 'json',
+            'mimeType': 'multipart/form-data',
+            'url': $SCRIPT_ROOT + '/edit/meeting/' + meeting_id,
+            'data': formData,
+            'success': (data) => {
+                if (data['message'] === 'Success') {
+                    // Redirect to homepage if the submission is successful
+                    window.location.href = '/meeting/' + meeting_id;
+                    console.log('success')
+                } else {
+                    // TODO: If validation failed -> show error message
+                    console.log(data['message']);
+                    submitButton.prop('disabled', false);
+                }
+            },
+            'error': () => {
+                submitButton.prop('disabled', false);
+            },
+            'contentType': false,
+            'processData': false,
+        });
+    }).catch(function (error) {
+        // Show the upload failure in the error alert at the bottom and let the user submit again
+        console.log(error);
+        $('#newMeetingFormError').removeClass('d-none').children().children('div')
+            .html('附件上傳失敗，請檢查網路連線後再送出一次');
+        $('#meetingFormArea').animate({scrollTop: 10000}, 1);
+        submitButton.prop('disabled', false);
     });
 });
 
@@ -232,4 +234,92 @@ $('#savedFiles').on('click', 'div > div > div', function () {
             }
         },
     });
-});
\ No newline at end of file
+});
+function autosave(key, url, body) {
+    // Send a small PATCH for a single row after the user stops typing
+    clearTimeout(autosaveTimers[key]);
+    autosavePending[key] = Object.assign(autosavePending[key] || {}, body);
+    autosaveTimers[key] = setTimeout(function () {
+        if (autosaveInFlight[key]) {
+            // Wait for the previous PATCH so this one carries the version it returns
+            autosave(key, url, {});
+            return;
+        }
+        autosaveInFlight[key] = true;
+        body = autosavePending[key];
+        delete autosavePending[key];
+        body['version'] = autosaveVersions[key];
+        $.ajax({
+            'type': 'PATCH',
+            'url': $SCRIPT_ROOT + url,
+            'contentType': 'application/json',
+            'data': JSON.stringify(body),
+            'dataType': 'json',
+            'success': (data) => {
+                autosaveVersions[key] = data['version'];
+            },
+            'error': (xhr) => {
+                if (xhr.status === 409) {
+                    // The row was changed by someone else; further autosaves of it would fail as well
+                    $('#autosaveConflict').removeClass('d-none');
+                } else {
+                    console.log(xhr.statusText);
+                }
+            },
+            'complete': () => {
+                autosaveInFlight[key] = false;
+            }
+        });
+    }, AUTOSAVE_DELAY);
+}
+
+$('#pMotion').on('input change', '.motion-form', function () {
+    if (!this.name) {
+        return;
+    }
+    const [field, index] = this.name.split('-');
+    const motionId = $('input[name="MotionDescription-' + index + '"]').attr('data-motion-id');
+    if (motionId === undefined) {
+        return;
+    }
+    let body = {};
+    body[field.replace('Motion', '').toLowerCase()] = $(this).val();
+    autosave('motion-' + motionId, '/api/meeting/' + meeting_id + '/motion/' + motionId, body);
+});
+
+$('#pAnnouncement, #pExtempore').on('input', 'textarea', function () {
+    const kind = this.name.startsWith('Announcement') ? 'announcement' : 'extempore';
+    const itemId = $(this).attr('data-item-id');
+    if (itemId) {
+        autosave(kind + '-' + itemId, '/api/meeting/' + meeting_id + '/' + kind + '/' + itemId,
+            {'content': $(this).val()});
+    }
+});
+
+$('#pAnnouncement, #pExtempore').on('change', 'textarea', function () {
+    // Append a newly added announcement or extempore once it has content
+    const kind = this.name.startsWith('Announcement') ? 'announcement' : 'extempore';
+    if ($(this).attr('data-item-id') !== undefined || !$(this).val()) {
+        return;
+    }
+    $(this).attr('data-item-id', '');
+    $.ajax({
+        'type': 'POST',
+        'url': $SCRIPT_ROOT + '/api/meeting/' + meeting_id + '/' + kind,
+        'contentType': 'application/json',
+        'data': JSON.stringify({'content': $(this).val()}),
+        'dataType': 'json',
+        'success': (data) => {
+            $(this).attr('data-item-id', data['id']);
+            autosaveVersions[kind + '-' + data['id']] = data['version'];
+        }
+    });
+});
+
+attendanceInput.on('click', 'div > a', function () {
+    const personId = this.id.split('-')[1];
+    if (autosaveVersions['attendee-' + personId] !== undefined) {
+        autosave('attendee-' + personId, '/api/meeting/' + meeting_id + '/attendee/' + personId,
+            {'is_present': $(this).siblings('input').prop('checked')});
+    }
+});
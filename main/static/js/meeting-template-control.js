@@ -49,69 +49,25 @@ $('#templateSaveBtn').on('click', function () {
     $('#saveTemplateDropdown').children('button').click();
 });
 
-function enableALlOptions() {
-    chairInput.children().each(function () {
-        $(this).attr('disabled', false);
-    });
-    minuteTakerInput.children().each(function () {
-        $(this).attr('disabled', false);
-    });
-    attendeeInput.children().each(function () {
-        $(this).attr('disabled', false);
-    });
-    guestInput.children().each(function () {
-        $(this).attr('disabled', false);
-    });
-    $('.selectpicker').selectpicker('refresh');
-    appendPresentTag();
-}
-
 // 套用模板
 templateList.on('click', 'li > a:nth-child(1)', function (e) {
-    enableALlOptions();
-    let data = JSON.parse(JSON.stringify(templateContentList[$(this).data('id')]));
+    let data = templateContentList[$(this).data('id')];
     titleInput.val(data['title']);
     let datetime = new Date(data['time']).toISOString();
     timeInput.val(datetime.substring(0, datetime.length - 1));
     locationInput.val(data['location']);
     typeInput.val(data['type']);
-    chairInput.val(data['chair']);
-    minuteTakerInput.val(data['minuteTaker']);
-    attendeeInput.val(data['attendees']);
-    guestInput.val(data['guests']);
 
-    // 禁用選項處理
-    let chairBar = chairInput.children();
-    let minuteTakerBar = minuteTakerInput.children();
-    let attendeeBar = attendeeInput.children();
-    let guestBar = guestInput.children();
-    chairInput.children().each(function () {
-        let value = $(this).val();
-        let index = $(this).index();
-        if (data['chair'] === parseInt(value)) {
-            oldChairIndex = index;
-            minuteTakerBar[index].disabled = true;
-            attendeeBar[index - 1].disabled = true;
-            guestBar[index - 1].disabled = true;
-        } else if (data['minuteTaker'] === parseInt(value)) {
-            oldMinuteTakerIndex = index;
-            chairBar[index].disabled = true;
-            attendeeBar[index - 1].disabled = true;
-            guestBar[index - 1].disabled = true;
-        } else if (data['attendees'][0] === parseInt(value)) {
-            data['attendees'].shift();
-            chairBar[index].disabled = true;
-            minuteTakerBar[index].disabled = true;
-            guestBar[index - 1].disabled = true;
-        } else if (data['guests'][0] === parseInt(value)) {
-            data['guests'].shift();
-            chairBar[index].disabled = true;
-            minuteTakerBar[index].disabled = true;
-            attendeeBar[index - 1].disabled = true;
-        }
-    })
-    $('.selectpicker').selectpicker('refresh');
-    appendPresentTag();
+    // 先載入模板中人員的選項，再選取並禁用其他選單中的重複人員
+    loadPersonOptions([data['chair'], data['minuteTaker']].concat(data['attendees'], data['guests']))
+        .then(function () {
+            chairInput.val(data['chair']);
+            minuteTakerInput.val(data['minuteTaker']);
+            attendeeInput.val(data['attendees']);
+            guestInput.val(data['guests']);
+            syncPersonOptions();
+            appendPresentTag();
+        });
     $('#applyTemplateDropdown').children('button').click(); // 關閉 Dropdown
 });
 
@@ -1,21 +1,87 @@
 // noinspection JSUnresolvedFunction
 
-const meetingTiles = $('.meetingTile');
+const meetingList = $('#meetingList');
+const meetingListView = $('#meetingListView');
 const meetingViewArea = $('#meetingViewArea');
 const meetingViewModal = $('#meetingViewModal');
 
-meetingTiles.on('click', function () {
-    meetingTiles.removeClass('active');
+let loadingMeetings = false;
+
+function loadMoreMeetings() {
+    let cursor = meetingList.data('next');
+    if (loadingMeetings || !cursor) {
+        return;
+    }
+    loadingMeetings = true;
+
+    $.ajax({
+        'url': $SCRIPT_ROOT + '/api/meetings',
+        'data': {after: cursor},
+        'type': 'GET',
+        'dataType': 'json',
+        'success': function (data) {
+            data.meetings.forEach(function (meeting) {
+                let tile = $('<a href="javascript:void(0)" class="list-group-item list-group-item-action py-3 lh-tight meetingTile"></a>');
+                tile.attr('id', 'meetingTile-' + meeting.id).attr('title', meeting.title);
+                tile.append($('<div class="d-flex w-100 align-items-center justify-content-between"></div>')
+                    .append($('<strong class="mb-1 text-nowrap text-truncate"></strong>').text(meeting.title)));
+                tile.append($('<div class="mb-1 small"></div>').text(meeting.type));
+                tile.append($('<div class="mb-0 small"></div>').text(moment(meeting.time).calendar()));
+                meetingList.append(tile);
+            });
+            meetingList.data('next', data.next ? data.next : '');
+        },
+        'complete': function (jqXHR, textStatus) {
+            loadingMeetings = false;
+            if (textStatus === 'success') {
+                fillMeetingListView();
+            }
+        }
+    });
+}
+
+function fillMeetingListView() {
+    // A list that does not overflow never fires scroll events, so keep loading until it does or runs out
+    let view = meetingListView[0];
+    if (view && view.scrollHeight <= view.clientHeight) {
+        loadMoreMeetings();
+    }
+}
+
+// Infinite scroll: fetch the next page when the list is scrolled near the bottom
+meetingListView.on('scroll', function () {
+    if (this.scrollTop + this.clientHeight >= this.scrollHeight - 200) {
+        loadMoreMeetings();
+    }
+});
+
+$(document).ready(fillMeetingListView);
+$(window).on('resize', fillMeetingListView);
+
+// Meeting views fetched so far, keyed by meeting id: {etag, html}. Revisiting a meeting sends If-None-Match
+// and reuses the stored HTML when the server answers 304 Not Modified.
+const meetingViewCache = {};
+
+meetingList.on('click', '.meetingTile', function () {
+    meetingList.children('.meetingTile').removeClass('active');
     $(this).addClass('active');
 
+    let meetingId = $(this).attr('id').split('-')[1];
+    let cached = meetingViewCache[meetingId];
     $.ajax({
         'url': $SCRIPT_ROOT + '/get/meeting',
         'data': {
-            id: $(this).attr('id').split('-')[1]
+            id: meetingId
         },
         'type': 'GET',
         'dataType': 'html',
-        'success': function (data) {
+        'headers': cached ? {'If-None-Match': cached.etag} : {},
+        'success': function (data, textStatus, jqXHR) {
+            if (jqXHR.status === 304) {
+                data = cached.html;
+            } else if (jqXHR.getResponseHeader('ETag')) {
+                meetingViewCache[meetingId] = {etag: jqXHR.getResponseHeader('ETag'), html: data};
+            }
             meetingViewArea.html(data);
             meetingViewArea.animate({scrollTop: 0}, 1);
             if ($(window).width() < 992) {
@@ -137,76 +137,76 @@ extemporeSection.on('click', 'div > a', function () {
     $(this).parent().remove();
 })
 
-// Detect duplicates in selecting person section
-// If someone is selected -> Disable the option for the other picker
-let oldChairIndex = 0
-let oldMinuteTakerIndex = 0
-chairInput.on('changed.bs.select', function (e, clickedIndex) {
-    minuteTakerInput.children()[clickedIndex].disabled = true;
-    minuteTakerInput.children()[oldChairIndex].disabled = false;
-
-    if (clickedIndex) {
-        attendeeInput.children()[clickedIndex - 1].disabled = true;
-        guestInput.children()[clickedIndex - 1].disabled = true;
-    }
-    if (oldChairIndex > 0) {
-        attendeeInput.children()[oldChairIndex - 1].disabled = false;
-        guestInput.children()[oldChairIndex - 1].disabled = false;
-    }
-    minuteTakerInput.selectpicker('refresh');
-    attendeeInput.selectpicker('refresh');
-    guestInput.selectpicker('refresh');
-
-    oldChairIndex = clickedIndex;
-});
-
-minuteTakerInput.on('changed.bs.select', function (e, clickedIndex) {
-    chairInput.children()[clickedIndex].disabled = true;
-    chairInput.children()[oldMinuteTakerIndex].disabled = false;
-
-    if (clickedIndex > 0) {
-        attendeeInput.children()[clickedIndex - 1].disabled = true;
-        guestInput.children()[clickedIndex - 1].disabled = true;
-    }
-    if (oldMinuteTakerIndex > 0) {
-        attendeeInput.children()[oldMinuteTakerIndex - 1].disabled = false;
-        guestInput.children()[oldMinuteTakerIndex - 1].disabled = false;
-    }
-    chairInput.selectpicker('refresh');
-    attendeeInput.selectpicker('refresh');
-    guestInput.selectpicker('refresh');
-
-    oldMinuteTakerIndex = clickedIndex;
-});
-
-attendeeInput.on('changed.bs.select', function (e, clickedIndex, newValue) {
-    if (newValue) {
-        chairInput.children()[clickedIndex + 1].disabled = true;
-        minuteTakerInput.children()[clickedIndex + 1].disabled = true;
-        guestInput.children()[clickedIndex].disabled = true;
-    } else {
-        chairInput.children()[clickedIndex + 1].disabled = false;
-        minuteTakerInput.children()[clickedIndex + 1].disabled = false;
-        guestInput.children()[clickedIndex].disabled = false;
-    }
-    chairInput.selectpicker('refresh');
-    minuteTakerInput.selectpicker('refresh');
-    guestInput.selectpicker('refresh');
-});
+// Person options are fetched while typing instead of rendering the whole directory into every select
+// All person selects share the same options so that a chosen person can be disabled in the others
+const personSelects = $('select.person-select');
+const PERSON_SUGGEST_DELAY = 250;
+let personSuggestTimer;
+let lastPersonQuery = '';
+
+function addPersonOptions(people) {
+    people.forEach(function (person) {
+        if (chairInput.children(`option[value="${person['id']}"]`).length) {
+            return;
+        }
+        personSelects.each(function () {
+            $(this).append($('<option>').val(person['id']).text(person['name'])
+                .attr('data-subtext', '(' + person['email'] + ') ' + person['type']));
+        });
+    });
+}
 
-guestInput.on('changed.bs.select', function (e, clickedIndex, newValue) {
-    if (newValue) {
-        chairInput.children()[clickedIndex + 1].disabled = true;
-        minuteTakerInput.children()[clickedIndex + 1].disabled = true;
-        attendeeInput.children()[clickedIndex].disabled = true;
-    } else {
-        chairInput.children()[clickedIndex + 1].disabled = false;
-        minuteTakerInput.children()[clickedIndex + 1].disabled = false;
-        attendeeInput.children()[clickedIndex].disabled = false;
+function loadPersonOptions(ids) {
+    // Fetch the options of people that are about to be selected (edited meetings, templates)
+    ids = ids.filter(id => id && !chairInput.children(`option[value="${id}"]`).length);
+    if (!ids.length) {
+        return $.Deferred().resolve().promise();
     }
-    chairInput.selectpicker('refresh');
-    minuteTakerInput.selectpicker('refresh');
-    attendeeInput.selectpicker('refresh');
+    return $.getJSON($SCRIPT_ROOT + '/api/people', {'ids': ids.join(',')}).then(function (data) {
+        addPersonOptions(data['people']);
+    });
+}
+
+function syncPersonOptions() {
+    // Detect duplicates in selecting person section
+    // If someone is selected -> Disable the option for the other pickers
+    // Read option.selected directly since .val() skips selected options that are still disabled
+    let chosen = new Map();
+    personSelects.each(function () {
+        const selectId = this.id;
+        $(this).children('option:selected').each(function () {
+            if (this.value) {
+                chosen.set(this.value, selectId);
+            }
+        });
+    });
+    personSelects.each(function () {
+        const selectId = this.id;
+        $(this).children('option').each(function () {
+            this.disabled = chosen.has(this.value) && chosen.get(this.value) !== selectId;
+        });
+    });
+    personSelects.selectpicker('refresh');
+}
+
+personSelects.on('changed.bs.select', syncPersonOptions);
+
+$(document).on('input', '.bootstrap-select.person-select .bs-searchbox input', function () {
+    const searchbox = $(this);
+    clearTimeout(personSuggestTimer);
+    personSuggestTimer = setTimeout(function () {
+        const query = searchbox.val().trim();
+        if (!query || query === lastPersonQuery) {
+            return;
+        }
+        lastPersonQuery = query;
+        $.getJSON($SCRIPT_ROOT + '/api/people/suggest', {'q': query}, function (data) {
+            addPersonOptions(data['people']);
+            syncPersonOptions();
+            // Re-apply the live search filter to the new options without firing this handler again
+            searchbox.trigger('propertychange');
+        });
+    }, PERSON_SUGGEST_DELAY);
 });
 
 newMeetingForm.validate({
@@ -275,7 +275,7 @@ $('#newMeetingBtn').on('click', function () {
         return;
     }
 
-    // formData contains: { json_form: body_form_save_as_json, attachments: FileList }
+    // formData contains: { json_form: body_form_save_as_json }
     let formData = new FormData();
     let meetingForm = {};
 
@@ -325,30 +325,43 @@ $('#newMeetingBtn').on('click', function () {
     meetingForm['motion'] = motionList;
     meetingForm['extempore'] = extemporeList;
 
-    formData.append('json_form', JSON.stringify(meetingForm));
-
+    // Disable the button until the submission finishes so attachments are not uploaded twice
+    const submitButton = $(this).prop('disabled', true);
     let attachments = document.getElementById('mAttachmentInput').files;
-    for (let i = 0; i < attachments.length; i++) {
-        formData.append('files[]', attachments[i]);
-    }
-
-    $.ajax({
-        'type': 'POST',
-        'dataType': 'json',
-        'mimeType': 'multipart/form-data',
-        'url': $SCRIPT_ROOT + '/new/meeting',
-        'data': formData,
-        'success': (data) => {
-            if (data['message'] === 'Success') {
-                // Redirect to homepage if the submission is successful
-                window.location.href = '/';
-            } else {
-                // TODO: If validation failed -> show error message
-                console.log(data['message']);
-            }
-        },
-        'contentType': false,
-        'processData': false,
+    uploadFiles(attachments).then(function (uploadIds) {
+        // Attachments are uploaded in chunks beforehand, the form only carries their upload IDs
+        meetingForm['uploads'] = uploadIds;
+        formData.append('json_form', JSON.stringify(meetingForm));
+
+        $.ajax({
+            'type': 'POST',
+            'dataType': 'json',
+            'mimeType': 'multipart/form-data',
+            'url': $SCRIPT_ROOT + '/new/meeting',
+            'data': formData,
+            'success': (data) => {
+                if (data['message'] === 'Success') {
+                    // Redirect to homepage if the submission is successful
+                    window.location.href = '/';
+                } else {
+                    // TODO: If validation failed -> show error message
+                    console.log(data['message']);
+                    submitButton.prop('disabled', false);
+                }
+            },
+            'error': () => {
+                submitButton.prop('disabled', false);
+            },
+            'contentType': false,
+            'processData': false,
+        });
+    }).catch(function (error) {
+        // Show the upload failure in the error alert at the bottom and let the user submit again
+        console.log(error);
+        $('#newMeetingFormError').removeClass('d-none').children().children('div')
+            .html('附件上傳失敗，請檢查網路連線後再送出一次');
+        $('#meetingFormArea').animate({scrollTop: 10000}, 1);
+        submitButton.prop('disabled', false);
     });
 });
 
@@ -361,19 +374,22 @@ $('.person-select').on('change', function () {
     }
 });
 
-attendanceInput.on('click', 'div > a', function () {
-    const checkBox = $(this).siblings('input');
-    if (checkBox.prop('checked') === true) {
-        checkBox.prop('checked', false);
-        $(this).css('background-color', '#ffcdd2');
-        $(this).removeClass('border border-success');
-        $(this).addClass('border border-danger');
+function setAttendance(tag, present) {
+    // Mark a person in the attendance section as present or absent
+    tag.siblings('input').prop('checked', present);
+    if (present) {
+        tag.css('background-color', '#c8e6c9');
+        tag.removeClass('border border-danger');
+        tag.addClass('border border-success');
     } else {
-        checkBox.prop('checked', true);
-        $(this).css('background-color', '#c8e6c9');
-        $(this).removeClass('border border-danger');
-        $(this).addClass('border border-success');
+        tag.css('background-color', '#ffcdd2');
+        tag.removeClass('border border-success');
+        tag.addClass('border border-danger');
     }
+}
+
+attendanceInput.on('click', 'div > a', function () {
+    setAttendance($(this), !$(this).siblings('input').prop('checked'));
 });
 
 function appendPresentTag() {
@@ -391,4 +407,60 @@ function appendPresentTag() {
                 </div>
             `);
     });
-}
\ No newline at end of file
+}
+
+const UPLOAD_MAX_RETRIES = 5;
+const UPLOAD_HASH_LIMIT = 32 * 1024 * 1024;
+
+async function fileSha256(file) {
+    // Hash small files so the server can skip the transfer when it already stores the same content
+    if (file.size > UPLOAD_HASH_LIMIT || !window.crypto || !window.crypto.subtle) {
+        return null;
+    }
+    const digest = await window.crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+    return Array.from(new Uint8Array(digest), byte => byte.toString(16).padStart(2, '0')).join('');
+}
+
+async function uploadFile(file) {
+    // Upload a file in chunks, resuming from the offset the server has received after a failure
+    const upload = await $.ajax({
+        'type': 'POST',
+        'url': $SCRIPT_ROOT + '/upload',
+        'contentType': 'application/json',
+        'data': JSON.stringify({'filename': file.name, 'size': file.size, 'sha256': await fileSha256(file)}),
+        'dataType': 'json'
+    });
+    const uploadUrl = $SCRIPT_ROOT + '/upload/' + upload['id'];
+    let offset = upload['offset'];
+    let retries = 0;
+    while (offset < file.size) {
+        try {
+            const data = await $.ajax({
+                'type': 'PATCH',
+                'url': uploadUrl,
+                'headers': {'Upload-Offset': offset},
+                'contentType': 'application/offset+octet-stream',
+                'data': file.slice(offset, offset + upload['chunk_size']),
+                'processData': false,
+                'dataType': 'json'
+            });
+            offset = data['offset'];
+            retries = 0;
+        } catch (error) {
+            if (++retries > UPLOAD_MAX_RETRIES) {
+                throw error;
+            }
+            await new Promise(resolve => setTimeout(resolve, 1000 * retries));
+            offset = (await $.ajax({'type': 'GET', 'url': uploadUrl, 'dataType': 'json'}))['offset'];
+        }
+    }
+    return upload['id'];
+}
+
+async function uploadFiles(files) {
+    let uploadIds = [];
+    for (const file of files) {
+        uploadIds.push(await uploadFile(file));
+    }
+    return uploadIds;
+}
@@ -188,11 +188,8 @@ $('#newPersonBtn').on('click', function () {
                 // noinspection JSUnresolvedFunction
                 $('#newPersonModal').modal('hide');
                 // Add person options dynamically
-                const optionElement =
-                    '<option value="' + data['person']['id'] +
-                    '" data-subtext="(' + data['person']['email'] + ') ' +
-                    data['person']['type'] + '">' + data['person']['name'] + '</option>'
-                $('.person-select > select').append(optionElement).selectpicker('refresh');
+                addPersonOptions([data['person']]);
+                syncPersonOptions();
                 newPersonFormValidator.resetForm();
                 newPersonForm.removeClass('has-validated');
                 newPersonFormError.addClass('d-none');
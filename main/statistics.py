@@ -0,0 +1,329 @@
+from collections import Counter
+from datetime import datetime, timedelta
+from itertools import chain
+
+import click
+from sqlalchemy import event, extract, func, inspect, select
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+
+from main import app, db
+from main.models import Meeting, Motion, MotionStatusType, Person, Feedback, MeetingMonthlyCount, \
+    MotionMonthlyCount
+
+MONTH_STR = ['一月', '二月', '三月', '四月', '五月', '六月', '七月', '八月', '九月', '十月', '十一月', '十二月']
+
+
+def semester_range(today):
+    """
+    計算所在學期的時間範圍，上學期為 8 月至隔年 1 月，下學期為 2 月至 7 月
+    :param today: 日期時間
+    :return: (起始時間, 結束時間)，左閉右開區間
+    """
+    if today.month >= 8:
+        return datetime(today.year, 8, 1), datetime(today.year + 1, 2, 1)
+    if today.month <= 1:
+        return datetime(today.year - 1, 8, 1), datetime(today.year, 2, 1)
+    return datetime(today.year, 2, 1), datetime(today.year, 8, 1)
+
+
+def week_range(today):
+    """
+    計算所在週（星期日至星期六）的時間範圍
+    :param today: 日期時間
+    :return: (起始時間, 結束時間)，左閉右開區間
+    """
+    week_start = (today - timedelta(days=(today.weekday() + 1) % 7)).replace(hour=0, minute=0, second=0,
+                                                                             microsecond=0)
+    return week_start, week_start + timedelta(days=7)
+
+
+def month_range(year, month):
+    """
+    計算某月的時間範圍
+    :param year: 年
+    :param month: 月
+    :return: (起始時間, 結束時間)，左閉右開區間
+    """
+    start = datetime(year, month, 1)
+    return start, datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+
+
+def iter_months(start, end):
+    """
+    依序列出時間範圍內的每個月份
+    :param start: 起始時間（每月 1 日）
+    :param end: 結束時間（不包含）
+    :return: (年, 月) 產生器
+    """
+    year, month = start.year, start.month
+    while datetime(year, month, 1) < end:
+        yield year, month
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def months_meeting_count(start, end):
+    """
+    從統計摘要取得時間範圍內每月的會議數
+    :param start: 起始時間（每月 1 日）
+    :param end: 結束時間（不包含）
+    :return: [(月份名稱, 會議數)]，依時間排序，沒有會議的月份為 0
+    """
+    rows = db.session.query(MeetingMonthlyCount.year, MeetingMonthlyCount.month, func.sum(MeetingMonthlyCount.count)) \
+        .filter(MeetingMonthlyCount.year.between(start.year, end.year)) \
+        .group_by(MeetingMonthlyCount.year, MeetingMonthlyCount.month).all()
+
+    counts = {(year, month): int(count) for year, month, count in rows}
+    return [(MONTH_STR[m - 1], counts.get((y, m), 0)) for y, m in iter_months(start, end)]
+
+
+def motion_status_count(start, end):
+    """
+    從統計摘要取得時間範圍內會議的各狀態討論事項數
+    :param start: 起始時間（每月 1 日）
+    :param end: 結束時間（不包含）
+    :return: [(狀態名稱, 討論事項數)]，依 MotionStatusType 順序
+    """
+    months = set(iter_months(start, end))
+    rows = MotionMonthlyCount.query.filter(MotionMonthlyCount.year.between(start.year, end.year))
+
+    counts = dict.fromkeys(MotionStatusType, 0)
+    for row in rows:
+        if (row.year, row.month) in months:
+            counts[row.status] += row.count
+    return [(status.value, count) for status, count in counts.items()]
+
+
+def yearly_meeting_count():
+    """
+    從統計摘要取得每年的會議數
+    :return: {年: 會議數}，依年份遞減排序
+    """
+    rows = db.session.query(MeetingMonthlyCount.year, func.sum(MeetingMonthlyCount.count)) \
+        .group_by(MeetingMonthlyCount.year).order_by(MeetingMonthlyCount.year.desc()).all()
+    return {year: int(count) for year, count in rows if count}
+
+
+def dashboard_data(today=None):
+    """
+    統計資料頁面所需的資料
+    :param today: 日期時間，預設為現在
+    :return: 統計資料 dict
+    """
+    today = today or datetime.today()
+    week_start, week_end = week_range(today)
+    semester_start, semester_end = semester_range(today)
+
+    week_meeting_count, week_motion_count = db.session.query(
+        func.count(func.distinct(Meeting.id)), func.count(Motion.id)
+    ).select_from(Meeting).outerjoin(Meeting.motions) \
+        .filter(Meeting.time >= week_start, Meeting.time < week_end).one()
+
+    return {
+        'week_meeting_count': week_meeting_count,
+        'week_motion_count': week_motion_count,
+        'person_count': Person.query.count(),
+        'feedback_count': Feedback.query.count(),
+        'months_meeting_count': months_meeting_count(semester_start, semester_end),
+        'semester_motion_status_percentage': motion_status_count(semester_start, semester_end)
+    }
+
+
+def live_month_counts(connection, start, end):
+    """
+    直接從會議與討論事項資料表計算時間範圍內的每月統計
+    :param connection: 資料庫連線
+    :param start: 起始時間
+    :param end: 結束時間（不包含）
+    :return: ({(年, 月, 會議類型): 數量}, {(年, 月, 討論事項狀態): 數量})
+    """
+    year = extract('year', Meeting.time)
+    month = extract('month', Meeting.time)
+    in_range = (Meeting.time >= start) & (Meeting.time < end)
+
+    meeting_rows = connection.execute(
+        select(year, month, Meeting.type, func.count(Meeting.id)).where(in_range).group_by(year, month, Meeting.type))
+    motion_rows = connection.execute(
+        select(year, month, Motion.status, func.count(Motion.id)).select_from(Motion).join(Motion.meeting)
+        .where(in_range).group_by(year, month, Motion.status))
+
+    return ({(int(y), int(m), key): count for y, m, key, count in meeting_rows},
+            {(int(y), int(m), key): count for y, m, key, count in motion_rows})
+
+
+def refresh_months(connection, months):
+    """
+    重新計算指定月份的統計摘要
+    :param connection: 資料庫連線
+    :param months: (年, 月) 集合
+    """
+    meeting_table = MeetingMonthlyCount.__table__
+    motion_table = MotionMonthlyCount.__table__
+
+    for year, month in sorted(months):
+        start, end = month_range(year, month)
+        meeting_counts, motion_counts = live_month_counts(connection, start, end)
+
+        connection.execute(meeting_table.delete().where(
+            (meeting_table.c.year == year) & (meeting_table.c.month == month)))
+        connection.execute(motion_table.delete().where(
+            (motion_table.c.year == year) & (motion_table.c.month == month)))
+        if meeting_counts:
+            connection.execute(meeting_table.insert(), [
+                {'year': y, 'month': m, 'type': key, 'count': count} for (y, m, key), count in meeting_counts.items()])
+        if motion_counts:
+            connection.execute(motion_table.insert(), [
+                {'year': y, 'month': m, 'status': key, 'count': count} for (y, m, key), count in motion_counts.items()])
+
+
+def _as_datetime(value):
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _month(time):
+    time = _as_datetime(time)
+    return time.year, time.month
+
+
+def _previous(obj, key):
+    """
+    取得屬性在此次 flush 之前（即資料庫中）的值
+    :param obj: ORM 物件
+    :param key: 屬性名稱
+    :return: 原本的值，新增的物件為 None
+    """
+    history = inspect(obj).attrs[key].history
+    if not history.has_changes():
+        return getattr(obj, key)
+    return history.deleted[0] if history.deleted else None
+
+
+def _summary_deltas(session):
+    """
+    由此次 flush 新增、修改與刪除的會議及討論事項計算統計摘要的增減量
+    :param session: SQLAlchemy Session
+    :return: ({(年, 月, 會議類型): 增減量}, {(年, 月, 討論事項狀態): 增減量})
+    """
+    meeting_deltas, motion_deltas = Counter(), Counter()
+    moved = {}  # 時間換到其他月份的會議 {會議編號: (原月份, 新月份)}
+    motions = []
+
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, Motion):
+            motions.append(obj)
+            continue
+        if not isinstance(obj, Meeting):
+            continue
+        old = None if obj in session.new else (_month(_previous(obj, 'time')), _previous(obj, 'type'))
+        new = None if obj in session.deleted else (_month(obj.time), obj.type)
+        if old == new:
+            continue
+        if old:
+            meeting_deltas[(*old[0], old[1])] -= 1
+        if new:
+            meeting_deltas[(*new[0], new[1])] += 1
+        if old and new and old[0] != new[0]:
+            moved[obj.id] = old[0], new[0]
+
+    for motion in motions:
+        if motion not in session.new:
+            meeting = _previous(motion, 'meeting')
+            motion_deltas[(*_month(_previous(meeting, 'time')), _previous(motion, 'status'))] -= 1
+        if motion not in session.deleted and motion.meeting is not None:
+            motion_deltas[(*_month(motion.meeting.time), motion.status)] += 1
+
+    if moved:
+        # 會議換月份時，此次 flush 未異動的討論事項也要從原月份移到新月份
+        rows = session.connection().execute(
+            select(Motion.meeting_id, Motion.status, func.count(Motion.id))
+            .where(Motion.meeting_id.in_(moved), Motion.id.notin_([motion.id for motion in motions]))
+            .group_by(Motion.meeting_id, Motion.status))
+        for meeting_id, status, count in rows:
+            old_month, new_month = moved[meeting_id]
+            motion_deltas[(*old_month, status)] -= count
+            motion_deltas[(*new_month, status)] += count
+
+    return meeting_deltas, motion_deltas
+
+
+def _apply_deltas(connection, table, key_column, deltas):
+    """
+    以 count = count + 增減量 更新統計摘要（不重新計數，並行的交易不會互相覆蓋）
+    :param connection: 資料庫連線
+    :param table: 統計摘要資料表
+    :param key_column: 分類欄位名稱
+    :param deltas: {(年, 月, 分類): 增減量}
+    """
+    # 依固定順序更新，避免交易之間互相等待列鎖而死結
+    for (year, month, key), delta in sorted(deltas.items(), key=lambda item: (*item[0][:2], item[0][2].name)):
+        if not delta:
+            continue
+        if connection.dialect.name == 'mysql':
+            connection.execute(mysql_insert(table).values(year=year, month=month, count=delta, **{key_column: key})
+                               .on_duplicate_key_update(count=table.c.count + delta))
+            continue
+        result = connection.execute(
+            table.update().where((table.c.year == year) & (table.c.month == month) & (table.c[key_column] == key))
+            .values(count=table.c.count + delta))
+        if result.rowcount == 0:
+            connection.execute(table.insert().values(year=year, month=month, count=delta, **{key_column: key}))
+
+
+@event.listens_for(db.session, 'after_flush')
+def update_summary(session, flush_context):
+    """
+    會議或討論事項寫入時，在同一交易內以增減量更新受影響月份的統計摘要
+    """
+    meeting_deltas, motion_deltas = _summary_deltas(session)
+    connection = session.connection()
+    _apply_deltas(connection, MeetingMonthlyCount.__table__, 'type', meeting_deltas)
+    _apply_deltas(connection, MotionMonthlyCount.__table__, 'status', motion_deltas)
+
+
+def rebuild_summary():
+    """
+    從會議與討論事項資料表重建全部統計摘要
+    """
+    connection = db.session.connection()
+    connection.execute(MeetingMonthlyCount.__table__.delete())
+    connection.execute(MotionMonthlyCount.__table__.delete())
+    first, last = db.session.query(func.min(Meeting.time), func.max(Meeting.time)).one()
+    if first:
+        start, end = datetime(first.year, first.month, 1), month_range(last.year, last.month)[1]
+        refresh_months(connection, set(iter_months(start, end)))
+    db.session.commit()
+
+
+def verify_summary():
+    """
+    比對統計摘要與會議、討論事項資料表
+    :return: 不一致項目列表 [(項目, 摘要數量, 實際數量)]
+    """
+    meeting_counts, motion_counts = live_month_counts(db.session.connection(), datetime.min, datetime.max)
+    summary = {(row.year, row.month, row.type): row.count for row in MeetingMonthlyCount.query}
+    summary.update({(row.year, row.month, row.status): row.count for row in MotionMonthlyCount.query})
+
+    mismatches = []
+    for key, count in chain(meeting_counts.items(), motion_counts.items()):
+        summary_count = summary.pop(key, 0)
+        if summary_count != count:
+            mismatches.append((key, summary_count, count))
+    mismatches.extend((key, count, 0) for key, count in summary.items() if count)
+    return mismatches
+
+
+@app.cli.command('rebuild-statistics')
+@click.option('--check', is_flag=True, help='只比對統計摘要，不重建')
+def rebuild_statistics_command(check):
+    """
+    重建統計摘要並比對是否與資料表一致
+    """
+    if not check:
+        rebuild_summary()
+        click.echo('統計摘要已重建')
+
+    mismatches = verify_summary()
+    for (year, month, key), summary_count, live_count in mismatches:
+        click.echo(f'{year}-{month:02d} {key.value}：摘要 {summary_count}，實際 {live_count}')
+    if mismatches:
+        raise click.ClickException(f'統計摘要有 {len(mismatches)} 筆不一致')
+    click.echo('統計摘要與資料表一致')
@@ -0,0 +1,187 @@
+import hashlib
+import os
+import shutil
+from datetime import datetime, timedelta
+from threading import Lock
+from uuid import uuid4
+
+import click
+from sqlalchemy import update
+
+from main import app, attachments, db
+from main.models import Upload
+
+READ_SIZE = 64 * 1024
+
+
+def part_path(upload_id):
+    return os.path.join(app.config['UPLOAD_PART_FOLDER'], upload_id)
+
+
+def create_upload(filename, size, uploader_id, sha256=None):
+    """
+    建立分段上傳，若用戶端提供的內容雜湊值已存在於檔案庫，則直接完成上傳，不需傳送內容
+    :param filename: 檔案名稱
+    :param size: 檔案大小（位元組）
+    :param uploader_id: 上傳者的人員編號
+    :param sha256: 用戶端計算的內容 SHA-256（可省略）
+    :return: (上傳編號, 是否已完成)
+    :raise ValueError: 檔案名稱或大小不正確
+    """
+    filename = os.path.basename(filename.replace('\\', '/'))
+    if not filename or size < 0:
+        raise ValueError('檔案名稱或大小不正確')
+
+    upload_id = uuid4().hex
+    upload = Upload(id=upload_id, filename=filename, size=size, uploader_id=uploader_id)
+    if sha256 and attachments.known_blob(sha256.lower(), size):
+        upload.offset = size
+        upload.sha256 = sha256.lower()
+    else:
+        open(part_path(upload_id), 'wb').close()
+        if size == 0:
+            upload.sha256 = hashlib.sha256().hexdigest()
+    completed = upload.completed
+    db.session.add(upload)
+    db.session.commit()
+    return upload_id, completed
+
+
+# 各上傳進行中的 SHA-256 計算狀態 {上傳編號: (已計算的位元組數, hash 物件)}，
+# 續傳時若狀態不在此行程（例如重新啟動或由其他行程接收），則從暫存檔重新計算已接收的部分
+_hashers = {}
+_hashers_lock = Lock()
+
+
+def _hasher_at(upload_id, offset):
+    with _hashers_lock:
+        cached = _hashers.pop(upload_id, None)
+    if cached is not None and cached[0] == offset:
+        return cached[1]
+
+    hasher = hashlib.sha256()
+    with open(part_path(upload_id), 'rb') as file:
+        remaining = offset
+        while remaining:
+            block = file.read(min(READ_SIZE, remaining))
+            if not block:
+                break
+            hasher.update(block)
+            remaining -= len(block)
+    return hasher
+
+
+def _append_chunk(upload_id, offset, chunk_path):
+    """
+    將一段已接收的內容從暫存檔複製到上傳暫存檔的 offset 位置（並截斷其後的內容）
+    """
+    with open(part_path(upload_id), 'r+b') as file, open(chunk_path, 'rb') as chunk:
+        file.seek(offset)
+        file.truncate()
+        shutil.copyfileobj(chunk, file, READ_SIZE)
+
+
+def write_chunk(upload, stream):
+    """
+    將一段內容從請求串流寫入此請求專用的暫存檔，每次只讀取 READ_SIZE 位元組，同時累加計算 SHA-256；
+    串流期間不佔用資料庫連線，連線中斷時已收到的部分仍會記錄，可從該位置續傳
+    串流結束後以條件式 UPDATE 取得 offset（同時鎖定該列），成功後才將內容接到上傳暫存檔並提交，
+    同時寫入同一位置的其他請求會等待此交易，之後因 offset 不符而放棄，不會覆寫已接收的內容
+    :param upload: Upload 物件，內容從其 offset 開始寫入
+    :param stream: 請求內容串流
+    :return: (新的 offset, 是否上傳完成)，其他請求同時寫入同一個上傳時為 None
+    :raise ValueError: 內容超過檔案大小
+    """
+    upload_id, offset, size = upload.id, upload.offset, upload.size
+    db.session.rollback()
+
+    hasher = _hasher_at(upload_id, offset)
+    chunk_path = f'{part_path(upload_id)}.{uuid4().hex}'
+    written = 0
+    try:
+        with open(chunk_path, 'wb') as chunk:
+            while True:
+                block = stream.read(READ_SIZE)
+                if not block:
+                    break
+                if offset + written + len(block) > size:
+                    raise ValueError('內容超過檔案大小')
+                chunk.write(block)
+                hasher.update(block)
+                written += len(block)
+    finally:
+        new_offset = offset + written
+        completed = new_offset == size
+        values = {'offset': new_offset, 'sha256': hasher.hexdigest() if completed else None}
+        try:
+            result = db.session.execute(update(Upload).where(Upload.id == upload_id, Upload.offset == offset)
+                                        .values(**values).execution_options(synchronize_session=False))
+            if result.rowcount:
+                _append_chunk(upload_id, offset, chunk_path)
+            db.session.commit()
+        except BaseException:
+            db.session.rollback()
+            raise
+        finally:
+            os.remove(chunk_path)
+        if result.rowcount and not completed:
+            with _hashers_lock:
+                _hashers[upload_id] = (new_offset, hasher)
+
+    return (new_offset, completed) if result.rowcount else None
+
+
+def resolve_uploads(upload_ids, uploader_id):
+    """
+    以單一 IN 查詢載入表單中參照的上傳
+    :param upload_ids: 上傳編號列表
+    :param uploader_id: 上傳者的人員編號，只能附加自己上傳的檔案
+    :return: (Upload 列表, 找不到或尚未上傳完成的上傳編號列表)
+    """
+    upload_ids = set(upload_ids)
+    if not upload_ids:
+        return [], []
+    uploads = [upload for upload in Upload.query.filter(Upload.id.in_(upload_ids), Upload.uploader_id == uploader_id)
+               if upload.completed and (os.path.exists(part_path(upload.id))
+                                        or os.path.exists(attachments.blob_path(upload.sha256)))]
+    return uploads, sorted(upload_ids - {upload.id for upload in uploads})
+
+
+def attach_uploads(meeting, uploads):
+    """
+    將上傳完成的檔案移入檔案庫並附加為會議附件
+    :param meeting: 會議（需已有編號）
+    :param uploads: resolve_uploads() 載入的 Upload 列表
+    """
+    for upload in uploads:
+        uploaded_path = part_path(upload.id)
+        attachments.store_file(uploaded_path if os.path.exists(uploaded_path) else None, upload.sha256)
+        attachments.new_attachment(meeting, upload.filename, upload.sha256)
+        db.session.delete(upload)
+
+
+def remove_expired_uploads():
+    """
+    刪除超過 UPLOAD_EXPIRY_HOURS 仍未附加的上傳與其暫存檔
+    :return: 刪除的上傳數
+    """
+    expired = Upload.query.filter(
+        Upload.created_at < datetime.utcnow() - timedelta(hours=app.config['UPLOAD_EXPIRY_HOURS'])).all()
+    for upload in expired:
+        with _hashers_lock:
+            _hashers.pop(upload.id, None)
+        try:
+            os.remove(part_path(upload.id))
+        except FileNotFoundError:
+            pass
+        db.session.delete(upload)
+    db.session.commit()
+    return len(expired)
+
+
+@app.cli.command('clean-uploads')
+def clean_uploads_command():
+    """
+    刪除過期未附加的上傳
+    """
+    click.echo(f'已刪除 {remove_expired_uploads()} 個過期的上傳')
@@ -0,0 +1,84 @@
+from flask_login import UserMixin
+from sqlalchemy import event
+
+from main import app, db, login
+from main.caching import TTLCache
+from main.models import Person, PersonType
+
+
+class SessionUser(UserMixin):
+    """
+    登入使用者的精簡資料（編號、姓名、電子郵件、身分），不屬於任何資料庫 Session，可跨請求快取
+    與 Person 比較時依人員編號判斷（UserMixin.__eq__），因此 meeting.chair == current_user 仍成立；
+    需要其他欄位或修改人員資料時，請以 Person.query.get(current_user.id) 載入
+    """
+
+    def __init__(self, id, name, email, type):
+        self.id = id
+        self.name = name
+        self.email = email
+        self.type = type
+
+    def is_admin(self):
+        return self.type == PersonType.Assistant
+
+    def __repr__(self):
+        return f'<SessionUser {self.id} {self.name}>'
+
+
+class UserCache:
+    """
+    登入使用者的快取，每個行程各自保存，超過容量時淘汰最久未使用的項目
+    人員資料修改或刪除的交易提交後清除該人員；其他行程的修改則最多在 ttl 秒後生效
+    """
+
+    def __init__(self, capacity, ttl):
+        self._cache = TTLCache(ttl, capacity)
+
+    def get(self, person_id):
+        """
+        取得使用者，快取中沒有或已過期時從資料庫載入
+        :param person_id: 人員編號
+        :return: SessionUser，人員不存在時為 None
+        """
+        def load():
+            row = db.session.query(Person.id, Person.name, Person.email, Person.type).filter_by(id=person_id).first()
+            return SessionUser(*row) if row else None
+
+        return self._cache.get(person_id, load)
+
+    def invalidate(self, person_ids):
+        self._cache.invalidate(person_ids)
+
+    def status(self):
+        return self._cache.status()
+
+
+cache = UserCache(app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL'])
+
+
+@login.user_loader
+def load_user(person_id):
+    return cache.get(int(person_id))
+
+
+@event.listens_for(db.session, 'after_flush')
+def collect_user_changes(session, flush_context):
+    """
+    記錄此次 flush 中修改或刪除的人員，待交易提交後再從快取清除
+    """
+    for obj in session.dirty | session.deleted:
+        if isinstance(obj, Person) and (obj in session.deleted or session.is_modified(obj, include_collections=False)):
+            session.info.setdefault('users_changed', set()).add(obj.id)
+
+
+@event.listens_for(db.session, 'after_commit')
+def invalidate_users(session):
+    person_ids = session.info.pop('users_changed', None)
+    if person_ids:
+        cache.invalidate(person_ids)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_user_changes(session):
+    session.info.pop('users_changed', None)
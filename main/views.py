@@ -1,19 +1,23 @@
 import json
-from datetime import timedelta
+from datetime import date, datetime, timedelta
 from functools import wraps
 from operator import and_
-from os import path, remove
-from threading import Thread
-from time import mktime
+from time import mktime, perf_counter
 
-from flask import render_template, redirect, url_for, flash, request, jsonify, send_file, abort
+from flask import render_template, redirect, url_for, flash, request, jsonify, send_file, abort, make_response
 from flask_login import login_user, logout_user, login_required, current_user
 from flask_mail import Message
-from sqlalchemy import desc, or_, extract
+from sqlalchemy import desc, exists, or_, update
 from sqlalchemy.exc import DataError
+from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.exc import StaleDataError
 
-from main import app, mail
+from main import app, attachments, directory, mailer, meeting_templates, previews, rendering, search, statistics, \
+    uploads, users
 from main.models import *
+from main.editing import assign, resolve_people, build_attendees, update_meeting, recurrence_dates, \
+    create_meetings, template_attendees, RECURRENCE_LIMIT
+from main.visibility import visible_meetings, visible_meeting_ids
 
 
 def admin_required(func):
@@ -46,8 +50,7 @@ def create_meeting_minute_page():
     顯示新增會議頁面
     :return: 新增會議頁面
     """
-    people = Person.query.all()
-    return render_template('meeting-new.html', title='建立會議紀錄', people=people)
+    return render_template('meeting-new.html', title='建立會議紀錄')
 
 
 @app.route('/add-person')
@@ -70,19 +73,77 @@ def meeting_page(meeting_id=None):
     :param meeting_id: 會議編號
     :return: 會議紀律列表
     """
-    meetings = Meeting.query.filter(or_(
-        Meeting.chair.has(id=current_user.id),
-        Meeting.minute_taker.has(id=current_user.id),
-        Meeting.attendees.any(id=current_user.id)
-    )).order_by(desc(Meeting.time))
+    meeting = Meeting.query_full().filter_by(id=meeting_id).first_or_404() if meeting_id else None
+    meetings, next_cursor = paginate_meetings(visible_meetings(current_user))
+    return render_template('meeting.html', title='會議列表', meetings=meetings, next_cursor=next_cursor,
+                           meeting=meeting, timedelta=timedelta)
 
-    if current_user.is_admin():
-        meetings = Meeting.query.order_by(desc(Meeting.time))
 
-    meeting = Meeting.query.get_or_404(meeting_id) if meeting_id else None
-    attendees = Attendee.query.filter_by(meeting_id=meeting_id)
-    return render_template('meeting.html', title='會議列表', meetings=meetings,
-                           meeting=meeting, attendees=attendees, timedelta=timedelta)
+@app.route('/api/meetings')
+@login_required
+def meetings_api():
+    """
+    會議列表分頁 API，供會議列表無限捲動使用
+    :request.args after: 上一頁最後一筆會議的游標
+    :request.args limit: 每頁筆數
+    :return: JSON 物件
+    """
+    try:
+        meetings, next_cursor = paginate_meetings(visible_meetings(current_user),
+                                                  after=request.args.get('after'),
+                                                  limit=request.args.get('limit', type=int))
+    except ValueError:
+        return abort(400)
+
+    data = [{'id': meeting.id,
+             'title': meeting.title,
+             'type': meeting.type.value,
+             'time': (meeting.time - timedelta(hours=8)).isoformat() + 'Z'} for meeting in meetings]
+    return jsonify({'meetings': data, 'next': next_cursor})
+
+
+def encode_meeting_cursor(meeting):
+    """
+    將會議的 (時間, 編號) 編碼為分頁游標
+    :param meeting: 會議
+    :return: 游標字串
+    """
+    return f'{meeting.time:%Y%m%d%H%M%S%f}-{meeting.id}'
+
+
+def decode_meeting_cursor(cursor):
+    """
+    解析分頁游標
+    :param cursor: 游標字串
+    :return: (會議時間, 會議編號)
+    :raise ValueError: 游標格式不正確
+    """
+    time, meeting_id = cursor.split('-')
+    return datetime.strptime(time, '%Y%m%d%H%M%S%f'), int(meeting_id)
+
+
+def paginate_meetings(meetings, after=None, limit=None):
+    """
+    以 (Meeting.time, Meeting.id) 為鍵值分頁（Keyset Pagination），
+    每頁只掃描索引上的 limit 筆資料，與會議總數無關
+    :param meetings: 會議查詢
+    :param after: 上一頁最後一筆會議的游標，None 表示第一頁
+    :param limit: 每頁筆數
+    :return: (會議列表, 下一頁游標)，已是最後一頁時游標為 None
+    :raise ValueError: 游標格式不正確
+    """
+    per_page = app.config['MEETINGS_PER_PAGE']
+    limit = min(max(limit or per_page, 1), per_page * 4)
+
+    if after:
+        time, meeting_id = decode_meeting_cursor(after)
+        meetings = meetings.filter(or_(Meeting.time < time,
+                                       and_(Meeting.time == time, Meeting.id < meeting_id)))
+
+    page = meetings.order_by(desc(Meeting.time), desc(Meeting.id)).limit(limit + 1).all()
+    if len(page) <= limit:
+        return page, None
+    return page[:limit], encode_meeting_cursor(page[limit - 1])
 
 
 @app.route('/calendar')
@@ -92,16 +153,36 @@ def calendar_page():
     顯示會議行事曆頁面
     :return: 會議行事曆頁面
     """
-    meetings = Meeting.query.filter(or_(
-        Meeting.chair.has(id=current_user.id),
-        Meeting.minute_taker.has(id=current_user.id),
-        Meeting.attendees.any(id=current_user.id)
-    ))
+    return render_template('calendar.html', title='會議行事曆')
 
-    if current_user.is_admin():
-        meetings = Meeting.query
 
-    return render_template('calendar.html', title='會議行事曆', meetings=meetings)
+@app.route('/api/calendar/events')
+@login_required
+def calendar_events_api():
+    """
+    會議行事曆事件 API，供 FullCalendar 依顯示的日期範圍呼叫
+    :request.args start: 起始時間（ISO 8601，包含）
+    :request.args end: 結束時間（ISO 8601，不包含）
+    :return: JSON 陣列，內容未變更時回傳 HTTP Response 304
+    """
+    try:
+        start = datetime.fromisoformat(request.args['start']).replace(tzinfo=None)
+        end = datetime.fromisoformat(request.args['end']).replace(tzinfo=None)
+    except (KeyError, ValueError):
+        return abort(400)
+
+    meetings = visible_meetings(current_user).filter(Meeting.time >= start, Meeting.time < end) \
+        .with_entities(Meeting.id, Meeting.title, Meeting.time).order_by(Meeting.time)
+
+    events = [{'title': meeting.title,
+               'start': meeting.time.isoformat(),
+               'url': url_for('meeting_page', meeting_id=meeting.id)} for meeting in meetings]
+
+    response = jsonify(events)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.add_etag()
+    return response.make_conditional(request)
 
 
 @app.route('/motion')
@@ -111,15 +192,7 @@ def motion_page():
     顯示討論事項（決策追蹤）列表頁面
     :return: 討論事項列表頁面
     """
-    meetings = Meeting.query.filter(or_(
-        Meeting.chair.has(id=current_user.id),
-        Meeting.minute_taker.has(id=current_user.id),
-        Meeting.attendees.any(id=current_user.id)
-    ))
-    motions = Motion.query.join(meetings.subquery()).join(Meeting).order_by(Motion.status, Meeting.time)
-
-    if current_user.is_admin():
-        motions = Motion.query.join(Meeting).order_by(Motion.status, Meeting.time)
+    motions = visible_meetings(current_user, Motion.query.join(Meeting)).order_by(Motion.status, Meeting.time)
 
     return render_template('motion.html', title='決策追蹤', motions=motions)
 
@@ -133,9 +206,37 @@ def person_page(person_id=None):
     :param person_id: 人員編號
     :return: 人員列表頁面
     """
-    people = Person.query.order_by(Person.name)
-    person = people.get_or_404(person_id) if person_id else None
-    return render_template('person.html', title='人員列表', people=people, person=person)
+    person = Person.query_profile().get_or_404(person_id) if person_id else None
+    return render_template('person.html', title='人員列表', people=directory.people.all(), person=person)
+
+
+@app.route('/api/people/suggest')
+@login_required
+def people_suggest_api():
+    """
+    人員選單即時搜尋 API
+    :request.args q: 姓名或電子郵件的開頭，含中文時也比對姓名中間的字
+    :request.args limit: 最多筆數
+    :return: JSON 物件（人員列表）
+    """
+    limit = min(max(request.args.get('limit', app.config['PEOPLE_SUGGEST_LIMIT'], type=int), 1), 100)
+    return jsonify({'people': [directory.person_json(record)
+                               for record in directory.people.suggest(request.args.get('q', ''), limit)]})
+
+
+@app.route('/api/people')
+@login_required
+def people_api():
+    """
+    取得指定人員的選單資料（編輯會議、套用模板時載入已選取的人員）
+    :request.args ids: 以逗號分隔的人員編號
+    :return: JSON 物件（人員列表）
+    """
+    try:
+        person_ids = [int(person_id) for person_id in request.args.get('ids', '').split(',') if person_id]
+    except ValueError:
+        abort(400)
+    return jsonify({'people': [directory.person_json(record) for record in directory.people.get(person_ids)]})
 
 
 @app.route('/statistics')
@@ -146,72 +247,7 @@ def statistics_page():
     顯示統計資料頁面
     :return: 統計資料頁面
     """
-    today = datetime.today()
-    year = today.year
-    week_start = (today - timedelta(days=today.weekday() + 1)).replace(hour=0, minute=0, second=0, microsecond=0)
-    if today.weekday() == 6:
-        week_start = today.replace(hour=0, minute=0, second=0, microsecond=0)
-    week_end = (week_start + timedelta(days=6)).replace(hour=23, minute=59, second=59, microsecond=0)
-
-    month_str = ['一月', '二月', '三月', '四月', '五月', '六月', '七月', '八月', '九月', '十月', '十一月', '十二月']
-
-    months_meeting_count = []
-    motion_status_count = [0, 0, 0]
-
-    if today.month <= 1 or today.month >= 8:  # 上學期（8月~隔年1月）
-        if today.month <= 1:
-            year -= 1
-
-        for i in range(1, 2):
-            meetings = Meeting.query.filter(
-                and_(extract('year', Meeting.time) == year + 1, extract('month', Meeting.time) == i))
-            months_meeting_count.append((month_str[i - 1], meetings.count()))
-            for motion in Motion.query.join(meetings.subquery()):
-                if motion.status.value == '討論中':
-                    motion_status_count[0] += 1
-                elif motion.status.value == '執行中':
-                    motion_status_count[1] += 1
-                elif motion.status.value == '結案':
-                    motion_status_count[2] += 1
-
-        for i in range(8, 13):
-            meetings = Meeting.query.filter(
-                and_(extract('year', Meeting.time) == year, extract('month', Meeting.time) == i))
-            months_meeting_count.append((month_str[i - 1], meetings.count()))
-            for motion in Motion.query.join(meetings.subquery()):
-                if motion.status.value == '討論中':
-                    motion_status_count[0] += 1
-                elif motion.status.value == '執行中':
-                    motion_status_count[1] += 1
-                elif motion.status.value == '結案':
-                    motion_status_count[2] += 1
-
-    else:  # 下學期（2月~7月）
-        for i in range(2, 8):
-            meetings = Meeting.query.filter(
-                and_(extract('year', Meeting.time) == year, extract('month', Meeting.time) == i))
-            months_meeting_count.append((month_str[i - 1], meetings.count()))
-            for motion in Motion.query.join(meetings.subquery()):
-                if motion.status.value == '討論中':
-                    motion_status_count[0] += 1
-                elif motion.status.value == '執行中':
-                    motion_status_count[1] += 1
-                elif motion.status.value == '結案':
-                    motion_status_count[2] += 1
-
-    data = {
-        'week_meeting_count': Meeting.query.filter(and_(Meeting.time > week_start, Meeting.time < week_end)).count(),
-        'week_motion_count': Motion.query.join(
-            Meeting.query.filter(and_(Meeting.time > week_start, Meeting.time < week_end)).subquery()).count(),
-        'person_count': Person.query.count(),
-        'feedback_count': Feedback.query.count(),
-        'months_meeting_count': months_meeting_count,
-        'semester_motion_status_percentage': [
-            ('討論中', motion_status_count[0]),
-            ('執行中', motion_status_count[1]),
-            ('結案', motion_status_count[2])
-        ]
-    }
+    data = statistics.dashboard_data()
     return render_template('statistics.html', title='統計資料', data=data)
 
 
@@ -238,32 +274,25 @@ def search_page():
     全文搜尋功能
     :request.form searchText: 關鍵字 [POST]
     :request.args query: 關鍵字
+    :request.args page: 頁碼
     :return: 搜尋頁面
     """
     if request.method == 'POST':
         search_text = request.form.get('searchText') if request.form.get('searchText') else ''
         return redirect(url_for('search_page', query=search_text))
 
-    query = request.args.get('query')
+    query = request.args.get('query', '')
+    page = max(request.args.get('page', 1, type=int), 1)
 
-    meeting_list = Meeting.query.msearch(query, fields=['title', 'chair_speech'])
-    announcement_list = Meeting.query.join(Announcement.query.msearch(query, fields=['content']).subquery())
-    motion_list = Meeting.query.join(
-        Motion.query.msearch(query, fields=['description', 'content', 'resolution', 'execution']).subquery())
-    extempore_list = Meeting.query.join(Extempore.query.msearch(query, fields=['content']).subquery())
+    meeting_ids = None
+    if not current_user.is_admin():
+        meeting_ids = [row.meeting_id for row in visible_meeting_ids(current_user.id)]
+    result = search.search_meetings(query, meeting_ids, page)
 
-    if current_user.is_admin():
-        meetings = meeting_list.union(announcement_list, extempore_list, motion_list).order_by(desc(Meeting.time))
-    else:
-        meetings = meeting_list.union(announcement_list, extempore_list, motion_list).filter(or_(
-            Meeting.chair.has(id=current_user.id),
-            Meeting.minute_taker.has(id=current_user.id),
-            Meeting.attendees.any(id=current_user.id)
-        )).order_by(desc(Meeting.time))
-
-    people = Person.query.msearch(query, fields=['name']).order_by(Person.name)
+    people = Person.query.filter(Person.name.contains(query, autoescape=True)).order_by(Person.name).all() \
+        if query else []
     return render_template('search.html', title='「' + query + '」的搜尋結果', search_text=query,
-                           meetings=meetings, people=people, timedelta=timedelta)
+                           result=result, people=people, timedelta=timedelta)
 
 
 @app.route('/yearlist')
@@ -274,27 +303,53 @@ def yearlist_page():
     列出歷年會議
     :return: 歷年會議總表頁面
     """
-    data = {}
-    for year in Meeting.query.with_entities(extract('year', Meeting.time)).distinct().all():
-        data[str(year[0])] = Meeting.query.filter(
-            extract('year', Meeting.time) == year[0]).order_by(desc(Meeting.time)).all()
+    data = {str(year): [] for year in statistics.yearly_meeting_count()}
+    for meeting in Meeting.query.order_by(desc(Meeting.time)):
+        data.setdefault(str(meeting.time.year), []).append(meeting)
     return render_template('yearlist.html', title='歷年會議總表', data=data, timedelta=timedelta)
 
 
+def versioned_response(meeting_id, variant, render):
+    """
+    以會議版本作為強 ETag 的回應：會議或其子項目寫入、或會議中顯示的人員資料修改時版本即遞增，
+    If-None-Match 符合時只查詢版本欄位並回傳 HTTP Response 304，不載入會議內容
+    :param meeting_id: 會議編號
+    :param variant: 區分同一會議不同回應內容的字串
+    :param render: 產生回應內容的函式
+    :return: Response
+    """
+    version = db.session.query(Meeting.version).filter_by(id=meeting_id).scalar()
+    if version is None:
+        return abort(404)
+    etag = f'meeting-{meeting_id}-{version}-{variant}'
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = make_response(render())
+    response.set_etag(etag)
+    # 由頁面自行保存內容並以 If-None-Match 重新驗證，瀏覽器不另外快取（部署新版面時不會沿用舊內容）
+    response.cache_control.private = True
+    response.cache_control.no_store = True
+    return response
+
+
 @app.route('/get/meeting')
 @login_required
 def meeting_view():
     """
     顯示會議記錄區塊，利用 JavaScript 呼叫並更新前端
     :request.args id: 會議編號
-    :return: 會議記錄區塊
+    :request.headers If-None-Match: 先前取得的 ETag
+    :return: 會議記錄區塊，未變更時回傳 HTTP Response 304
     """
     meeting_id = request.args.get('id')
     if not meeting_id:
         return abort(400)
-    meeting = Meeting.query.get_or_404(int(meeting_id))
-    attendees = Attendee.query.filter_by(meeting_id=meeting_id)
-    return render_template('components/meeting-view.html', meeting=meeting, attendees=attendees)
+    meeting_id = int(meeting_id)
+    # 區塊中的按鈕依使用者身分顯示
+    variant = f'view-{current_user.id}-{int(current_user.is_admin())}'
+    return versioned_response(meeting_id, variant, lambda: render_template(
+        'components/meeting-view.html', meeting=Meeting.query_full().filter_by(id=meeting_id).first_or_404()))
 
 
 @app.route('/get/motion')
@@ -323,7 +378,7 @@ def person_view():
     person_id = request.args.get('id')
     if not person_id:
         return abort(404)
-    person = Person.query.get_or_404(int(person_id))
+    person = Person.query_profile().get_or_404(int(person_id))
     return render_template('components/person-view.html', person=person)
 
 
@@ -333,13 +388,18 @@ def person_view():
 def new_meeting():
     """
     新增會議記錄 API
-    :request.form json_form: 新增會議表單
-    :request.files files[]: 附件檔案
+    :request.form json_form: 新增會議表單（uploads 為已上傳完成的附件上傳編號）
     :return: JSON 物件
     """
     form = request.form
     data = json.loads(form['json_form'])
-    files = request.files.getlist('files[]')
+
+    people, missing = resolve_people(data['attendee'], data['guest'], [data['chair'], data['minuteTaker']])
+    if missing:
+        return jsonify({'message': 'Person not found', 'missing': missing})
+    attachments, missing = uploads.resolve_uploads(data.get('uploads', []), current_user.id)
+    if missing:
+        return jsonify({'message': 'Upload not found', 'missing': missing})
 
     meeting = Meeting()
     meeting.title = data['title']
@@ -349,26 +409,10 @@ def new_meeting():
     meeting.chair_id = int(data['chair'])
     meeting.minute_taker_id = int(data['minuteTaker'])
     meeting.chair_speech = data['chairSpeech']
-
-    for att_id in data['attendee']:
-        person = Person.query.get(int(att_id))
-        meeting.attendees.append(person)
-
-    for gue_id in data['guest']:
-        person = Person.query.get(int(gue_id))
-        meeting.attendees.append(person)
-        meeting.attendee_association[-1].is_member = False
+    meeting.attendee_association = build_attendees(people, data)
 
     db.session.add(meeting)
-    db.session.commit()
-
-    attendees = meeting.attendee_association
-    present = data['present']
-    for attendee in attendees:
-        if attendee.person_id in present:
-            attendee.is_present = True
-        else:
-            attendee.is_present = False
+    db.session.flush()
 
     for content in data['announcement']:
         announcement = Announcement(content)
@@ -386,13 +430,7 @@ def new_meeting():
         extempore = Extempore(content)
         meeting.extempores.append(extempore)
 
-    for file in files:
-        # secure_filename() does not allow Chinese characters
-        filename = str(meeting.id) + '-' + file.filename
-        filepath = path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        attachment = Attachment(filename, filepath)
-        meeting.attachments.append(attachment)
+    uploads.attach_uploads(meeting, attachments)
 
     db.session.commit()
     return jsonify({'message': 'Success'})
@@ -472,76 +510,31 @@ def new_person():
 def edit_meeting(meeting_id):
     """
     編輯會議紀錄
-    :request.form json_form: 編輯會議表單
-    :request.files files[]: 附件檔案
+    :request.form json_form: 編輯會議表單（uploads 為已上傳完成的附件上傳編號）
     :param meeting_id: 會議編號
     :return: 編輯會議紀錄頁面
     """
-    meeting = Meeting.query.get_or_404(int(meeting_id))
-    people = Person.query.all()
-
     if request.method == 'POST':
+        meeting = Meeting.query_full().filter_by(id=meeting_id).first_or_404()
         form = request.form
         data = json.loads(form['json_form'])
-        files = request.files.getlist('files[]')
-
-        meeting.title = data['title']
-        meeting.time = data['time']
-        meeting.location = data['location']
-        meeting.type = data['type']
-        meeting.chair_id = int(data['chair'])
-        meeting.minute_taker_id = int(data['minuteTaker'])
-        meeting.chair_speech = data['chairSpeech']
-
-        meeting.attendees.clear()
-        for att_id in data['attendee']:
-            person = Person.query.get(int(att_id))
-            meeting.attendees.append(person)
-
-        for gue_id in data['guest']:
-            person = Person.query.get(int(gue_id))
-            meeting.attendees.append(person)
-            meeting.attendee_association[-1].is_member = False
-
-        attendees = Attendee.query.filter_by(meeting_id=meeting.id)
-
-        present = data['present']
-        for attendee in attendees:
-            if attendee.person_id in present:
-                attendee.is_present = True
-            else:
-                attendee.is_present = False
-
-        meeting.announcements.clear()
-        for content in data['announcement']:
-            announcement = Announcement(content)
-            meeting.announcements.append(announcement)
-
-        meeting.motions.clear()
-        for motion_form in data['motion']:
-            motion = Motion(motion_form['MotionDescription'],
-                            motion_form['MotionContent'],
-                            motion_form['MotionStatus'],
-                            motion_form['MotionResolution'],
-                            motion_form['MotionExecution'])
-            meeting.motions.append(motion)
-
-        meeting.extempores.clear()
-        for content in data['extempore']:
-            extempore = Extempore(content)
-            meeting.extempores.append(extempore)
-
-        for file in files:
-            # secure_filename() does not allow Chinese characters
-            filename = str(meeting.id) + '-' + file.filename
-            filepath = path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-            attachment = Attachment(filename, filepath)
-            meeting.attachments.append(attachment)
+
+        people, missing = resolve_people(data['attendee'], data['guest'], [data['chair'], data['minuteTaker']])
+        if missing:
+            return jsonify({'message': 'Person not found', 'missing': missing})
+        attachments, missing = uploads.resolve_uploads(data.get('uploads', []), current_user.id)
+        if missing:
+            return jsonify({'message': 'Upload not found', 'missing': missing})
+
+        counts = update_meeting(meeting, data, people)
+        uploads.attach_uploads(meeting, attachments)
+        counts.inserted += len(attachments)
 
         db.session.commit()
-        return jsonify({'message': 'Success'})
-    return render_template('meeting-edit.html', title=meeting.title, people=people)
+        return jsonify({'message': 'Success', 'writes': counts.to_dict()})
+
+    meeting = Meeting.query.get_or_404(int(meeting_id))
+    return render_template('meeting-edit.html', title=meeting.title)
 
 
 @app.route('/edit/person/<int:person_id>', methods=['GET', 'POST'])
@@ -552,7 +545,7 @@ def edit_person(person_id):
     :param person_id: 人員編號
     :return: 編輯人員資訊頁面
     """
-    person = Person.query.get_or_404(int(person_id))
+    person = Person.query_profile().get_or_404(int(person_id))
     if request.method == 'POST':
         form = request.form.to_dict()
         person.name = form['pNameInput']
@@ -620,12 +613,7 @@ def delete_meeting(meeting_id):
     :return: 重新導向至會議列表頁面
     """
     meeting = Meeting.query.get_or_404(int(meeting_id))
-    for file in meeting.attachments:
-        try:
-            remove(file.file_path)
-        except FileNotFoundError:
-            print('FileNotFoundError: The system cannot find the path specified')
-            abort(500)
+    # 附件檔案在交易提交後由 main.attachments 依參照數刪除
     db.session.delete(meeting)
     db.session.commit()
     return redirect(url_for('meeting_page'))
@@ -640,12 +628,60 @@ def delete_person(person_id):
     :param person_id: 人員編號
     :return: 重新導向至人員列表頁面
     """
-    person = Person.query.get_or_404(int(person_id))
+    person = Person.query_profile().get_or_404(int(person_id))
     db.session.delete(person)
     db.session.commit()
     return redirect(url_for('person_page'))
 
 
+@app.route('/upload', methods=['POST'])
+@login_required
+@admin_required
+def new_upload():
+    """
+    建立分段上傳 API
+    :request.json filename: 檔案名稱
+    :request.json size: 檔案大小（位元組）
+    :request.json sha256: 內容 SHA-256（可省略，已存在於檔案庫時不需再上傳內容）
+    :return: JSON 物件，包含上傳編號與建議的分段大小
+    """
+    data = request.get_json()
+    try:
+        size = int(data['size'])
+        upload_id, completed = uploads.create_upload(data['filename'], size, current_user.id, data.get('sha256'))
+    except (KeyError, TypeError, ValueError):
+        return abort(400)
+    return jsonify({'id': upload_id, 'offset': size if completed else 0, 'completed': completed,
+                    'chunk_size': app.config['UPLOAD_CHUNK_SIZE']})
+
+
+@app.route('/upload/<upload_id>', methods=['GET', 'PATCH'])
+@login_required
+@admin_required
+def upload_chunk(upload_id):
+    """
+    分段上傳 API：GET 取得已接收的位置以續傳，PATCH 從 Upload-Offset 標頭指定的位置寫入請求內容
+    :request.headers Upload-Offset: 此段內容的起始位置，須等於已接收的位元組數 [PATCH]
+    :param upload_id: 上傳編號
+    :return: JSON 物件，位置不符時回傳 HTTP Response 409
+    """
+    upload = Upload.query.filter_by(id=upload_id, uploader_id=current_user.id).first_or_404()
+    if request.method == 'GET':
+        return jsonify({'offset': upload.offset, 'size': upload.size, 'completed': upload.completed})
+
+    if request.headers.get('Upload-Offset', type=int) != upload.offset or upload.completed:
+        return jsonify({'message': 'Offset conflict', 'offset': upload.offset}), 409
+    try:
+        result = uploads.write_chunk(upload, request.stream)
+    except ValueError:
+        return abort(400)
+    if result is None:
+        return jsonify({'message': 'Offset conflict'}), 409
+
+    offset, completed = result
+    return jsonify({'message': 'Success', 'offset': offset, 'completed': completed})
+
+
 @app.route('/delete/attachment/<int:file_id>', methods=['POST'])
 @login_required
 @admin_required
@@ -656,16 +692,33 @@ def delete_attachment(file_id):
     :return: JSON 物件
     """
     file = Attachment.query.filter_by(id=file_id).first_or_404()
-    try:
-        remove(file.file_path)
-    except FileNotFoundError:
-        print('FileNotFoundError: The system cannot find the path specified')
-        abort(500)
+    # 檔案在交易提交後由 main.attachments 依參照數刪除
     db.session.delete(file)
     db.session.commit()
     return jsonify({'message': 'Success'})
 
 
+@app.route('/uploads/meeting/<int:meeting_id>.zip')
+@login_required
+@admin_required
+def download_meeting_attachments(meeting_id):
+    """
+    以 ZIP 下載會議的所有附件，邊讀取邊傳送
+    :param meeting_id: 會議編號
+    :return: ZIP 檔案
+    """
+    db.session.query(Meeting.id).filter_by(id=meeting_id).first_or_404()
+    files = db.session.query(Attachment.filename, Attachment.file_path) \
+        .filter_by(meeting_id=meeting_id).order_by(Attachment.id).all()
+    names = attachments.archive_names(filename for filename, _ in files)
+    response = app.response_class(attachments.stream_zip(zip(names, (file_path for _, file_path in files))),
+                                  mimetype='application/zip')
+    response.headers.set('Content-Disposition', 'attachment', filename=f'meeting-{meeting_id}.zip')
+    response.cache_control.private = True
+    response.cache_control.no_store = True
+    return response
+
+
 @app.route('/uploads/<int:file_id>')
 @login_required
 @admin_required
@@ -673,11 +726,36 @@ def download_attachment(file_id):
     """
     下載附件檔案
     :param file_id: 檔案編號
-    :return: 檔案
+    :return: 檔案，未變更時回傳 HTTP Response 304，Range 請求回傳 HTTP Response 206
     """
-    file = Attachment.query.filter_by(id=file_id).first()
-    return send_file(path_or_file=file.file_path, as_attachment=False,
-                     download_name=file.filename.split('-', 1)[1])
+    file = db.session.query(Attachment.filename, Attachment.file_path, Attachment.sha256) \
+        .filter_by(id=file_id).first_or_404()
+    try:
+        return attachments.send_attachment(file.file_path, file.sha256, file.filename.split('-', 1)[1])
+    except FileNotFoundError:
+        return abort(404)
+
+
+@app.route('/uploads/<int:file_id>/thumbnail')
+@login_required
+@admin_required
+def attachment_thumbnail(file_id):
+    """
+    附件縮圖，由背景預覽程序產生
+    :param file_id: 檔案編號
+    :return: JPEG 縮圖，尚未產生時回傳 HTTP Response 404
+    """
+    sha256 = db.session.query(Attachment.sha256).filter_by(id=file_id).scalar()
+    if not sha256:
+        return abort(404)
+    try:
+        # 同一附件的內容不會改變，縮圖可快取
+        response = send_file(previews.preview_path(sha256, 'jpg'), mimetype='image/jpeg', etag=sha256, max_age=86400)
+    except FileNotFoundError:
+        return abort(404)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
 
 
 @app.route('/api/meeting/<int:meeting_id>')
@@ -687,10 +765,19 @@ def meeting_api(meeting_id):
     """
     會議記錄 API
     :param meeting_id: 會議編號
-    :return: JSON 物件
+    :request.headers If-None-Match: 先前取得的 ETag
+    :return: JSON 物件，未變更時回傳 HTTP Response 304
     """
-    meeting = Meeting.query.get_or_404(int(meeting_id))
+    return versioned_response(meeting_id, 'api', lambda: meeting_json(
+        Meeting.query_full().filter_by(id=meeting_id).first_or_404()))
+
 
+def meeting_json(meeting):
+    """
+    組成會議記錄 API 的 JSON 物件
+    :param meeting: 會議（以 Meeting.query_full() 載入）
+    :return: JSON 物件
+    """
     attendee = []
     guest = []
     att_present = []
@@ -709,11 +796,13 @@ def meeting_api(meeting_id):
                 gue_present.append(att.person_id)
 
     for mot in meeting.motions:
-        motion = {'description': mot.description,
+        motion = {'id': mot.id,
+                  'description': mot.description,
                   'content': mot.content,
                   'status': mot.status.name,
                   'resolution': mot.resolution,
-                  'execution': mot.execution}
+                  'execution': mot.execution,
+                  'version': mot.version}
         motions.append(motion)
 
     for file in meeting.attachments:
@@ -738,11 +827,139 @@ def meeting_api(meeting_id):
                  'announcements': [ann.content for ann in meeting.announcements],
                  'motions': motions,
                  'extempore': [ext.content for ext in meeting.extempores],
-                 'files': files}
+                 'files': files,
+                 'autosave': {
+                     'announcements': [{'id': ann.id, 'version': ann.version} for ann in meeting.announcements],
+                     'extempores': [{'id': ext.id, 'version': ext.version} for ext in meeting.extempores],
+                     'attendees': {att.person_id: att.version for att in meeting.attendee_association}
+                 }}
 
     return jsonify(meet_info)
 
 
+CONTENT_MODELS = {'announcement': Announcement, 'extempore': Extempore}
+MOTION_FIELDS = ['description', 'content', 'status', 'resolution', 'execution']
+
+
+def json_object():
+    """
+    讀取 JSON 物件格式的請求內容
+    :return: dict，請求內容不是 JSON 物件時為 None
+    """
+    data = request.get_json(silent=True)
+    return data if isinstance(data, dict) else None
+
+
+def save_patch(row, version, values):
+    """
+    以樂觀版本檢查儲存單一資料列的修改：版本不符時不寫入，UPDATE 也以版本為條件避免同時修改
+    :param row: 要修改的資料列（需有 version 欄位）
+    :param version: 用戶端持有的版本
+    :param values: {欄位名稱: 新值}
+    :return: JSON 回應
+    """
+    if version != row.version:
+        return jsonify({'message': 'Version conflict', 'version': row.version}), 409
+    if assign(row, **values):
+        try:
+            db.session.flush()
+        except StaleDataError:
+            db.session.rollback()
+            return jsonify({'message': 'Version conflict'}), 409
+        version = row.version
+        db.session.commit()
+    return jsonify({'message': 'Success', 'version': version})
+
+
+@app.route('/api/meeting/<int:meeting_id>/motion/<int:motion_id>', methods=['PATCH'])
+@login_required
+@admin_required
+def patch_motion(meeting_id, motion_id):
+    """
+    自動儲存單一討論事項
+    :request.json version: 討論事項版本
+    :request.json description, content, status, resolution, execution: 要修改的欄位（皆可省略）
+    :param meeting_id: 會議編號
+    :param motion_id: 討論事項編號
+    :return: JSON 物件
+    """
+    motion = Motion.query.filter_by(id=motion_id, meeting_id=meeting_id).first_or_404()
+    data = json_object()
+    if data is None:
+        return jsonify({'message': 'Invalid data'}), 400
+    values = {key: data[key] for key in MOTION_FIELDS if key in data}
+    if 'status' in values:
+        try:
+            values['status'] = MotionStatusType[values['status']]
+        except (KeyError, TypeError):
+            return jsonify({'message': 'Invalid status'}), 400
+    return save_patch(motion, data.get('version'), values)
+
+
+@app.route('/api/meeting/<int:meeting_id>/<any(announcement, extempore):kind>', methods=['POST'])
+@login_required
+@admin_required
+def append_content(meeting_id, kind):
+    """
+    自動儲存時新增一則公告或臨時動議
+    :request.json content: 內容
+    :param meeting_id: 會議編號
+    :param kind: announcement 或 extempore
+    :return: JSON 物件，包含新項目的編號與版本
+    """
+    if not db.session.query(Meeting.query.filter_by(id=meeting_id).exists()).scalar():
+        abort(404)
+    data = json_object()
+    if data is None or not isinstance(data.get('content'), str):
+        return jsonify({'message': 'Invalid data'}), 400
+    item = CONTENT_MODELS[kind](data['content'])
+    item.meeting_id = meeting_id
+    db.session.add(item)
+    db.session.flush()
+    item_id, version = item.id, item.version
+    db.session.commit()
+    return jsonify({'message': 'Success', 'id': item_id, 'version': version})
+
+
+@app.route('/api/meeting/<int:meeting_id>/<any(announcement, extempore):kind>/<int:item_id>', methods=['PATCH'])
+@login_required
+@admin_required
+def patch_content(meeting_id, kind, item_id):
+    """
+    自動儲存單一公告或臨時動議
+    :request.json version: 項目版本
+    :request.json content: 內容
+    :param meeting_id: 會議編號
+    :param kind: announcement 或 extempore
+    :param item_id: 項目編號
+    :return: JSON 物件
+    """
+    item = CONTENT_MODELS[kind].query.filter_by(id=item_id, meeting_id=meeting_id).first_or_404()
+    data = json_object()
+    if data is None or not isinstance(data.get('content'), str):
+        return jsonify({'message': 'Invalid data'}), 400
+    return save_patch(item, data.get('version'), {'content': data['content']})
+
+
+@app.route('/api/meeting/<int:meeting_id>/attendee/<int:person_id>', methods=['PATCH'])
+@login_required
+@admin_required
+def patch_attendee(meeting_id, person_id):
+    """
+    自動儲存單一與會人員的出席狀態
+    :request.json version: 與會人員版本
+    :request.json is_present: 是否出席
+    :param meeting_id: 會議編號
+    :param person_id: 人員編號
+    :return: JSON 物件
+    """
+    attendee = Attendee.query.get_or_404((meeting_id, person_id))
+    data = json_object()
+    if data is None or 'is_present' not in data:
+        return jsonify({'message': 'Invalid data'}), 400
+    return save_patch(attendee, data.get('version'), {'is_present': bool(data['is_present'])})
+
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     """
@@ -779,8 +996,7 @@ def recover():
         recipients = [email]
         msg = Message('找回您的密碼 - 會議管理系統', sender=sender, recipients=recipients)
         msg.body = '您的密碼為：' + person.password
-        thread = Thread(target=send_async_email, args=[app, msg])
-        thread.start()
+        mailer.send(msg)
     return render_template('recover.html', title='忘記密碼')
 
 
@@ -795,8 +1011,9 @@ def reset():
     """
     old_password = request.form.get('oldPassword')
     new_password = request.form.get('newPassword')
-    if current_user.password == old_password:
-        current_user.password = new_password
+    person = Person.query.get(current_user.id)
+    if person.password == old_password:
+        person.password = new_password
         db.session.commit()
         return redirect(url_for('home'))
     elif old_password:
@@ -814,14 +1031,26 @@ def logout():
     return redirect(url_for('login'))
 
 
-def send_async_email(current_app, msg):
+@app.route('/api/mail/status')
+@login_required
+@admin_required
+def mail_status_api():
+    """
+    郵件佇列狀態 API
+    :return: JSON 物件（待寄送數、失敗數、等待秒數）
+    """
+    return jsonify(mailer.queue.status()._asdict())
+
+
+@app.route('/api/user-cache/status')
+@login_required
+@admin_required
+def user_cache_status_api():
     """
-    送出電子郵件 (用於異步處理)
-    :param current_app: Flask 實例
-    :param msg: flask_mail.Message 物件
+    登入使用者快取狀態 API（此行程）
+    :return: JSON 物件（快取人數、命中數、未命中數、命中率）
     """
-    with current_app.app_context():
-        mail.send(msg)
+    return jsonify(users.cache.status()._asdict())
 
 
 @app.route('/mail/notice/<int:meeting_id>')
@@ -833,15 +1062,13 @@ def send_meeting_notice(meeting_id):
     :param meeting_id: 會議編號
     :return: HTTP Response 200
     """
-    meeting = Meeting.query.get_or_404(meeting_id)
-    attendees = Attendee.query.filter_by(meeting_id=meeting_id)
+    meeting = Meeting.query_full().filter_by(id=meeting_id).first_or_404()
     sender = ('會議管理系統', '110.database.csie.nuk@gmail.com')
     recipients = [att.email for att in meeting.attendees] + [meeting.chair.email]
     title = '開會通知 - ' + meeting.title
     msg = Message(title, sender=sender, recipients=recipients)
-    msg.html = render_template('components/mail-meeting-minute.html', meeting=meeting, attendees=attendees, agenda=True)
-    thread = Thread(target=send_async_email, args=[app, msg])
-    thread.start()
+    msg.html = rendering.render_minute(meeting, agenda=True)
+    mailer.send(msg)
     return 'Success', 200
 
 
@@ -854,15 +1081,13 @@ def send_meeting_minute(meeting_id):
     :param meeting_id: 會議編號
     :return: HTTP Response 200
     """
-    meeting = Meeting.query.get_or_404(meeting_id)
-    attendees = Attendee.query.filter_by(meeting_id=meeting_id)
+    meeting = Meeting.query_full().filter_by(id=meeting_id).first_or_404()
     sender = ('會議管理系統', '110.database.csie.nuk@gmail.com')
     recipients = [att.email for att in meeting.attendees] + [meeting.chair.email]
     title = '會議結果 - ' + meeting.title
     msg = Message(title, sender=sender, recipients=recipients)
-    msg.html = render_template('components/mail-meeting-minute.html', meeting=meeting, attendees=attendees)
-    thread = Thread(target=send_async_email, args=[app, msg])
-    thread.start()
+    msg.html = rendering.render_minute(meeting)
+    mailer.send(msg)
     return 'Success', 200
 
 
@@ -883,8 +1108,7 @@ def send_meeting_modify_request(meeting_id):
     html = f'<h1>請求修改會議紀錄</h1><p>會議：{meeting.title}</p><p>來自：{current_user.name}</p><p>{modify_request}</p>'
     msg = Message(title, sender=sender, recipients=recipients)
     msg.html = html
-    thread = Thread(target=send_async_email, args=[app, msg])
-    thread.start()
+    mailer.send(msg)
     return 'Success', 200
 
 
@@ -897,9 +1121,7 @@ def print_meeting_minute(meeting_id):
     :param meeting_id: 會議編號
     :return: 列印頁面
     """
-    meeting = Meeting.query.get_or_404(meeting_id)
-    attendees = Attendee.query.filter_by(meeting_id=meeting_id)
-    return render_template('components/mail-meeting-minute.html', meeting=meeting, attendees=attendees)
+    return rendering.cached_minute(meeting_id)
 
 
 @app.route('/confirm')
@@ -912,31 +1134,38 @@ def confirm_meeting_minute():
     :request.args confirm: 確認 或 取消確認
     :return: HTTP Response 200
     """
-    person_id = request.args.get('person_id')
-    meeting_id = request.args.get('meeting_id')
-    meeting = Meeting.query.get(meeting_id)
+    person_id = int(request.args.get('person_id'))
+    meeting_id = int(request.args.get('meeting_id'))
+    confirmed = request.args.get('confirm') == 'true'
 
-    if request.args.get('confirm') == 'true':
-        if str(meeting.chair_id) == person_id:
-            meeting.chair_confirmed = True
-        else:
-            attendee = Attendee.query.filter_by(person_id=person_id, meeting_id=meeting_id).first()
-            attendee.is_confirmed = True
-
-        all_confirmed = meeting.chair_confirmed
-        for attendee in meeting.attendees:
-            a = Attendee.query.filter_by(person_id=attendee.id, meeting_id=meeting.id).first()
-            all_confirmed = all_confirmed and a.is_confirmed
-        if all_confirmed:
-            meeting.archived = True
+    # 鎖定會議列，同一會議的確認依序處理，避免同時確認時漏掉封存
+    chair_id = db.session.query(Meeting.chair_id).filter_by(id=meeting_id).with_for_update().first_or_404()[0]
+
+    if chair_id == person_id:
+        db.session.execute(update(Meeting).where(Meeting.id == meeting_id)
+                           .values(chair_confirmed=confirmed, version=Meeting.version + 1)
+                           .execution_options(synchronize_session=False))
+    else:
+        result = db.session.execute(update(Attendee).where(Attendee.meeting_id == meeting_id,
+                                                           Attendee.person_id == person_id)
+                                    .values(is_confirmed=confirmed, version=Attendee.version + 1)
+                                    .execution_options(synchronize_session=False))
+        if result.rowcount == 0:
+            abort(404)
+        db.session.execute(update(Meeting).where(Meeting.id == meeting_id)
+                           .values(version=Meeting.version + 1).execution_options(synchronize_session=False))
+
+    if confirmed:
+        # 主席與所有與會人員皆已確認時封存，檢查與封存在同一個 UPDATE 內完成
+        unconfirmed = exists().where(Attendee.meeting_id == meeting_id, Attendee.is_confirmed.is_(False))
+        result = db.session.execute(update(Meeting).where(Meeting.id == meeting_id,
+                                                          Meeting.chair_confirmed.is_(True),
+                                                          ~unconfirmed)
+                                    .values(archived=True, version=Meeting.version + 1)
+                                    .execution_options(synchronize_session=False))
+        if result.rowcount:
             db.session.commit()
             return 'Archived', 200
-    else:
-        if str(meeting.chair_id) == person_id:
-            meeting.chair_confirmed = False
-        else:
-            attendee = Attendee.query.filter_by(person_id=person_id, meeting_id=meeting_id).first()
-            attendee.is_confirmed = False
 
     db.session.commit()
     return 'Success', 200
@@ -944,26 +1173,75 @@ def confirm_meeting_minute():
 
 @app.route('/template/get')
 def get_template():
-    template_list = MeetingTemplate.query.all()
-    data = []
-    for template in template_list:
-        attendees = []
-        guests = []
-        for person in template.attendees:
-            attendees.append(person.id)
-        for person in template.guests:
-            guests.append(person.id)
-        data.append({'id': template.id,
-                     'name': template.name,
-                     'title': template.title,
-                     'time': template.time,
-                     'location': template.location,
-                     'type': template.type.name,
-                     'chair': template.chair_id,
-                     'minuteTaker': template.minute_taker_id,
-                     'attendees': attendees,
-                     'guests': guests})
-    return jsonify({'templateList': data})
+    """
+    會議模板列表
+    :request.headers If-None-Match: 先前取得的 ETag
+    :return: JSON 物件，未變更時回傳 HTTP Response 304
+    """
+    body, etag = meeting_templates.directory.get()
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+@app.route('/template/<int:template_id>/instantiate', methods=['POST'])
+@login_required
+@admin_required
+def instantiate_template(template_id):
+    """
+    依會議模板與週期規則，在同一交易中一次建立多場會議與其與會人員
+    已有相同名稱、類型與時間的會議略過不建立，重複送出不會產生重複會議
+    :param template_id: 模板編號
+    :request.json start: 開始日期（YYYY-MM-DD）
+    :request.json end: 結束日期（YYYY-MM-DD，含）
+    :request.json weekday: 星期幾（0 為星期一，預設與開始日期相同）
+    :request.json interval: 間隔週數（預設為 1，隔週為 2）
+    :request.json exclude: 略過的日期列表（YYYY-MM-DD）
+    :request.json dryRun: 為 true 時只預覽將建立的會議，不寫入
+    :return: JSON 物件
+    """
+    started = perf_counter()
+    template = MeetingTemplate.query.options(
+        selectinload(MeetingTemplate.attendees).load_only(Person.id),
+        selectinload(MeetingTemplate.guests).load_only(Person.id)
+    ).filter_by(id=template_id).first_or_404()
+
+    data = request.get_json()
+    try:
+        start = date.fromisoformat(data['start'])
+        end = date.fromisoformat(data['end'])
+        weekday = None if data.get('weekday') is None else int(data['weekday'])
+        interval = int(data.get('interval', 1))
+        exclude = {date.fromisoformat(day) for day in data.get('exclude', [])}
+        if interval < 1 or weekday is not None and not 0 <= weekday <= 6:
+            raise ValueError
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'message': 'Invalid recurrence'}), 400
+    dates = recurrence_dates(start, end, weekday, interval, exclude)
+    if len(dates) > RECURRENCE_LIMIT:
+        return jsonify({'message': 'Too many meetings', 'limit': RECURRENCE_LIMIT}), 400
+
+    times = [datetime.combine(day, template.time.time()) for day in dates]
+    existing = {time for time, in db.session.query(Meeting.time).filter(
+        Meeting.title == template.title, Meeting.type == template.type, Meeting.time.in_(times))} if times else set()
+    times = [time for time in times if time not in existing]
+    attendee_count = sum(map(len, template_attendees(template)))
+
+    if data.get('dryRun'):
+        meetings = [{'time': time.isoformat()} for time in times]
+    else:
+        created = create_meetings(template, times)
+        meetings = [{'id': meeting.id, 'time': meeting.time.isoformat()} for meeting in created]
+        db.session.commit()
+
+    return jsonify({'message': 'Preview' if data.get('dryRun') else 'Success',
+                    'title': template.title,
+                    'meetings': meetings,
+                    'attendees': attendee_count,
+                    'skipped': sorted(time.isoformat() for time in existing),
+                    'elapsed_ms': round((perf_counter() - started) * 1000, 1)})
 
 
 @app.route('/template/add', methods=['GET', 'POST'])
@@ -977,12 +1255,12 @@ def add_template():
     template.type = data['type']
     template.chair_id = int(data['chair'])
     template.minute_taker_id = int(data['minuteTaker'])
-    for att_id in data['attendee']:
-        person = Person.query.get(int(att_id))
-        template.attendees.append(person)
-    for gue_id in data['guest']:
-        person = Person.query.get(int(gue_id))
-        template.guests.append(person)
+
+    people, missing = resolve_people(data['attendee'], data['guest'], [data['chair'], data['minuteTaker']])
+    if missing:
+        return jsonify({'message': 'Person not found', 'missing': missing})
+    template.attendees = [people[person_id] for person_id in dict.fromkeys(map(int, data['attendee']))]
+    template.guests = [people[person_id] for person_id in dict.fromkeys(map(int, data['guest']))]
     db.session.add(template)
     db.session.commit()
     return 'Success', 200
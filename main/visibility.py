@@ -0,0 +1,139 @@
+from itertools import chain
+
+import click
+from sqlalchemy import event, inspect, literal, select, union_all
+
+from main import app, db
+from main.models import Meeting, Attendee, MeetingVisibility, VisibilityRole
+
+MEETING_ROLE_ATTRIBUTES = ['chair_id', 'minute_taker_id', 'chair', 'minute_taker', 'attendee_association']
+
+
+def visible_meeting_ids(person_id):
+    """
+    人員可檢視的會議編號子查詢
+    :param person_id: 人員編號
+    :return: 會議編號查詢
+    """
+    return db.session.query(MeetingVisibility.meeting_id).filter_by(person_id=person_id)
+
+
+def visible_meetings(user, query=None):
+    """
+    限定為使用者可檢視的會議：管理員可檢視全部會議，其他人員只能檢視擔任主席、紀錄或與會的會議
+    :param user: 使用者
+    :param query: 要加上限制的查詢（需包含 Meeting），預設為 Meeting.query
+    :return: 會議查詢
+    """
+    query = Meeting.query if query is None else query
+    if user.is_admin():
+        return query
+    return query.filter(Meeting.id.in_(visible_meeting_ids(user.id)))
+
+
+def live_visibility(meeting_ids=None):
+    """
+    從會議與與會人員資料表產生可檢視會議索引的內容
+    :param meeting_ids: 會議編號列表，None 表示全部會議
+    :return: SELECT (person_id, meeting_id, role) 查詢
+    """
+    role_type = MeetingVisibility.role.type
+    chair = select(Meeting.chair_id, Meeting.id, literal(VisibilityRole.Chair, role_type)) \
+        .where(Meeting.chair_id.isnot(None))
+    minute_taker = select(Meeting.minute_taker_id, Meeting.id, literal(VisibilityRole.MinuteTaker, role_type)) \
+        .where(Meeting.minute_taker_id.isnot(None))
+    attendee = select(Attendee.person_id, Attendee.meeting_id, literal(VisibilityRole.Attendee, role_type))
+
+    if meeting_ids is not None:
+        chair = chair.where(Meeting.id.in_(meeting_ids))
+        minute_taker = minute_taker.where(Meeting.id.in_(meeting_ids))
+        attendee = attendee.where(Attendee.meeting_id.in_(meeting_ids))
+    return union_all(chair, minute_taker, attendee)
+
+
+def refresh_meetings(connection, meeting_ids):
+    """
+    重新產生指定會議的可檢視會議索引
+    :param connection: 資料庫連線
+    :param meeting_ids: 會議編號集合
+    """
+    table = MeetingVisibility.__table__
+    meeting_ids = sorted(meeting_ids)
+    connection.execute(table.delete().where(table.c.meeting_id.in_(meeting_ids)))
+    connection.execute(table.insert().from_select(['person_id', 'meeting_id', 'role'], live_visibility(meeting_ids)))
+
+
+def _touched_meeting_ids(session):
+    """
+    找出此次 flush 中主席、紀錄或與會人員有異動的會議
+    :param session: SQLAlchemy Session
+    :return: 會議編號集合
+    """
+    meeting_ids = set()
+
+    for obj in chain(session.new, session.dirty, session.deleted):
+        state = inspect(obj)
+        if isinstance(obj, Meeting):
+            if obj in session.dirty and not any(state.attrs[key].history.has_changes()
+                                                for key in MEETING_ROLE_ATTRIBUTES):
+                continue
+            meeting_ids.add(state.identity[0] if obj in session.deleted else obj.id)
+        elif isinstance(obj, Attendee):
+            meeting_ids.add(state.identity[0] if obj in session.deleted else obj.meeting_id)
+            meeting_ids.update(meeting.id for meeting in state.attrs.meeting.history.deleted or () if meeting)
+
+    meeting_ids.discard(None)
+    return meeting_ids
+
+
+@event.listens_for(db.session, 'after_flush')
+def update_visibility(session, flush_context):
+    """
+    主席、紀錄或與會人員寫入時，在同一交易內更新受影響會議的可檢視會議索引
+    """
+    meeting_ids = _touched_meeting_ids(session)
+    if meeting_ids:
+        refresh_meetings(session.connection(), meeting_ids)
+
+
+def rebuild_visibility():
+    """
+    從會議與與會人員資料表重建全部可檢視會議索引
+    """
+    table = MeetingVisibility.__table__
+    connection = db.session.connection()
+    connection.execute(table.delete())
+    connection.execute(table.insert().from_select(['person_id', 'meeting_id', 'role'], live_visibility()))
+    db.session.commit()
+
+
+def verify_visibility():
+    """
+    比對可檢視會議索引與會議、與會人員資料表
+    :return: (索引中多出的項目, 索引中缺少的項目)，皆為 (person_id, meeting_id, role) 集合
+    """
+    connection = db.session.connection()
+    indexed = {tuple(row) for row in connection.execute(
+        select(MeetingVisibility.person_id, MeetingVisibility.meeting_id, MeetingVisibility.role))}
+    live = {tuple(row) for row in connection.execute(live_visibility())}
+    return indexed - live, live - indexed
+
+
+@app.cli.command('rebuild-visibility')
+@click.option('--check', is_flag=True, help='只比對可檢視會議索引，不重建')
+def rebuild_visibility_command(check):
+    """
+    重建可檢視會議索引並比對是否與資料表一致
+    """
+    if not check:
+        rebuild_visibility()
+        click.echo('可檢視會議索引已重建')
+
+    extra, missing = verify_visibility()
+    for person_id, meeting_id, role in sorted(extra, key=str):
+        click.echo(f'多出：人員 {person_id} 會議 {meeting_id} {role.value}')
+    for person_id, meeting_id, role in sorted(missing, key=str):
+        click.echo(f'缺少：人員 {person_id} 會議 {meeting_id} {role.value}')
+    if extra or missing:
+        raise click.ClickException(f'可檢視會議索引有 {len(extra) + len(missing)} 筆不一致')
+    click.echo('可檢視會議索引與資料表一致')
@@ -0,0 +1,107 @@
+import os
+from datetime import datetime
+from itertools import count
+
+import pytest
+from sqlalchemy import event
+
+from main import app as flask_app, db
+from main import directory, mailer, meeting_templates, previews, rendering, search, users
+from main.models import Announcement, Attachment, Extempore, GenderType, Meeting, MeetingType, Motion, \
+    MotionStatusType, Person, PersonType
+
+# 預設每個測試使用暫存目錄中的 SQLite 檔案；設定 TEST_DATABASE_URL（例如 mysql+pymysql://root@localhost/meeting_test）
+# 即可對正式環境使用的資料庫執行同一組測試（測試會清空該資料庫）
+DATABASE_URL = os.environ.get('TEST_DATABASE_URL')
+
+_ids = count(1)
+
+if not DATABASE_URL or DATABASE_URL.startswith('sqlite'):
+    # SQLite 不支援複合主鍵的自動編號（MySQL 支援），測試時改由程式指定編號
+    def _assign_id(mapper, connection, target):
+        if target.id is None:
+            target.id = next(_ids)
+
+    for model in (Announcement, Attachment, Extempore, Motion):
+        model.__table__.c.id.autoincrement = False
+        event.listen(model, 'before_insert', _assign_id)
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    flask_app.config.update(TESTING=True, SQLALCHEMY_DATABASE_URI=DATABASE_URL or f'sqlite:///{tmp_path / "test.db"}',
+                            SNAPSHOT_FOLDER=str(tmp_path / 'snapshots'), BLOB_FOLDER=str(tmp_path / 'blobs'),
+                            PREVIEW_FOLDER=str(tmp_path / 'previews'),
+                            UPLOAD_PART_FOLDER=str(tmp_path / 'upload-parts'))
+    for folder in ('SNAPSHOT_FOLDER', 'BLOB_FOLDER', 'PREVIEW_FOLDER', 'UPLOAD_PART_FOLDER'):
+        os.makedirs(flask_app.config[folder])
+    # 各行程的快取與本機佇列，每個測試使用新的實例
+    monkeypatch.setattr(search, 'index', search.SearchIndex(str(tmp_path / 'search-index.sqlite3')))
+    monkeypatch.setattr(mailer, 'queue', mailer.MailQueue(str(tmp_path / 'mail-queue.sqlite3')))
+    monkeypatch.setattr(previews, 'queue', previews.PreviewQueue(str(tmp_path / 'preview-queue.sqlite3')))
+    monkeypatch.setattr(rendering, 'cache', rendering.RenderCache(flask_app.config['RENDER_CACHE_SIZE'],
+                                                                  flask_app.config['SNAPSHOT_FOLDER']))
+    monkeypatch.setattr(users, 'cache', users.UserCache(flask_app.config['USER_CACHE_SIZE'],
+                                                        flask_app.config['USER_CACHE_TTL']))
+    monkeypatch.setattr(directory, 'people', directory.PersonDirectory(flask_app.config['PEOPLE_DIRECTORY_TTL']))
+    monkeypatch.setattr(meeting_templates, 'directory',
+                        meeting_templates.TemplateDirectory(flask_app.config['TEMPLATE_CACHE_TTL']))
+    # 背景程序會在測試進行中查詢資料庫（影響 SQL 語句計數），需要的測試自行呼叫 run_* / send_batch 等函式
+    for module, name in ((search, 'start_indexer'), (mailer, 'start_mailers'), (previews, 'start_previewer')):
+        monkeypatch.setattr(module, name, lambda: None)
+
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+        yield flask_app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def statements(app):
+    """
+    記錄執行的 SQL 語句，測試中以 statements.clear() 重新開始計算
+    """
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    engine = db.get_engine()
+    event.listen(engine, 'after_cursor_execute', record)
+    yield executed
+    event.remove(engine, 'after_cursor_execute', record)
+
+
+def make_person(name, type=PersonType.DeptProf):
+    number = next(_ids)
+    person = Person(name=name, gender=GenderType.Male, phone='0912345678', email=f'person{number}@example.com',
+                    type=type)
+    db.session.add(person)
+    return person
+
+
+def make_meeting(chair, minute_taker, attendees=(), guests=(), motions=1, time=None):
+    """
+    建立會議（含一則報告事項、一則臨時動議與 motions 個討論事項）
+    """
+    meeting = Meeting(title='系務會議', type=MeetingType.DeptAffairs, time=time or datetime(2024, 3, 1, 10),
+                      location='會議室', chair=chair, minute_taker=minute_taker, chair_speech='主席致詞')
+    for person in attendees:
+        meeting.attendees.append(person)
+    for person in guests:
+        meeting.attendees.append(person)
+        meeting.attendee_association[-1].is_member = False
+    meeting.announcements.append(Announcement('報告事項'))
+    meeting.extempores.append(Extempore('臨時動議'))
+    meeting.motions.extend(Motion('案由', '內容', MotionStatusType.InDiscussion, '', '') for _ in range(motions))
+    db.session.add(meeting)
+    return meeting
+
+
+def login(app, person):
+    client = app.test_client()
+    response = client.post('/login', data={'email': person.email, 'password': 'password'})
+    assert response.status_code == 302
+    return client
@@ -0,0 +1,90 @@
+import hashlib
+import os
+
+import pytest
+
+from conftest import make_meeting, make_person
+from main import attachments, db
+from main.models import Attachment, Blob
+
+CONTENT = b'%PDF-1.4 meeting attachment'
+SHA256 = hashlib.sha256(CONTENT).hexdigest()
+
+
+@pytest.fixture
+def meeting(app):
+    person = make_person('主席')
+    meeting = make_meeting(person, person)
+    db.session.commit()
+    return meeting
+
+
+def incoming_file(tmp_path, name):
+    file_path = tmp_path / name
+    file_path.write_bytes(CONTENT)
+    return str(file_path)
+
+
+def attach(meeting, file_path, name='議程.pdf'):
+    attachments.store_file(file_path, SHA256)
+    return attachments.new_attachment(meeting, name, SHA256)
+
+
+def test_same_content_is_stored_once(meeting, tmp_path):
+    first = incoming_file(tmp_path, 'first')
+    second = incoming_file(tmp_path, 'second')
+    attach(meeting, first)
+    attach(meeting, second, '議程副本.pdf')
+    db.session.commit()
+
+    blob = Blob.query.get(SHA256)
+    assert (blob.ref_count, blob.size) == (2, len(CONTENT))
+    assert open(attachments.blob_path(SHA256), 'rb').read() == CONTENT
+    assert not os.path.exists(first) and not os.path.exists(second)
+
+
+def test_duplicate_is_kept_until_commit(meeting, tmp_path):
+    attach(meeting, incoming_file(tmp_path, 'first'))
+    db.session.commit()
+
+    second = incoming_file(tmp_path, 'second')
+    attach(meeting, second, '議程副本.pdf')
+    db.session.flush()
+    assert os.path.exists(second)
+    db.session.rollback()
+
+    assert os.path.exists(second)
+    assert os.path.exists(attachments.blob_path(SHA256))
+    assert Blob.query.get(SHA256).ref_count == 1
+
+
+def test_rollback_restores_new_content(meeting, tmp_path):
+    first = incoming_file(tmp_path, 'first')
+    attach(meeting, first)
+    db.session.flush()
+    assert os.path.exists(attachments.blob_path(SHA256))
+    db.session.rollback()
+
+    assert os.path.exists(first)
+    assert not os.path.exists(attachments.blob_path(SHA256))
+
+
+def test_last_reference_removes_file(meeting, tmp_path):
+    attach(meeting, incoming_file(tmp_path, 'first'))
+    db.session.commit()
+
+    db.session.delete(Attachment.query.one())
+    db.session.commit()
+
+    assert Blob.query.get(SHA256) is None
+    assert not os.path.exists(attachments.blob_path(SHA256))
+
+
+def test_release_keeps_content_referenced_again(meeting, tmp_path):
+    attach(meeting, incoming_file(tmp_path, 'first'))
+    db.session.commit()
+
+    # 另一個交易在刪除檔案之前又參照了相同內容
+    attachments._release_blob(db.get_engine(), SHA256)
+
+    assert os.path.exists(attachments.blob_path(SHA256))
@@ -0,0 +1,55 @@
+import pytest
+
+from conftest import login, make_meeting, make_person
+from main import db
+from main.models import PersonType
+
+
+@pytest.fixture
+def meeting(app):
+    admin = make_person('系助理', PersonType.Assistant)
+    attendee = make_person('李委員')
+    meeting = make_meeting(admin, admin, attendees=[attendee])
+    db.session.commit()
+    return login(app, admin), meeting, attendee.id
+
+
+def test_second_patch_with_the_same_version_conflicts(meeting):
+    client, meeting, _ = meeting
+    motion = meeting.motions[0]
+    url = f'/api/meeting/{meeting.id}/motion/{motion.id}'
+    version = motion.version
+
+    first = client.patch(url, json={'version': version, 'resolution': '照案通過'})
+    second = client.patch(url, json={'version': version, 'resolution': '修正後通過'})
+
+    assert first.status_code == 200 and first.json['version'] == version + 1
+    assert second.status_code == 409 and second.json['version'] == version + 1
+    db.session.expire_all()
+    assert motion.resolution == '照案通過'
+
+
+@pytest.mark.parametrize('path, body', [
+    ('motion', {'version': 1, 'status': 'Unknown'}),
+    ('announcement', {'version': 1}),
+    ('extempore', {'version': 1, 'content': None}),
+    ('attendee', {'version': 1}),
+])
+def test_invalid_patch_is_rejected(meeting, path, body):
+    client, meeting, attendee_id = meeting
+    item_id = {'motion': meeting.motions[0].id, 'announcement': meeting.announcements[0].id,
+               'extempore': meeting.extempores[0].id, 'attendee': attendee_id}[path]
+
+    response = client.patch(f'/api/meeting/{meeting.id}/{path}/{item_id}', json=body)
+
+    assert response.status_code == 400
+
+
+def test_non_json_body_is_rejected(meeting):
+    client, meeting, _ = meeting
+    motion_url = f'/api/meeting/{meeting.id}/motion/{meeting.motions[0].id}'
+
+    assert client.patch(motion_url, data='status=Closed').status_code == 400
+    assert client.patch(motion_url, json=['Closed']).status_code == 400
+    assert client.post(f'/api/meeting/{meeting.id}/announcement', data='報告事項').status_code == 400
+    assert client.post(f'/api/meeting/{meeting.id}/announcement', json={}).status_code == 400
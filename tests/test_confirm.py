@@ -0,0 +1,53 @@
+from threading import Barrier, Thread
+
+import pytest
+
+from conftest import login, make_meeting, make_person
+from main import db
+from main.models import Meeting
+
+ROUNDS = 5
+
+
+@pytest.fixture
+def meetings(app):
+    """
+    主席已確認、只差兩位與會人員確認的會議
+    """
+    chair = make_person('主席')
+    first = make_person('委員甲')
+    second = make_person('委員乙')
+    meetings = []
+    for _ in range(ROUNDS):
+        meeting = make_meeting(chair, chair, attendees=[first, second])
+        meeting.chair_confirmed = True
+        meetings.append(meeting)
+    db.session.commit()
+    return first, second, [meeting.id for meeting in meetings]
+
+
+def test_concurrent_last_confirmations_archive_once(app, meetings):
+    first, second, meeting_ids = meetings
+    clients = {first.id: login(app, first), second.id: login(app, second)}
+    db.session.remove()
+
+    for meeting_id in meeting_ids:
+        barrier = Barrier(len(clients))
+        results = []
+
+        def confirm(person_id, client):
+            barrier.wait()
+            response = client.get('/confirm', query_string={'person_id': person_id, 'meeting_id': meeting_id,
+                                                           'confirm': 'true'})
+            results.append((response.status_code, response.get_data(as_text=True)))
+
+        threads = [Thread(target=confirm, args=item) for item in clients.items()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # 兩個請求都成功，而且恰好其中一個封存會議
+        assert sorted(results) == [(200, 'Archived'), (200, 'Success')]
+        assert db.session.query(Meeting.archived).filter_by(id=meeting_id).scalar() is True
+        db.session.remove()
@@ -0,0 +1,42 @@
+import pytest
+
+from conftest import login, make_person
+from main import db
+from main.models import Person, PersonType
+
+
+@pytest.fixture
+def client(app):
+    admin = make_person('系助理', PersonType.Assistant)
+    for name in ('王小明', '王大同', '王美麗', '李王華', 'Alice Wang', 'alex chen'):
+        make_person(name)
+    db.session.commit()
+    return login(app, admin)
+
+
+def suggest(client, query, **args):
+    response = client.get('/api/people/suggest', query_string={'q': query, **args})
+    assert response.status_code == 200
+    return [person['name'] for person in response.json['people']]
+
+
+def test_prefix_matches_come_first(client):
+    # 姓名開頭相符的依姓名排序，其後才是姓名中間含有查詢字串的人員
+    assert suggest(client, '王') == ['王大同', '王小明', '王美麗', '李王華']
+    assert suggest(client, 'AL') == ['alex chen', 'Alice Wang']
+    assert suggest(client, '小明') == ['王小明']
+    assert suggest(client, '   ') == []
+
+
+def test_limit(client):
+    assert suggest(client, '王', limit=2) == ['王大同', '王小明']
+
+
+def test_rename_is_visible_without_waiting_for_the_ttl(client):
+    assert suggest(client, '王小明') == ['王小明']
+
+    Person.query.filter_by(name='王小明').one().name = '陳小明'
+    db.session.commit()
+
+    assert suggest(client, '王小明') == []
+    assert suggest(client, '陳') == ['陳小明']
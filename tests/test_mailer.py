@@ -0,0 +1,153 @@
+import socket
+
+import pytest
+from flask_mail import Message
+
+from main import mail, mailer
+
+controller = pytest.importorskip('aiosmtpd.controller')
+
+
+class Recorder:
+    """
+    記錄收到的郵件的本機 SMTP 伺服器，收件人以 reject 開頭時拒收
+    """
+
+    def __init__(self, port):
+        self.port = port
+        self.messages = []
+        self.server = None
+
+    def start(self):
+        self.server = controller.Controller(self, hostname='127.0.0.1', port=self.port)
+        self.server.start()
+
+    def stop(self):
+        if self.server:
+            self.server.stop()
+            self.server = None
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith('reject'):
+            return '550 Mailbox unavailable'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return '250 Message accepted for delivery'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def smtp(app, monkeypatch):
+    """
+    啟動本機 SMTP 伺服器，寄信設定改為寄到此伺服器
+    """
+    port = free_port()
+    monkeypatch.setitem(app.extensions, 'mail', mail.init_mail({'MAIL_SERVER': '127.0.0.1', 'MAIL_PORT': port}))
+    monkeypatch.setitem(app.config, 'MAIL_RETRY_DELAY', 0)
+    server = Recorder(port)
+    server.start()
+    yield server
+    server.stop()
+
+
+def message(recipient, subject='會議通知'):
+    return Message(subject, sender='noreply@example.com', recipients=[recipient], body='會議內容')
+
+
+def deliver(app):
+    batch = mailer.queue.claim(app.config['MAIL_BATCH_SIZE'])
+    if batch:
+        mailer.send_batch(app, batch)
+    return len(batch)
+
+
+def test_batch_is_delivered(app, smtp):
+    for number in range(3):
+        mailer.queue.enqueue(message(f'person{number}@example.com'))
+
+    assert deliver(app) == 3
+
+    assert sorted(envelope.rcpt_tos[0] for envelope in smtp.messages) == \
+        ['person0@example.com', 'person1@example.com', 'person2@example.com']
+    status = mailer.queue.status()
+    assert (status.pending, status.failed) == (0, 0)
+    assert deliver(app) == 0
+
+
+def test_copies_reply_to_and_attachments_are_kept(app, smtp):
+    msg = Message('會議通知', sender=('系辦公室', 'noreply@example.com'), recipients=['person@example.com'],
+                  cc=['cc@example.com'], bcc=['bcc@example.com'], reply_to='office@example.com', body='會議內容')
+    msg.attach('議程.pdf', 'application/pdf', b'%PDF-1.4 agenda')
+    mailer.queue.enqueue(msg)
+
+    (_, _, _, queued), = mailer.queue.claim(1)
+    assert (queued.cc, queued.bcc, queued.reply_to) == (['cc@example.com'], ['bcc@example.com'], 'office@example.com')
+    assert [(attachment.filename, attachment.data) for attachment in queued.attachments] == \
+        [('議程.pdf', b'%PDF-1.4 agenda')]
+
+    mailer.send_batch(app, [(1, 0, 0, queued)])
+
+    envelope, = smtp.messages
+    assert sorted(envelope.rcpt_tos) == ['bcc@example.com', 'cc@example.com', 'person@example.com']
+    content = envelope.content.decode()
+    assert 'Reply-To: office@example.com' in content and 'application/pdf' in content
+    assert 'bcc@example.com' not in content
+
+
+def test_rejected_message_is_retried_then_failed(app, smtp, monkeypatch):
+    monkeypatch.setitem(app.config, 'MAIL_MAX_ATTEMPTS', 2)
+    mailer.queue.enqueue(message('person@example.com'))
+    mailer.queue.enqueue(message('reject@example.com'))
+
+    assert deliver(app) == 2
+    assert [envelope.rcpt_tos for envelope in smtp.messages] == [['person@example.com']]
+    assert mailer.queue.status().pending == 1
+
+    assert deliver(app) == 1
+    status = mailer.queue.status()
+    assert (status.pending, status.failed) == (0, 1)
+    assert deliver(app) == 0
+
+
+def test_unreachable_server_keeps_messages(app, smtp):
+    mailer.queue.enqueue(message('person@example.com'))
+    smtp.stop()
+
+    assert deliver(app) == 1
+    assert mailer.queue.status().pending == 1
+
+    smtp.start()
+    assert deliver(app) == 1
+    assert [envelope.rcpt_tos for envelope in smtp.messages] == [['person@example.com']]
+    assert mailer.queue.status().pending == 0
+
+
+def test_pending_mail_is_resumed_on_first_request(app, monkeypatch):
+    started = []
+    monkeypatch.setattr(mailer, 'start_mailers', lambda: started.append(True))
+    monkeypatch.setattr(mailer.mailers, 'resumed', False)
+    mailer.queue.enqueue(message('person@example.com'))
+
+    client = app.test_client()
+    client.get('/login')
+    client.get('/login')
+
+    assert started == [True]
+
+
+def test_empty_queue_does_not_start_mailers(app, monkeypatch):
+    started = []
+    monkeypatch.setattr(mailer, 'start_mailers', lambda: started.append(True))
+    monkeypatch.setattr(mailer.mailers, 'resumed', False)
+
+    app.test_client().get('/login')
+
+    assert started == []
@@ -0,0 +1,99 @@
+import json
+
+import pytest
+
+from conftest import login, make_meeting, make_person
+from main import db
+from main.models import Announcement, Meeting, PersonType
+
+WRITES = ('INSERT', 'UPDATE', 'DELETE')
+
+
+@pytest.fixture
+def meeting(app):
+    """
+    含與會、列席人員與多個討論事項的會議
+    """
+    admin = make_person('系助理', PersonType.Assistant)
+    people = [make_person(f'人員{number}') for number in range(8)]
+    meeting = make_meeting(people[0], people[1], attendees=people[2:6], guests=people[6:8], motions=3)
+    db.session.commit()
+    meeting.attendee_association[0].is_present = True
+    db.session.commit()
+    return admin, meeting.id
+
+
+def meeting_form(meeting):
+    """
+    依會議目前的內容組成與編輯頁面相同格式的表單
+    """
+    associations = meeting.attendee_association
+    return {'title': meeting.title,
+            'time': meeting.time.isoformat(),
+            'location': meeting.location,
+            'type': meeting.type.name,
+            'chair': meeting.chair_id,
+            'minuteTaker': meeting.minute_taker_id,
+            'attendee': [att.person_id for att in associations if att.is_member],
+            'guest': [att.person_id for att in associations if not att.is_member],
+            'present': [att.person_id for att in associations if att.is_present],
+            'chairSpeech': meeting.chair_speech,
+            'announcement': [{'id': str(ann.id), 'content': ann.content} for ann in sorted(meeting.announcements, key=lambda ann: ann.id)],
+            'motion': [{'MotionId': str(mot.id),
+                        'MotionDescription': mot.description,
+                        'MotionContent': mot.content,
+                        'MotionStatus': mot.status.name,
+                        'MotionResolution': mot.resolution,
+                        'MotionExecution': mot.execution} for mot in meeting.motions],
+            'extempore': [{'id': str(ext.id), 'content': ext.content} for ext in sorted(meeting.extempores, key=lambda ext: ext.id)],
+            'uploads': []}
+
+
+def save(client, meeting_id, form):
+    response = client.post(f'/edit/meeting/{meeting_id}', data={'json_form': json.dumps(form)})
+    assert response.status_code == 200
+    assert response.json['message'] == 'Success'
+    return response.json['writes']
+
+
+def test_unchanged_edit_writes_nothing(app, statements, meeting):
+    admin, meeting_id = meeting
+    client = login(app, admin)
+    form = meeting_form(Meeting.query.get(meeting_id))
+    db.session.remove()
+
+    statements.clear()
+    writes = save(client, meeting_id, form)
+
+    assert writes == {'inserted': 0, 'updated': 0, 'deleted': 0}
+    assert [statement for statement in statements if statement.lstrip().upper().startswith(WRITES)] == []
+
+
+def test_changed_edit_writes_only_changes(app, statements, meeting):
+    admin, meeting_id = meeting
+    client = login(app, admin)
+    form = meeting_form(Meeting.query.get(meeting_id))
+    db.session.remove()
+    form['motion'][1]['MotionResolution'] = '照案通過'
+    form['extempore'].append({'id': '', 'content': '新增的臨時動議'})
+
+    writes = save(client, meeting_id, form)
+
+    assert writes == {'inserted': 1, 'updated': 1, 'deleted': 0}
+
+
+def test_removing_a_middle_item_deletes_only_that_item(app, meeting):
+    admin, meeting_id = meeting
+    Meeting.query.get(meeting_id).announcements.extend([Announcement('第二則'), Announcement('第三則')])
+    db.session.commit()
+    client = login(app, admin)
+    form = meeting_form(Meeting.query.get(meeting_id))
+    db.session.remove()
+    removed = form['announcement'].pop(1)
+
+    writes = save(client, meeting_id, form)
+
+    assert writes == {'inserted': 0, 'updated': 0, 'deleted': 1}
+    remaining = sorted(Meeting.query.get(meeting_id).announcements, key=lambda ann: ann.id)
+    assert [ann.content for ann in remaining] == ['報告事項', '第三則']
+    assert int(removed['id']) not in [ann.id for ann in remaining]
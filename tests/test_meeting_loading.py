@@ -0,0 +1,78 @@
+from datetime import datetime
+
+import pytest
+
+from conftest import login, make_meeting, make_person
+from main import db
+from main.models import Meeting, PersonType
+from main.views import decode_meeting_cursor, encode_meeting_cursor
+
+
+@pytest.fixture
+def meetings(app):
+    """
+    與會人數不同的兩場會議（3 人與 30 人，各含列席人員）
+    """
+    admin = make_person('系助理', PersonType.Assistant)
+    people = [make_person(f'人員{number}') for number in range(40)]
+    small = make_meeting(people[0], people[1], attendees=people[2:4], guests=people[4:5], motions=1)
+    large = make_meeting(people[0], people[1], attendees=people[2:27], guests=people[27:32], motions=8)
+    db.session.commit()
+    return admin, small.id, large.id
+
+
+def count_statements(client, statements, url):
+    statements.clear()
+    response = client.get(url)
+    assert response.status_code == 200
+    return len(statements)
+
+
+@pytest.mark.parametrize('url', ['/get/meeting?id={}', '/meeting/{}', '/print/minute/{}', '/mail/notice/{}',
+                                 '/mail/minute/{}'])
+def test_full_meeting_statement_count_is_constant(app, statements, meetings, url):
+    admin, small_id, large_id = meetings
+    client = login(app, admin)
+    client.get('/api/meetings')  # 先載入登入使用者的快取
+
+    small = count_statements(client, statements, url.format(small_id))
+    large = count_statements(client, statements, url.format(large_id))
+
+    assert small == large
+    assert large <= 12
+
+
+def test_meeting_cursor_round_trip(app):
+    meeting = Meeting(id=42, time=datetime(2024, 3, 1, 10, 30, 15, 123456))
+
+    assert decode_meeting_cursor(encode_meeting_cursor(meeting)) == (meeting.time, 42)
+
+
+def test_pages_cover_meetings_with_equal_times_once(app):
+    admin = make_person('系助理', PersonType.Assistant)
+    times = [datetime(2024, 3, day, 10) for day in (1, 1, 1, 2, 2, 3, 4, 4, 4, 4)]
+    meetings = [make_meeting(admin, admin, time=time) for time in times]
+    db.session.commit()
+    expected = [meeting.id for meeting in sorted(meetings, key=lambda meeting: (meeting.time, meeting.id),
+                                                 reverse=True)]
+    client = login(app, admin)
+
+    found = []
+    cursor = None
+    while True:
+        response = client.get('/api/meetings', query_string={'limit': 3, **({'after': cursor} if cursor else {})})
+        assert response.status_code == 200
+        found.extend(meeting['id'] for meeting in response.json['meetings'])
+        cursor = response.json['next']
+        if cursor is None:
+            break
+
+    assert found == expected
+
+
+@pytest.mark.parametrize('cursor', ['abc', '20240301-1', '20240301100000000000-x', '1-2-3'])
+def test_bad_cursor_is_rejected(app, cursor):
+    admin = make_person('系助理', PersonType.Assistant)
+    db.session.commit()
+
+    assert login(app, admin).get('/api/meetings', query_string={'after': cursor}).status_code == 400
@@ -0,0 +1,48 @@
+import hashlib
+from contextlib import closing
+
+from conftest import make_meeting, make_person
+from main import attachments, db, previews, search
+
+
+def test_pending_previews_are_resumed_on_first_request(app, monkeypatch):
+    started = []
+    monkeypatch.setattr(previews, 'start_previewer', lambda: started.append(True))
+    monkeypatch.setattr(previews.previewer, 'resumed', False)
+    previews.queue.enqueue({'0' * 64: 'pdf'})
+
+    client = app.test_client()
+    client.get('/login')
+    client.get('/login')
+
+    assert started == [True]
+
+
+def test_empty_queue_does_not_start_previewer(app, monkeypatch):
+    started = []
+    monkeypatch.setattr(previews, 'start_previewer', lambda: started.append(True))
+    monkeypatch.setattr(previews.previewer, 'resumed', False)
+
+    app.test_client().get('/login')
+
+    assert started == []
+
+
+def test_extracted_text_is_reindexed(app, tmp_path):
+    person = make_person('主席')
+    meeting = make_meeting(person, person)
+    db.session.commit()
+    content = '會議紀錄附件'.encode()
+    sha256 = hashlib.sha256(content).hexdigest()
+    source = tmp_path / 'incoming'
+    source.write_bytes(content)
+    attachments.store_file(str(source), sha256)
+    attachment = attachments.new_attachment(meeting, '紀錄.txt', sha256)
+    db.session.commit()
+
+    assert previews.drain_queue(app) == 1
+
+    assert previews.extracted_text(sha256) == '會議紀錄附件'
+    with closing(search.index.connect()) as connection:
+        queued = [key for key, in connection.execute('SELECT doc_key FROM queue')]
+    assert f'attachment:{attachment.id}' in queued
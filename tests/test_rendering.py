@@ -0,0 +1,79 @@
+import pytest
+from sqlalchemy import update
+
+from conftest import login, make_meeting, make_person
+from main import db, rendering
+from main.models import Meeting, Person, PersonType
+
+
+@pytest.fixture
+def meeting(app):
+    """
+    已封存的會議（主席、紀錄與兩位與會人員）
+    """
+    admin = make_person('系助理', PersonType.Assistant)
+    chair = make_person('王主席')
+    attendee = make_person('李委員')
+    meeting = make_meeting(chair, make_person('陳紀錄'), attendees=[attendee, make_person('林委員')])
+    meeting.archived = True
+    db.session.commit()
+    return admin, chair.id, attendee.id, meeting.id
+
+
+def rename(person_id, name):
+    Person.query.get(person_id).name = name
+    db.session.commit()
+
+
+@pytest.mark.parametrize('role', ['chair', 'attendee'])
+def test_renaming_a_person_bumps_the_meeting(app, meeting, role):
+    _, chair_id, attendee_id, meeting_id = meeting
+    person_id = chair_id if role == 'chair' else attendee_id
+    version = Meeting.query.get(meeting_id).version
+    assert '王主席' in rendering.cached_minute(meeting_id)
+
+    rename(person_id, '新名字')
+
+    assert Meeting.query.get(meeting_id).version == version + 1
+    assert '新名字' in rendering.cached_minute(meeting_id)
+
+
+def test_unrelated_person_change_keeps_the_version(app, meeting):
+    _, chair_id, _, meeting_id = meeting
+    version = Meeting.query.get(meeting_id).version
+
+    Person.query.get(chair_id).phone = '0987654321'
+    db.session.commit()
+
+    assert Meeting.query.get(meeting_id).version == version
+
+
+def test_snapshot_of_an_older_version_is_not_read(app, meeting, monkeypatch):
+    _, _, _, meeting_id = meeting
+    version = Meeting.query.get(meeting_id).version
+    rendering.cached_minute(meeting_id)
+    # 以 Core UPDATE 遞增版本（例如確認會議或產生預覽）；快照刪除後，仍以舊版本渲染的請求才寫入快照
+    db.session.execute(update(Meeting).where(Meeting.id == meeting_id).values(version=Meeting.version + 1))
+    db.session.commit()
+    rendering.cache.remove_snapshots(meeting_id)
+    rendering.cache.write_snapshot(meeting_id, version, False, 'stale')
+    assert rendering.cache.read_snapshot(meeting_id, version, False) == 'stale'
+    # 其他行程的記憶體快取中沒有此會議
+    monkeypatch.setattr(rendering, 'cache', rendering.RenderCache(app.config['RENDER_CACHE_SIZE'],
+                                                                  app.config['SNAPSHOT_FOLDER']))
+
+    html = rendering.cached_minute(meeting_id)
+
+    assert html != 'stale'
+    assert rendering.cache.read_snapshot(meeting_id, version + 1, False) == html
+
+
+def test_meeting_etag_changes_when_a_person_is_renamed(app, meeting):
+    admin, _, attendee_id, meeting_id = meeting
+    client = login(app, admin)
+    etag = client.get(f'/api/meeting/{meeting_id}').headers['ETag']
+    assert client.get(f'/api/meeting/{meeting_id}', headers={'If-None-Match': etag}).status_code == 304
+
+    rename(attendee_id, '新名字')
+
+    assert client.get(f'/api/meeting/{meeting_id}', headers={'If-None-Match': etag}).status_code == 200
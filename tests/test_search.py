@@ -0,0 +1,72 @@
+import pytest
+
+from conftest import login, make_meeting, make_person
+from main import db, search
+
+
+@pytest.fixture
+def documents(app):
+    search.index.update([
+        ('meeting:1', 1, '系務會議\n確認上次會議紀錄'),
+        ('motion:1', 1, '討論一百一十三學年度課程地圖'),
+        ('meeting:2', 2, '系課程委員會\nBudget review for the laboratory'),
+        ('meeting:3', 3, '招生暨學生事務委員會\n研究生招生名額'),
+    ])
+
+
+def meeting_ids(query, **kwargs):
+    rows, total = search.index.search(query, **kwargs)
+    assert total == len(rows)
+    return sorted(meeting_id for meeting_id, _ in rows)
+
+
+def test_cjk_bigrams_match_any_substring(documents):
+    assert meeting_ids('會議紀錄') == [1]
+    assert meeting_ids('課程') == [1, 2]
+    assert meeting_ids('議紀') == [1]
+    assert meeting_ids('紀議') == []
+
+
+def test_single_character_matches(documents):
+    assert meeting_ids('錄') == [1]
+    assert meeting_ids('招') == [3]
+
+
+def test_english_words_match_by_prefix(documents):
+    assert meeting_ids('budg') == [2]
+    assert meeting_ids('LABORATORY') == [2]
+    assert meeting_ids('laboratories') == []
+
+
+def test_meetings_outside_the_visible_set_are_filtered(documents):
+    assert meeting_ids('委員會') == [2, 3]
+    assert meeting_ids('委員會', meeting_ids=[3, 4]) == [3]
+    assert search.index.search('委員會', meeting_ids=[]) == ([], 0)
+
+
+def test_each_meeting_is_listed_once_across_pages(app):
+    search.index.update([(f'{kind}:{number}', number, f'預算審查 {number}')
+                         for number in range(1, 1201) for kind in ('meeting', 'motion')])
+
+    pages = [search.index.search('預算', page=page, per_page=500) for page in (1, 2, 3)]
+
+    assert [total for _, total in pages] == [1200, 1200, 1200]
+    found = [meeting_id for rows, _ in pages for meeting_id, _ in rows]
+    assert sorted(found) == list(range(1, 1201))
+
+
+def test_search_page_lists_only_visible_meetings(app):
+    attendee = make_person('李委員')
+    chair = make_person('王主席')
+    visible = make_meeting(chair, chair, attendees=[attendee])
+    make_meeting(chair, chair)
+    db.session.commit()
+    search.rebuild_index()
+    client = login(app, attendee)
+
+    response = client.get('/search', query_string={'query': '系務'})
+
+    assert response.status_code == 200
+    html = response.get_data(as_text=True)
+    assert f'/meeting/{visible.id}' in html
+    assert html.count('/meeting/') == 1
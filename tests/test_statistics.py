@@ -0,0 +1,76 @@
+from datetime import datetime
+from threading import Barrier, Thread
+
+import pytest
+
+from conftest import make_meeting, make_person
+from main import db, statistics
+from main.models import MeetingMonthlyCount, MeetingType, Motion, MotionStatusType, Person
+
+WRITERS = 4
+
+
+@pytest.fixture
+def chair(app):
+    chair = make_person('主席')
+    db.session.commit()
+    return chair.id
+
+
+def month_count(year, month):
+    return sum(row.count for row in MeetingMonthlyCount.query.filter_by(year=year, month=month))
+
+
+def test_summary_follows_each_change(app, chair):
+    person = Person.query.get(chair)
+    meeting = make_meeting(person, person, motions=2)
+    db.session.commit()
+    assert statistics.verify_summary() == []
+    assert month_count(2024, 3) == 1
+
+    meeting.time = datetime(2024, 5, 2, 10)
+    db.session.commit()
+    assert statistics.verify_summary() == []
+    assert (month_count(2024, 3), month_count(2024, 5)) == (0, 1)
+
+    meeting.type = MeetingType.FacultyEvaluation
+    meeting.motions[0].status = MotionStatusType.Closed
+    db.session.commit()
+    assert statistics.verify_summary() == []
+
+    db.session.delete(meeting.motions[1])
+    meeting.motions.append(Motion('新案由', '內容', MotionStatusType.InExecution, '', ''))
+    db.session.commit()
+    assert statistics.verify_summary() == []
+
+    db.session.delete(meeting)
+    db.session.commit()
+    assert statistics.verify_summary() == []
+    assert month_count(2024, 5) == 0
+
+
+def test_concurrent_writers_in_the_same_month_leave_no_drift(app, chair):
+    barrier = Barrier(WRITERS)
+    errors = []
+
+    def write(day):
+        with app.app_context():
+            try:
+                barrier.wait()
+                person = Person.query.get(chair)
+                make_meeting(person, person, time=datetime(2024, 3, day, 10))
+                db.session.commit()
+            except Exception as error:
+                errors.append(error)
+            finally:
+                db.session.remove()
+
+    threads = [Thread(target=write, args=(day,)) for day in range(1, WRITERS + 1)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert statistics.verify_summary() == []
+    assert month_count(2024, 3) == WRITERS
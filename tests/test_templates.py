@@ -0,0 +1,85 @@
+from datetime import datetime
+
+import pytest
+
+from conftest import login, make_person
+from main import db
+from main.models import Attendee, Meeting, MeetingTemplate, MeetingType, PersonType, template_guest_relations
+
+ATTENDEES = 40
+MEETINGS = 50
+
+
+@pytest.fixture
+def template(app):
+    """
+    40 位與會人員的模板，列席人員中重複列出一位與會人員與一位列席人員
+    """
+    admin = make_person('系助理', PersonType.Assistant)
+    chair = make_person('主席')
+    attendees = [make_person(f'委員{number}') for number in range(ATTENDEES)]
+    guest = make_person('列席人員')
+    template = MeetingTemplate(name='系務會議', title='系務會議', type=MeetingType.DeptAffairs,
+                               time=datetime(2024, 1, 1, 10), location='會議室', chair=chair, minute_taker=chair,
+                               attendees=attendees, guests=[guest])
+    db.session.add(template)
+    db.session.commit()
+    db.session.execute(template_guest_relations.insert(), [{'template_id': template.id, 'guest_id': guest.id},
+                                                           {'template_id': template.id,
+                                                            'guest_id': attendees[0].id}])
+    db.session.commit()
+    return login(app, admin), template.id
+
+
+def instantiate(client, template_id, **recurrence):
+    response = client.post(f'/template/{template_id}/instantiate',
+                           json={'start': '2024-02-05', 'end': '2024-02-26', **recurrence})
+    assert response.status_code == 200
+    return response.json
+
+
+def test_dry_run_writes_nothing(template):
+    client, template_id = template
+
+    result = instantiate(client, template_id, dryRun=True)
+
+    assert result['message'] == 'Preview'
+    assert [meeting['time'] for meeting in result['meetings']] == \
+        ['2024-02-05T10:00:00', '2024-02-12T10:00:00', '2024-02-19T10:00:00', '2024-02-26T10:00:00']
+    assert Meeting.query.count() == 0
+
+
+def test_existing_occurrences_are_skipped(template):
+    client, template_id = template
+    instantiate(client, template_id, end='2024-02-12')
+
+    result = instantiate(client, template_id)
+
+    assert [meeting['time'] for meeting in result['meetings']] == ['2024-02-19T10:00:00', '2024-02-26T10:00:00']
+    assert result['skipped'] == ['2024-02-05T10:00:00', '2024-02-12T10:00:00']
+    assert Meeting.query.count() == 4
+
+
+def test_attendees_and_guests_are_deduplicated(template):
+    client, template_id = template
+
+    result = instantiate(client, template_id, end='2024-02-05')
+
+    assert result['attendees'] == ATTENDEES + 1
+    meeting_id = result['meetings'][0]['id']
+    rows = Attendee.query.filter_by(meeting_id=meeting_id).all()
+    assert len(rows) == ATTENDEES + 1
+    assert sum(not row.is_member for row in rows) == 1
+
+
+def test_statement_count_does_not_grow_with_attendees(template, statements):
+    client, template_id = template
+    statements.clear()
+
+    result = instantiate(client, template_id, start='2024-01-01', end='2024-12-09')
+
+    assert len(result['meetings']) == MEETINGS
+    assert Attendee.query.count() == MEETINGS * (ATTENDEES + 1)
+    # 與會人員以單一 executemany 寫入；其餘為每場會議一個 INSERT，以及查詢與統計摘要等每月的更新（目前共 88 個）
+    assert sum(statement.startswith('INSERT INTO attendee') for statement in statements) == 1
+    assert len(statements) < 2 * MEETINGS
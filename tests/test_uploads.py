@@ -0,0 +1,50 @@
+import hashlib
+import io
+import os
+
+import pytest
+
+from conftest import make_person
+from main import db, uploads
+from main.models import Upload, PersonType
+
+
+@pytest.fixture
+def upload(app):
+    person = make_person('系助理', PersonType.Assistant)
+    db.session.commit()
+    upload_id, _ = uploads.create_upload('議程.pdf', 8, person.id)
+    return upload_id
+
+
+def content(upload_id):
+    with open(uploads.part_path(upload_id), 'rb') as file:
+        return file.read()
+
+
+def test_chunks_are_appended_in_order(upload):
+    assert uploads.write_chunk(Upload.query.get(upload), io.BytesIO(b'abcd')) == (4, False)
+    assert uploads.write_chunk(Upload.query.get(upload), io.BytesIO(b'efgh')) == (8, True)
+
+    assert content(upload) == b'abcdefgh'
+    assert Upload.query.get(upload).sha256 == hashlib.sha256(b'abcdefgh').hexdigest()
+
+
+def test_stale_writer_does_not_overwrite_received_content(upload):
+    # 兩個請求都讀到 offset 0，先取得 offset 的請求寫入，另一個請求放棄
+    first, second = Upload.query.get(upload), Upload(id=upload, offset=0, size=8)
+    assert uploads.write_chunk(first, io.BytesIO(b'abcd')) == (4, False)
+
+    assert uploads.write_chunk(second, io.BytesIO(b'wxyz')) is None
+
+    assert content(upload) == b'abcd'
+    assert Upload.query.get(upload).offset == 4
+    assert os.listdir(os.path.dirname(uploads.part_path(upload))) == [upload]
+
+
+def test_oversized_chunk_is_rejected(upload):
+    with pytest.raises(ValueError):
+        uploads.write_chunk(Upload.query.get(upload), io.BytesIO(b'x' * (2 * uploads.READ_SIZE)))
+
+    assert Upload.query.get(upload).offset == 0
+    assert content(upload) == b''